@@ -0,0 +1,136 @@
+import json
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchItemError(Exception):
+    """La respuesta del lote no trajo un resultado válido para este elemento."""
+
+
+class _Batch:
+    __slots__ = ("items", "futures", "full", "deadline")
+
+    def __init__(self, deadline: float):
+        self.items = []
+        self.futures = []
+        self.full = threading.Event()
+        self.deadline = deadline
+
+
+class MicroBatcher:
+    """Agrupa elementos enviados desde varios hilos en lotes de hasta ``max_size``.
+
+    El primer hilo de cada lote (líder) espera a que se llene o a que pasen
+    ``max_wait`` segundos y ejecuta ``run_batch(items)``, que debe retornar un
+    resultado (o una excepción) por elemento. Cada hilo recibe solo el suyo,
+    así un elemento fallido no arrastra al resto del lote.
+    """
+
+    def __init__(self, run_batch, max_size: int, max_wait: float):
+        self.run_batch = run_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._open: _Batch | None = None
+        self.batches = 0
+        self.items = 0
+        self.failed_batches = 0
+        self.failed_items = 0
+
+    def submit(self, item):
+        """Agrega ``item`` al lote abierto y bloquea hasta tener su resultado"""
+        future = Future()
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch(time.monotonic() + self.max_wait)
+            batch.items.append(item)
+            batch.futures.append(future)
+            if len(batch.items) >= self.max_size:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(timeout=max(batch.deadline - time.monotonic(), 0))
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: _Batch) -> None:
+        try:
+            self._resolve(batch)
+        finally:
+            # Un BaseException que no es Exception (p. ej. KeyboardInterrupt) sigue su curso en
+            # el hilo líder, pero los seguidores no pueden quedar esperando
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(BatchItemError("El lote se interrumpió"))
+
+    def _resolve(self, batch: _Batch) -> None:
+        try:
+            results = list(self.run_batch(list(batch.items)))
+        except Exception as exc:
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch.items)
+                self.failed_batches += 1
+            for future in batch.futures:
+                future.set_exception(exc)
+            return
+
+        failed = 0
+        for index, future in enumerate(batch.futures):
+            result = results[index] if index < len(results) else BatchItemError("Sin resultado en el lote")
+            if isinstance(result, BaseException):
+                failed += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch.items)
+            self.failed_items += failed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "failed_batches": self.failed_batches,
+                "failed_items": self.failed_items,
+            }
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_batch_reply(text: str, count: int) -> list[str | None]:
+    """Extrae las respuestas de ``{"respuestas": [{"id": n, "respuesta": ...}]}`` (ids desde 1).
+
+    Los elementos faltantes, vacíos o con id inválido quedan en None; si el
+    JSON no se puede leer, todos quedan en None.
+    """
+    replies = [None] * count
+    try:
+        data = json.loads(_FENCE.sub("", (text or "").strip()))
+    except ValueError:
+        return replies
+    entries = data.get("respuestas") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return replies
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        item_id = entry.get("id")
+        reply = entry.get("respuesta")
+        if isinstance(item_id, int) and 1 <= item_id <= count and isinstance(reply, str) and reply.strip():
+            replies[item_id - 1] = reply.strip()
+    return replies
@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Normaliza una pregunta para usarla como clave de caché.
+
+    Unifica la representación unicode y los espacios en blanco. No se cambia
+    a minúsculas porque las preguntas suelen incluir código, donde las
+    mayúsculas importan.
+    """
+    question = unicodedata.normalize("NFKC", question)
+    return _WHITESPACE.sub(" ", question).strip()
+
+
+def make_cache_key(question: str, prompt_version: str, model: str) -> str:
+    """Clave de caché: pregunta normalizada + versión del prompt + modelo"""
+    raw = f"{model}\x00{prompt_version}\x00{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheBackend:
+    """Persistencia en disco para que un pod reiniciado parta con la caché caliente.
+
+    Las escrituras se encolan y las aplica un hilo propio, agrupadas en una
+    transacción, para que ni ``/chat`` (event loop) ni los workers esperen al
+    disco. Lo encolado al momento de un crash se pierde; ``close`` lo escribe.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.batch_size = batch_size
+        self._pending: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, daemon=True, name="response-cache-writer")
+        self._writer.start()
+
+    def load(self, now: float):
+        """Entradas vigentes, de la más antigua a la más reciente"""
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self._conn.commit()
+        return self._conn.execute(
+            "SELECT key, value, expires_at FROM responses ORDER BY rowid"
+        ).fetchall()
+
+    def put(self, key: str, value: str, expires_at: float) -> None:
+        self._pending.put(("INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                           (key, value, expires_at)))
+
+    def delete(self, key: str) -> None:
+        self._pending.put(("DELETE FROM responses WHERE key = ?", (key,)))
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                for statement, args in (item for item in batch if item is not None):
+                    self._conn.execute(statement, args)
+                self._conn.commit()
+            except sqlite3.Error as exc:
+                logger.warning(f"No se pudo persistir la caché de respuestas: {exc}")
+            if stop:
+                return
+
+    def close(self) -> None:
+        """Escribe lo pendiente y cierra la base"""
+        if self._writer.is_alive():
+            self._pending.put(None)
+            self._writer.join()
+        self._conn.close()
+
+
+class ResponseCache:
+    """Caché LRU de respuestas del modelo, acotada por entradas y bytes, con TTL.
+
+    Es thread-safe: la usan tanto los workers del consumidor como ``/chat``.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024,
+                 ttl: float = 3600.0, backend: SQLiteCacheBackend = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._backend = backend
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, size)
+        self._entries: OrderedDict[str, tuple[str, float, int]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if backend is not None:
+            loaded = 0
+            for key, value, expires_at in backend.load(time.time()):
+                self._store(key, value, expires_at, persist=False)
+                loaded += 1
+            logger.info(f"Caché de respuestas cargada desde disco: {loaded} entradas")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._store(key, value, time.time() + self.ttl, persist=True)
+
+    def _store(self, key: str, value: str, expires_at: float, persist: bool) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+        if persist and self._backend is not None:
+            self._backend.put(key, value, expires_at)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        if self._backend is not None:
+            self._backend.delete(key)
+
+    def close(self) -> None:
+        if self._backend is not None:
+            self._backend.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": self._backend is not None,
+            }
@@ -0,0 +1,323 @@
+import heapq
+import importlib.util
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Códigos que vale la pena reintentar; el resto de los 4xx son errores permanentes
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+class CircuitBreaker:
+    """Circuit breaker simple: se abre tras N fallos seguidos y prueba de nuevo tras un tiempo.
+
+    En semiabierto deja pasar una sola petición de prueba (``acquire``) hasta
+    que se registre su resultado.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = self.CLOSED
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """Si el circuito acepta trabajo nuevo; no consume la prueba del semiabierto"""
+        return self.state != self.OPEN
+
+    def acquire(self) -> bool:
+        """Permiso para un intento: en semiabierto solo para la prueba en curso"""
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_at(self) -> float:
+        """Instante (monotonic) en que el circuito vuelve a dejar pasar peticiones"""
+        with self._lock:
+            return self._opened_at + self.reset_timeout
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Circuit breaker del servicio de mensajes ABIERTO")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+@dataclass
+class DeliveryJob:
+    thread_id: str
+    payload: dict
+    traceparent: str | None = None
+    # Datos de la pregunta para publicar la respuesta si se agotan los reintentos
+    context: dict = field(default_factory=dict)
+    attempts: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class MessagesDelivery:
+    """Entrega de respuestas al servicio de mensajes.
+
+    Mantiene un ``httpx.Client`` de larga vida (keep-alive, HTTP/2 si está
+    instalado ``h2``) y un outbox en memoria atendido por hilos en segundo
+    plano, con reintentos acotados, backoff exponencial con jitter y un
+    circuit breaker para cuando el servicio está caído.
+
+    Las entregas de un mismo thread salen de a una y en orden de llegada,
+    igual que en ``ConsumerWorkerPool``. Una entrega que agota sus reintentos
+    se pasa a ``on_give_up(job)`` en vez de perderse.
+    """
+
+    def __init__(self, base_url: str, bot_user_id: str, timeout: float = 30.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10.0,
+                 outbox_size: int = 1000, workers: int = 2, max_connections: int = 20,
+                 breaker: CircuitBreaker = None, on_give_up=None):
+        self.base_url = base_url.rstrip("/")
+        self.bot_user_id = bot_user_id
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.on_give_up = on_give_up
+        self.http2 = importlib.util.find_spec("h2") is not None
+        self._client = httpx.Client(
+            timeout=timeout,
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+        self._outbox: queue.Queue[DeliveryJob] = queue.Queue(maxsize=outbox_size)
+        self._delayed: list[tuple[float, int, DeliveryJob]] = []
+        self._sequence = itertools.count()
+        # thread_id con una entrega en curso -> entregas que esperan su turno
+        self._pending: dict[str, deque[DeliveryJob]] = {}
+        self._lock = threading.Lock()
+        # Un solo hilo a la vez saca del outbox y registra el thread, para que dos
+        # entregas del mismo thread no cambien de orden entre el get y el registro
+        self._intake = threading.Lock()
+        self._stopped = threading.Event()
+        self._workers = workers
+        self._threads: list[threading.Thread] = []
+
+        self.delivered = 0
+        self.retried = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def _post(self, job: DeliveryJob) -> httpx.Response:
+        url = f"{self.base_url}/threads/{job.thread_id}/messages"
+        headers = {
+            "X-User-Id": self.bot_user_id,  # Usar el user_id del bot
+            "Content-Type": "application/json",
+        }
+        if job.traceparent:
+            headers["traceparent"] = job.traceparent
+        return self._client.post(url, json=job.payload, headers=headers)
+
+    def _attempt(self, job: DeliveryJob) -> bool | None:
+        """Un intento de entrega. True: entregado, False: error permanente, None: reintentable"""
+        job.attempts += 1
+        try:
+            response = self._post(job)
+        except httpx.RequestError as e:
+            logger.error(f"Error de conexión al servicio de mensajes: {e}")
+            self.breaker.record_failure()
+            return None
+
+        retryable = response.status_code >= 500 or response.status_code in RETRYABLE_STATUS
+        if not retryable:
+            # El servicio respondió: también un 4xx cierra el circuito (y libera la prueba)
+            self.breaker.record_success()
+        if response.is_success:
+            with self._lock:
+                self.delivered += 1
+            return True
+
+        logger.error(f"❌ Error al enviar respuesta: {response.status_code}")
+        logger.error(f"Response: {response.text}")
+        if retryable:
+            self.breaker.record_failure()
+            return None
+        return False
+
+    def send(self, thread_id: str, payload: dict, traceparent: str = None) -> bool:
+        """Entrega síncrona (un intento) usando el pool de conexiones"""
+        if not self.breaker.acquire():
+            logger.warning("Circuit breaker abierto, no se intenta la entrega")
+            return False
+        return bool(self._attempt(DeliveryJob(thread_id, payload, traceparent)))
+
+    def enqueue(self, thread_id: str, payload: dict, traceparent: str = None, context: dict = None) -> bool:
+        """Agrega la entrega al outbox. Retorna False si el circuito está abierto o el outbox lleno"""
+        self.start()
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            return False
+        try:
+            self._outbox.put_nowait(DeliveryJob(thread_id, payload, traceparent, context or {}))
+        except queue.Full:
+            logger.warning("Outbox de entregas lleno")
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def backoff(self, attempts: int) -> float:
+        """Backoff exponencial con jitter completo"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempts)))
+
+    def _schedule(self, job: DeliveryJob, ready_at: float) -> None:
+        with self._lock:
+            heapq.heappush(self._delayed, (ready_at, next(self._sequence), job))
+
+    def _next_job(self) -> DeliveryJob | None:
+        with self._lock:
+            now = time.monotonic()
+            if self._delayed and self._delayed[0][0] <= now:
+                return heapq.heappop(self._delayed)[2]
+            wait = min(self._delayed[0][0] - now, 0.5) if self._delayed else 0.5
+        if not self._intake.acquire(timeout=wait):
+            return None
+        try:
+            job = self._outbox.get(timeout=wait)
+        except queue.Empty:
+            return None
+        else:
+            with self._lock:
+                if job.thread_id in self._pending:
+                    # Hay una entrega anterior del thread en curso o esperando reintento
+                    self._pending[job.thread_id].append(job)
+                    return None
+                self._pending[job.thread_id] = deque()
+            return job
+        finally:
+            self._intake.release()
+
+    def _finish(self, job: DeliveryJob) -> None:
+        """Libera el thread del job; su siguiente entrega queda lista para cualquier hilo"""
+        with self._lock:
+            waiting = self._pending[job.thread_id]
+            if waiting:
+                heapq.heappush(self._delayed, (time.monotonic(), next(self._sequence), waiting.popleft()))
+            else:
+                del self._pending[job.thread_id]
+
+    def _give_up(self, job: DeliveryJob) -> None:
+        with self._lock:
+            self.dropped += 1
+        logger.error(
+            f"Entrega descartada tras {job.attempts} intentos - Thread ID: {job.thread_id}, "
+            f"respuesta de {len(job.payload.get('content') or '')} caracteres"
+        )
+        if self.on_give_up is None:
+            return
+        try:
+            self.on_give_up(job)
+        except Exception as e:
+            logger.error(f"Error al derivar la entrega descartada: {e}")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            job = self._next_job()
+            if job is None:
+                continue
+
+            if not self.breaker.acquire():
+                # Esperar a que el circuito (o la prueba en curso) deje pasar peticiones sin gastar intentos
+                self._schedule(job, max(self.breaker.retry_at(), time.monotonic() + 0.1))
+                continue
+
+            result = self._attempt(job)
+            if result is None and job.attempts <= self.max_retries:
+                with self._lock:
+                    self.retried += 1
+                self._schedule(job, time.monotonic() + self.backoff(job.attempts))
+                continue
+            if not result:
+                self._give_up(job)
+            self._finish(job)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"delivery-outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def drain(self, timeout: float) -> bool:
+        """Espera (hasta ``timeout``) a que el outbox se vacíe y cierra; False si quedaron entregas"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                pending = self._outbox.qsize() + len(self._pending)
+            if not pending or not self._threads:
+                break
+            time.sleep(0.05)
+        with self._lock:
+            pending = self._outbox.qsize() + len(self._pending) + sum(map(len, self._pending.values()))
+        if pending:
+            logger.warning(f"Apagado con {pending} entregas pendientes en el outbox")
+        self.close()
+        return not pending
+
+    def close(self) -> None:
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._client.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "http2": self.http2,
+                "circuit": self.breaker.state,
+                "outbox": self._outbox.qsize(),
+                "scheduled_retries": len(self._delayed),
+                "waiting_on_thread": sum(map(len, self._pending.values())),
+                "delivered": self.delivered,
+                "retried": self.retried,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+            }
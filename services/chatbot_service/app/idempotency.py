@@ -0,0 +1,286 @@
+import hashlib
+import logging
+import math
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+def message_key(question_id: str | None, thread_id: str | None, body: bytes) -> str:
+    """Clave de idempotencia: id del mensaje (y su thread); sin id, la huella del cuerpo"""
+    if question_id and question_id != "unknown":
+        return f"{thread_id or ''}:{question_id}"
+    return "sha256:" + hashlib.sha256(body).hexdigest()
+
+
+class BloomFilter:
+    """Filtro de Bloom de tamaño fijo para ``capacity`` claves con tasa de falsos positivos ``error_rate``"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class RotatingBloomFilter:
+    """Dos generaciones de ``BloomFilter``: al llenarse la actual pasa a ser la anterior.
+
+    Mantiene la memoria y la tasa de falsos positivos acotadas recordando
+    entre ``capacity`` y ``2 * capacity`` claves recientes.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous: BloomFilter | None = None
+        self.rotations = 0
+
+    def add(self, key: str) -> None:
+        if self._current.full:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self.rotations += 1
+        self._current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._current or (self._previous is not None and key in self._previous)
+
+    @property
+    def bytes(self) -> int:
+        return len(self._current._bits) * (2 if self._previous is not None else 1)
+
+
+@dataclass
+class IdempotencyRecord:
+    reply: str | None
+    done: bool
+    expires_at: float
+
+
+class SQLiteIdempotencyBackend:
+    """Registro en disco compartible entre procesos del mismo nodo (p. ej. un volumen común).
+
+    Sobrevive al reinicio del pod: una reentrega tras un crash encuentra la
+    respuesta ya generada. Como en la caché de respuestas, las escrituras se
+    encolan y las aplica un hilo propio, agrupadas en una transacción, para
+    que los workers no esperen al disco; mientras tanto ``get`` las ve desde
+    memoria. Lo encolado al momento de un crash se pierde (la reentrega vuelve
+    a llamar al modelo); ``close`` lo escribe.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256):
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            "key TEXT PRIMARY KEY, reply TEXT, done INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.batch_size = batch_size
+        # La conexión la comparten el hilo escritor y las lecturas de los workers
+        self._conn_lock = threading.Lock()
+        self._unflushed: dict[str, IdempotencyRecord] = {}
+        self._unflushed_lock = threading.Lock()
+        self._pending: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, daemon=True, name="idempotency-writer")
+        self._writer.start()
+
+    def get(self, key: str, now: float) -> IdempotencyRecord | None:
+        with self._unflushed_lock:
+            record = self._unflushed.get(key)
+        if record is not None:
+            return record if record.expires_at > now else None
+        with self._conn_lock:
+            row = self._conn.execute(
+                "SELECT reply, done, expires_at FROM idempotency WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return IdempotencyRecord(row[0], bool(row[1]), row[2])
+
+    def put(self, key: str, record: IdempotencyRecord) -> None:
+        with self._unflushed_lock:
+            self._unflushed[key] = record
+        self._pending.put(("INSERT OR REPLACE INTO idempotency (key, reply, done, expires_at) VALUES (?, ?, ?, ?)",
+                           (key, record.reply, int(record.done), record.expires_at), key, record))
+
+    def keys(self, now: float):
+        """Purga lo vencido y retorna las claves vigentes (para poblar el filtro de Bloom)"""
+        with self._conn_lock:
+            self._conn.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+            return [row[0] for row in self._conn.execute("SELECT key FROM idempotency ORDER BY rowid")]
+
+    def purge(self, now: float) -> None:
+        self._pending.put(("DELETE FROM idempotency WHERE expires_at <= ?", (now,), None, None))
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            writes = [item for item in batch if item is not None]
+            try:
+                with self._conn_lock:
+                    for statement, args, _, _ in writes:
+                        self._conn.execute(statement, args)
+                    self._conn.commit()
+            except sqlite3.Error as exc:
+                logger.warning(f"No se pudo persistir el registro de idempotencia: {exc}")
+            with self._unflushed_lock:
+                for _, _, key, record in writes:
+                    # Solo si no llegó una escritura más reciente de la misma clave
+                    if key is not None and self._unflushed.get(key) is record:
+                        del self._unflushed[key]
+            if stop:
+                return
+
+    def close(self) -> None:
+        """Escribe lo pendiente y cierra la base"""
+        if self._writer.is_alive():
+            self._pending.put(None)
+            self._writer.join()
+        self._conn.close()
+
+
+class IdempotencyStore:
+    """Registro de mensajes ya procesados, para que una reentrega no repita la llamada al modelo ni la entrega.
+
+    - ``record_reply`` guarda la respuesta apenas se genera; si el pod muere
+      antes del ack, la reentrega la reutiliza sin llamar al modelo.
+    - ``mark_done`` marca el mensaje como entregado (y suelta la respuesta);
+      una reentrega posterior solo se confirma.
+    - En memoria: LRU acotado a ``max_entries`` registros con TTL.
+    - Con ``backend`` (SQLite): las claves se agregan además a un filtro de
+      Bloom rotativo, que evita consultar el disco por los mensajes nuevos (el
+      caso común). Los mensajes que RabbitMQ marca como ``redelivered`` se
+      consultan siempre, porque otra réplica pudo haberlos registrado.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 86400.0,
+                 bloom_capacity: int = 100000, bloom_error_rate: float = 0.01,
+                 backend: SQLiteIdempotencyBackend = None, purge_every: int = 1000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._backend = backend
+        self.purge_every = purge_every
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, IdempotencyRecord] = OrderedDict()
+        self._bloom = RotatingBloomFilter(bloom_capacity, bloom_error_rate) if backend is not None else None
+        self._writes = 0
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.bloom_skips = 0
+
+        if backend is not None:
+            keys = backend.keys(time.time())
+            for key in keys:
+                self._bloom.add(key)
+            logger.info(f"Registro de idempotencia cargado desde disco: {len(keys)} claves")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str, redelivered: bool = False) -> IdempotencyRecord | None:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            record = self._entries.get(key)
+            if record is not None and record.expires_at <= now:
+                del self._entries[key]
+                record = None
+            if record is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return record
+            if self._backend is None:
+                self.misses += 1
+                return None
+            if not redelivered and key not in self._bloom:
+                self.bloom_skips += 1
+                self.misses += 1
+                return None
+            record = self._backend.get(key, now)
+            if record is None:
+                self.misses += 1
+                return None
+            self.backend_hits += 1
+            self._remember(key, record)
+            return record
+
+    def record_reply(self, key: str, reply: str) -> None:
+        self._put(key, reply, done=False)
+
+    def mark_done(self, key: str) -> None:
+        self._put(key, None, done=True)
+
+    def _put(self, key: str, reply: str | None, done: bool) -> None:
+        if not self.enabled:
+            return
+        record = IdempotencyRecord(reply, done, time.time() + self.ttl)
+        with self._lock:
+            self._remember(key, record)
+            if self._backend is not None:
+                self._bloom.add(key)
+                self._backend.put(key, record)
+                self._writes += 1
+                if self._writes % self.purge_every == 0:
+                    self._backend.purge(time.time())
+
+    def close(self) -> None:
+        if self._backend is not None:
+            self._backend.close()
+
+    def _remember(self, key: str, record: IdempotencyRecord) -> None:
+        self._entries[key] = record
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "bloom_skips": self.bloom_skips,
+                "bloom_bytes": self._bloom.bytes if self._bloom is not None else 0,
+                "persistent": self._backend is not None,
+            }
@@ -0,0 +1,275 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from google.genai import errors
+
+
+# Mínimo de tokens que Gemini 2.5 Flash acepta para un contenido en caché
+MIN_CACHE_TOKENS = 1024
+
+
+def count_tokens(text: str) -> int:
+    """Conteo aproximado de tokens (~4 caracteres por token)"""
+    return len(text) // 4 + 1 if text else 0
+
+
+def _contents_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(_contents_text(part) for part in contents)
+    return str(getattr(contents, "text", "") or contents)
+
+
+class FakeLLMBackend:
+    """Backend local que imita la interfaz de ``genai.Client`` usada por el servicio.
+
+    Permite correr el pipeline sin la API de Gemini: latencia log-normal
+    configurable (más un costo por token generado), tasa de errores (503 o
+    429 con ``retryDelay``) y de respuestas vacías, y un registro de los
+    tokens recibidos. Con ``response_mime_type="application/json"`` responde
+    los micro-lotes del consumidor, y ``caches`` imita el contenido en caché
+    (los tokens en caché se cuentan aparte y no pagan ``ms_per_prompt_token``).
+    Sin ``thinking_config`` el modelo razona ``thinking_tokens`` tokens (con
+    un ``thinking_budget`` usa a lo sumo ese presupuesto), que cuestan como
+    tokens generados y cuentan para ``max_output_tokens``: si se supera, la
+    respuesta se trunca con ``finish_reason=MAX_TOKENS``.
+    Se activa con ``GEMINI_BACKEND=fake``.
+    """
+
+    def __init__(self, latency_ms: float = 200.0, latency_sigma: float = 0.3,
+                 error_rate: float = 0.0, error_code: int = 503, retry_after: float = None,
+                 empty_rate: float = 0.0, reply_chars: int = 400, ms_per_output_token: float = 0.0,
+                 ms_per_prompt_token: float = 0.0, min_cache_tokens: int = MIN_CACHE_TOKENS,
+                 thinking_tokens: int = 0,
+                 seed: int = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.retry_after = retry_after
+        self.empty_rate = empty_rate
+        self.reply_chars = reply_chars
+        self.ms_per_output_token = ms_per_output_token
+        self.ms_per_prompt_token = ms_per_prompt_token
+        self.min_cache_tokens = min_cache_tokens
+        self.thinking_tokens = thinking_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.total_thinking_tokens = 0
+        self.truncated = 0
+        self._caches: dict[str, SimpleNamespace] = {}
+
+        self.models = SimpleNamespace(generate_content=self.generate_content, get=self.get_model)
+        self.caches = SimpleNamespace(
+            create=self.create_cache,
+            update=self.update_cache,
+            list=self.list_caches,
+            delete=self.delete_cache,
+        )
+        self.aio = SimpleNamespace(models=SimpleNamespace(
+            generate_content=self.generate_content_async,
+            generate_content_stream=self.generate_content_stream_async,
+        ))
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMBackend":
+        retry_after = os.getenv("FAKE_LLM_RETRY_AFTER")
+        return cls(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "200")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            error_code=int(os.getenv("FAKE_LLM_ERROR_CODE", "503")),
+            retry_after=float(retry_after) if retry_after else None,
+            empty_rate=float(os.getenv("FAKE_LLM_EMPTY_RATE", "0")),
+        )
+
+    def configure(self, **settings) -> None:
+        for key, value in settings.items():
+            if not hasattr(self, key):
+                raise AttributeError(key)
+            setattr(self, key, value)
+
+    def create_cache(self, model: str, config=None):
+        system = getattr(config, "system_instruction", None)
+        tokens = count_tokens(_contents_text(system) if system else "")
+        if tokens < self.min_cache_tokens:
+            raise errors.ClientError(400, {"error": {
+                "code": 400, "status": "INVALID_ARGUMENT",
+                "message": f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.min_cache_tokens}",
+            }})
+        cache = SimpleNamespace(
+            name=f"cachedContents/{uuid.uuid4().hex[:12]}",
+            model=f"models/{model}",
+            display_name=getattr(config, "display_name", None),
+            expire_time=None,
+            tokens=tokens,
+        )
+        self._set_ttl(cache, getattr(config, "ttl", None))
+        with self._lock:
+            self._caches[cache.name] = cache
+        return cache
+
+    @staticmethod
+    def _set_ttl(cache, ttl: str | None) -> None:
+        seconds = float((ttl or "3600s").rstrip("s"))
+        cache.expire_time = datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+    def _get_cache(self, name: str):
+        with self._lock:
+            cache = self._caches.get(name)
+            if cache is not None and cache.expire_time <= datetime.now(timezone.utc):
+                del self._caches[name]
+                cache = None
+        if cache is None:
+            raise errors.ClientError(404, {"error": {"code": 404, "status": "NOT_FOUND",
+                                                     "message": f"CachedContent not found: {name}"}})
+        return cache
+
+    def update_cache(self, name: str, config=None):
+        cache = self._get_cache(name)
+        self._set_ttl(cache, getattr(config, "ttl", None))
+        return cache
+
+    def list_caches(self, config=None):
+        with self._lock:
+            return list(self._caches.values())
+
+    def delete_cache(self, name: str, config=None):
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def _plan(self, model: str, contents, config) -> tuple[float, Exception | None, object]:
+        """Decide latencia, error y respuesta de una llamada"""
+        prompt = _contents_text(contents)
+        system = getattr(config, "system_instruction", None) if config is not None else None
+        prompt_tokens = count_tokens(prompt) + count_tokens(_contents_text(system) if system else "")
+        cached_name = getattr(config, "cached_content", None) if config is not None else None
+        cached_tokens = self._get_cache(cached_name).tokens if cached_name else 0
+
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            latency = self._random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+            latency += prompt_tokens * self.ms_per_prompt_token / 1000
+            fail = self._random.random() < self.error_rate
+            empty = not fail and self._random.random() < self.empty_rate
+            if fail:
+                self.errors += 1
+
+        if fail:
+            return latency, self._error(), None
+
+        json_output = getattr(config, "response_mime_type", None) == "application/json"
+        if empty:
+            text = ""
+        elif json_output:
+            text = self._batch_reply(model, prompt)
+        else:
+            text = self._reply(model, prompt)
+        thinking_config = getattr(config, "thinking_config", None) if config is not None else None
+        budget = getattr(thinking_config, "thinking_budget", None)
+        thinking = self.thinking_tokens if budget is None or budget < 0 else min(budget, self.thinking_tokens)
+        max_tokens = getattr(config, "max_output_tokens", None) if config is not None else None
+        thinking = min(thinking, max_tokens) if max_tokens else thinking
+        finish_reason = "STOP"
+        if max_tokens and thinking + count_tokens(text) > max_tokens:
+            text = text[:(max_tokens - thinking) * 4]
+            finish_reason = "MAX_TOKENS"
+        output_tokens = count_tokens(text)
+        latency += (output_tokens + thinking) * self.ms_per_output_token / 1000
+        with self._lock:
+            self.output_tokens += output_tokens
+            self.total_thinking_tokens += thinking
+            self.truncated += finish_reason == "MAX_TOKENS"
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens + cached_tokens,
+            cached_content_token_count=cached_tokens,
+            candidates_token_count=output_tokens,
+            thoughts_token_count=thinking,
+            total_token_count=prompt_tokens + cached_tokens + output_tokens + thinking,
+        )
+        candidates = [SimpleNamespace(finish_reason=finish_reason)]
+        return latency, None, SimpleNamespace(text=text, usage_metadata=usage, candidates=candidates)
+
+    def _reply(self, model: str, prompt: str) -> str:
+        question = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+        reply = f"[{model}] Respuesta simulada a: {question}\n"
+        return (reply + "x" * self.reply_chars)[:max(self.reply_chars, len(reply))]
+
+    def _batch_reply(self, model: str, prompt: str) -> str:
+        """Responde un micro-lote: la última línea del prompt es la lista JSON de mensajes"""
+        try:
+            items = json.loads(prompt.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return "{}"
+        answers = [{"id": item["id"], "respuesta": self._reply(model, item["mensaje"])} for item in items]
+        return json.dumps({"respuestas": answers}, ensure_ascii=False)
+
+    def _error(self) -> Exception:
+        if self.error_code == 429:
+            details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                        "retryDelay": f"{self.retry_after or 1}s"}]
+            return errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                      "message": "Quota exceeded", "details": details}})
+        return errors.ServerError(self.error_code, {"error": {"code": self.error_code, "status": "UNAVAILABLE",
+                                                              "message": "Backend simulado no disponible"}})
+
+    def get_model(self, model: str):
+        """Imita ``models.get``: metadatos del modelo, sin latencia ni errores"""
+        return SimpleNamespace(name=f"models/{model}")
+
+    def generate_content(self, model: str, contents, config=None):
+        latency, error, response = self._plan(model, contents, config)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    async def generate_content_async(self, model: str, contents, config=None):
+        latency, error, response = self._plan(model, contents, config)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return response
+
+    async def generate_content_stream_async(self, model: str, contents, config=None):
+        latency, error, response = self._plan(model, contents, config)
+
+        async def chunks():
+            # El primer fragmento llega tras una fracción de la latencia total
+            await asyncio.sleep(latency * 0.2)
+            if error is not None:
+                raise error
+            text = response.text
+            step = max(len(text) // 4, 1)
+            for start in range(0, len(text), step):
+                yield SimpleNamespace(text=text[start:start + step], usage_metadata=response.usage_metadata,
+                                      candidates=response.candidates)
+                await asyncio.sleep(latency * 0.2)
+
+        return chunks()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "output_tokens": self.output_tokens,
+                "thinking_tokens": self.total_thinking_tokens,
+                "truncated": self.truncated,
+            }
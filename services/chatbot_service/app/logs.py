@@ -0,0 +1,101 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_payload_sample_rate = 0.0
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo que registra.
+
+    ``QueueHandler.prepare`` por defecto aplica el formatter antes de encolar;
+    aquí solo se resuelven los argumentos del mensaje y el formateo (texto o
+    JSON) queda para el hilo del ``QueueListener``.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """Formato de texto clásico; los campos de un evento se agregan como clave=valor"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items() if value is not None)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea, con los campos del evento al primer nivel"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            payload.update(fields)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(log_format: str = "text", level: str = "INFO",
+                      payload_sample_rate: float = 0.0) -> logging.handlers.QueueListener:
+    """Configura el logging raíz con entrega no bloqueante (QueueHandler + QueueListener).
+
+    ``log_format`` es ``text`` (formato original) o ``json`` (un evento por línea).
+    """
+    global _payload_sample_rate
+    _payload_sample_rate = payload_sample_rate
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_LazyQueueHandler(log_queue)]
+    root.setLevel(level)
+    return listener
+
+
+def sample_payload() -> bool:
+    """Indica si este evento debe incluir el contenido (pregunta/respuesta)"""
+    return _payload_sample_rate > 0 and random.random() < _payload_sample_rate
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields) -> None:
+    """Registra un evento estructurado de una etapa del pipeline.
+
+    Si el nivel está deshabilitado no se construye nada; los campos se
+    formatean recién en el hilo del listener.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def elapsed_ms(started: float) -> float:
+    """Milisegundos transcurridos desde ``started`` (time.perf_counter)"""
+    return round((time.perf_counter() - started) * 1000, 2)
@@ -1,21 +1,49 @@
+import asyncio
 import logging
 import os
+import secrets
 import time
 import json
+import socket
 import threading
 from functools import lru_cache
-import httpx
 import uuid
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
 from google import genai
-from pydantic import BaseModel
+from google.genai import errors, types
+from pydantic import BaseModel, Field
 import pika
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-# Configurar logging para que muestre mensajes INFO
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from .batching import BatchItemError, MicroBatcher, parse_batch_reply
+from .cache import ResponseCache, SQLiteCacheBackend, make_cache_key
+from .delivery import CircuitBreaker, MessagesDelivery
+from .idempotency import IdempotencyStore, SQLiteIdempotencyBackend, message_key
+from .llm_backends import FakeLLMBackend
+from .logs import configure_logging, elapsed_ms, log_event, sample_payload
+from . import envelope, metrics, tracing
+from .profiles import (
+    DEFAULT_PROFILES, UNBOUNDED, GenerationProfile, classify, combine, parse_profile, thinking_budget_for,
+)
+from .prompt_cache import PromptCacheManager
+from .ratelimit import GeminiLimiter, LimiterTimeout
+from .replay import ERROR_HEADER, ReplayFilter, ReplayJob
+from .retry import choose_retry_delay, parse_delays, retry_after_hint, retry_queue_name
+from .router import ModelRouter, parse_models
+from .sharding import ShardCoordinator, shard_queue_name
+from .singleflight import SingleFlight
+from .supervisor import ConsumerSupervisor
+from .usage import BudgetExceeded, UsageLedger, current_scope, usage_scope
+from .worker_pool import ConsumerWorkerPool, Lane, ThreadSafeChannel
+
+# Configurar logging: LOG_FORMAT=text (formato original) o json (un evento por línea).
+# El contenido de preguntas/respuestas solo se registra para una muestra (LOG_PAYLOAD_SAMPLE_RATE)
+configure_logging(
+    log_format=os.getenv("LOG_FORMAT", "text"),
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    payload_sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0")),
 )
 logger = logging.getLogger(__name__)
 
@@ -25,7 +53,12 @@ app = FastAPI(
     version="2.0.0",
 )
 
-PROMPT_TEMPLATE = """Actúa como un asistente experto en programación. Recibirás un mensaje de un usuario que puede contener una pregunta técnica, una solicitud de ejemplo de código, o una duda sobre un concepto de programación.
+# Incrementar al modificar SYSTEM_INSTRUCTION o PROMPT_TEMPLATE para invalidar las respuestas en caché
+PROMPT_VERSION = "2"
+
+# Parte fija del prompt: se envía como instrucción de sistema y se registra una sola vez
+# como contenido en caché de Gemini (ver PromptCacheManager)
+SYSTEM_INSTRUCTION = """Actúa como un asistente experto en programación. Recibirás un mensaje de un usuario que puede contener una pregunta técnica, una solicitud de ejemplo de código, o una duda sobre un concepto de programación.
 
 Tu tarea es analizar el mensaje y responder de la siguiente manera:
 
@@ -48,11 +81,21 @@ Tu tarea es analizar el mensaje y responder de la siguiente manera:
 2.  Genera una respuesta precisa y útil, eligiendo entre una explicación, un snippet de código, o una combinación de ambos.
 3.  Mantén el tono profesional y servicial.
 4.  No incluyas explicaciones innecesarias; sé directo y al punto.
+"""
 
-Mensaje del usuario:
+# Parte variable: lo único que se envía en cada petición
+PROMPT_TEMPLATE = """Mensaje del usuario:
 {mensaje}
 """
 
+# Variante para micro-lotes: una respuesta JSON por mensaje
+BATCH_PROMPT_TEMPLATE = """**Modo lote:** recibirás varios mensajes independientes, cada uno con un `id`.
+Responde cada uno por separado siguiendo tus instrucciones y devuelve únicamente un objeto JSON con la forma {{"respuestas": [{{"id": <id>, "respuesta": "<tu respuesta>"}}]}}, con una entrada por cada `id`.
+
+Mensajes (JSON):
+{mensajes}
+"""
+
 # Configuración RabbitMQ
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
@@ -65,14 +108,138 @@ RESPONSES_QUEUE = os.getenv("RESPONSES_QUEUE", "gemini_responses")
 FAILED_QUESTIONS_QUEUE = os.getenv("FAILED_QUESTIONS_QUEUE", "failed_questions_queue")
 FAILED_RESPONSES_QUEUE = os.getenv("FAILED_RESPONSES_QUEUE", "failed_responses_queue")
 
+# Serialización de los mensajes que publica este servicio (application/json o application/msgpack)
+ENVELOPE_CONTENT_TYPE = os.getenv("ENVELOPE_CONTENT_TYPE", envelope.JSON)
+
 # Configuración DLX
 DLX_EXCHANGE = os.getenv("DLX_EXCHANGE", "dlx_exchange")
 MAX_RETRIES = 3
 
+# Reintentos diferidos: colas <cola>.retry.N con TTL que devuelven el mensaje a la cola de trabajo.
+# RETRY_DELAYS define el TTL (segundos) de cada nivel; deben coincidir con definitions.json
+RETRY_DELAYS = parse_delays(os.getenv("RETRY_DELAYS", "5,30,120"))
+RETRY_DELAY_ENABLED = os.getenv("RETRY_DELAY_ENABLED", "true").lower() == "true"
+
+# Reproceso de las DLQ: mensajes por segundo y backlog de la cola de trabajo sobre el cual se pausa
+REPLAY_RATE = float(os.getenv("REPLAY_RATE", "5"))
+REPLAY_MAX_BACKLOG = int(os.getenv("REPLAY_MAX_BACKLOG", "50"))
+# Los endpoints /admin exigen el header X-Admin-Token; sin token quedan desactivados
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Consumo particionado entre réplicas: SHARD_COUNT colas <cola>.shard.N (0 = una sola cola compartida).
+# Los mensajes de un mismo thread caen en el mismo shard y cada shard tiene un único consumidor activo
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+REPLICA_ID = os.getenv("REPLICA_ID") or socket.gethostname()
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", "5"))
+SHARD_MEMBER_TIMEOUT = float(os.getenv("SHARD_MEMBER_TIMEOUT", "15"))
+
+# Reconexión del consumidor (backoff exponencial con jitter) y plazo para terminar lo que está
+# en proceso al apagarse (debe ser menor que terminationGracePeriodSeconds)
+CONSUMER_RECONNECT_BASE = float(os.getenv("CONSUMER_RECONNECT_BASE", "1"))
+CONSUMER_RECONNECT_MAX = float(os.getenv("CONSUMER_RECONNECT_MAX", "60"))
+SHUTDOWN_GRACE_PERIOD = float(os.getenv("SHUTDOWN_GRACE_PERIOD", "25"))
+
+# Micro-lotes del consumidor: agrupa hasta MICRO_BATCH_SIZE preguntas (o las que lleguen en
+# MICRO_BATCH_WAIT_MS) en una sola llamada al modelo. 1 lo desactiva; requiere CONSUMER_WORKERS >= tamaño
+MICRO_BATCH_SIZE = int(os.getenv("MICRO_BATCH_SIZE", "1"))
+MICRO_BATCH_WAIT_MS = float(os.getenv("MICRO_BATCH_WAIT_MS", "50"))
+
+# Configuración del pool de workers del consumidor.
+# Con CONSUMER_WORKERS=1 se mantiene el modo síncrono original (un mensaje a la vez).
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "1"))
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", str(CONSUMER_WORKERS)))
+# Los heartbeats de los shards corren en el hilo de la conexión: en modo síncrono el callback lo
+# ocupa durante toda la llamada a Gemini, los pares dan por muerta a la réplica y los shards rotan
+if SHARD_COUNT > 0 and CONSUMER_WORKERS <= 1:
+    raise ValueError(f"SHARD_COUNT={SHARD_COUNT} requiere el pool de workers (CONSUMER_WORKERS > 1)")
+
+# Carriles de prioridad: las preguntas de quiz_service llegan a BULK_QUESTIONS_QUEUE (vacío = sin
+# carril bulk) y comparten el pool con las de los threads por round-robin ponderado. El carril
+# bulk ocupa a lo sumo BULK_MAX_WORKERS workers (0 = 3/4 del pool) y un mensaje bulk que espera
+# más de BULK_MAX_WAIT segundos pasa primero
+BULK_QUEUE = os.getenv("BULK_QUESTIONS_QUEUE", f"{QUESTIONS_QUEUE}.bulk")
+BULK_PREFETCH = int(os.getenv("BULK_PREFETCH", str(CONSUMER_PREFETCH)))
+LANE_INTERACTIVE_WEIGHT = int(os.getenv("LANE_INTERACTIVE_WEIGHT", "4"))
+LANE_BULK_WEIGHT = int(os.getenv("LANE_BULK_WEIGHT", "1"))
+BULK_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", "0"))
+BULK_MAX_WAIT = float(os.getenv("BULK_MAX_WAIT", "30"))
+
 # Configuración del servicio de mensajes
 MESSAGES_SERVICE_URL = os.getenv("MESSAGES_SERVICE_URL", "http://localhost:3000")
 CHATBOT_USER_ID = os.getenv("CHATBOT_USER_ID", "00000000-0000-0000-0000-000000000000") # UUID para el bot
 
+# Entrega de respuestas: "sync" (un intento en línea) u "outbox" (cola en memoria con reintentos)
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "sync")
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "3"))
+DELIVERY_OUTBOX_SIZE = int(os.getenv("DELIVERY_OUTBOX_SIZE", "1000"))
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "2"))
+DELIVERY_BREAKER_THRESHOLD = int(os.getenv("DELIVERY_BREAKER_THRESHOLD", "5"))
+DELIVERY_BREAKER_RESET = float(os.getenv("DELIVERY_BREAKER_RESET", "30"))
+# Si la entrega no es posible, publicar la respuesta en RESPONSES_QUEUE
+DELIVERY_SPILLOVER = os.getenv("DELIVERY_SPILLOVER", "true").lower() == "true"
+
+# Configuración de Gemini y del endpoint /chat
+# GEMINI_BACKEND=fake usa un backend local simulado (benchmarks y pruebas sin API key)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "gemini")
+# Modelos en orden de preferencia, con deadline opcional en segundos: "modelo[:deadline],..."
+GEMINI_MODELS = parse_models(
+    os.getenv("GEMINI_MODELS", "gemini-2.5-flash"),
+    default_deadline=float(os.getenv("GEMINI_DEADLINE", "60")),
+)
+GEMINI_MODEL = GEMINI_MODELS[0].name
+# Hedging: segundo intento si el primero supera este percentil de su latencia (0 lo desactiva)
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "0.5"))
+GEMINI_HEDGE_MAX_RATIO = float(os.getenv("GEMINI_HEDGE_MAX_RATIO", "0.1"))
+# Perfiles de generación por clase de pregunta (concept, code, bugfix), elegida por un clasificador
+# local. PROFILE_<CLASE>="max_output_tokens=..,thinking_budget=..,temperature=..,model=.." ajusta
+# cada uno; GENERATION_PROFILES_ENABLED=false usa la configuración por defecto del modelo
+GENERATION_PROFILES_ENABLED = os.getenv("GENERATION_PROFILES_ENABLED", "true").lower() == "true"
+GENERATION_PROFILES = {
+    name: parse_profile(os.getenv(f"PROFILE_{name.upper()}", ""), profile)
+    for name, profile in DEFAULT_PROFILES.items()
+}
+for _profile in GENERATION_PROFILES.values():
+    if _profile.model and _profile.model not in {route.name for route in GEMINI_MODELS}:
+        raise ValueError(f"El modelo del perfil {_profile.name} ({_profile.model}) no está en GEMINI_MODELS")
+# Presupuesto de tokens por thread y por usuario en ventanas de TOKEN_BUDGET_WINDOW segundos (0 = sin límite)
+THREAD_TOKEN_BUDGET = int(os.getenv("THREAD_TOKEN_BUDGET", "0"))
+USER_TOKEN_BUDGET = int(os.getenv("USER_TOKEN_BUDGET", "0"))
+TOKEN_BUDGET_WINDOW = float(os.getenv("TOKEN_BUDGET_WINDOW", "86400"))
+# Aviso al thread cuando su pregunta va a la DLQ por falta de presupuesto
+BUDGET_EXCEEDED_REPLY = os.getenv(
+    "BUDGET_EXCEEDED_REPLY",
+    "Se agotó tu cupo de consultas al asistente por ahora. Tu pregunta quedó guardada; intenta de nuevo más tarde.",
+)
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "8"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "5"))
+
+# Limitador de llamadas a Gemini (0 = sin límite) y concurrencia adaptativa AIMD
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "0"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "0"))
+GEMINI_CONCURRENCY = float(os.getenv("GEMINI_CONCURRENCY", "8"))
+GEMINI_MIN_CONCURRENCY = float(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+GEMINI_MAX_CONCURRENCY = float(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+
+# Caché de la instrucción de sistema en Gemini (cached content). Sin él se envía en cada llamada
+# La instrucción actual no alcanza el mínimo de tokens del caché de Gemini: se activa solo si crece
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "false").lower() == "true"
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", "3600"))
+PROMPT_CACHE_REFRESH_MARGIN = float(os.getenv("PROMPT_CACHE_REFRESH_MARGIN", "300"))
+
+# Caché de respuestas (RESPONSE_CACHE_MAX_ENTRIES=0 la desactiva)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")  # archivo SQLite opcional
+
+# Registro de mensajes procesados por id, para no repetir llamadas ni entregas en una reentrega
+# (IDEMPOTENCY_MAX_ENTRIES=0 lo desactiva). Con IDEMPOTENCY_PATH se comparte entre procesos vía SQLite
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", "")
+IDEMPOTENCY_BLOOM_CAPACITY = int(os.getenv("IDEMPOTENCY_BLOOM_CAPACITY", "100000"))
+
 
 class ChatRequest(BaseModel):
     message: str
@@ -82,10 +249,26 @@ class ChatResponse(BaseModel):
     reply: str
 
 
+class ReplayRequest(BaseModel):
+    queue: str = FAILED_QUESTIONS_QUEUE
+    thread_id: str | None = None
+    format: str | None = None
+    error: str | None = None
+    older_than: float | None = None
+    newer_than: float | None = None
+    rate: float = Field(REPLAY_RATE, gt=0)
+    max_backlog: int = Field(REPLAY_MAX_BACKLOG, ge=1)
+    limit: int | None = Field(None, ge=1)
+    reset_retries: bool = True
+    dry_run: bool = False
+
+
 @lru_cache(maxsize=1) #evita recrear el cliente en cada petición
 def get_genai_client() -> genai.Client:
     """Create (and memoize) the Gemini client using the GEMINI_API_KEY env var."""
 
+    if GEMINI_BACKEND == "fake":
+        return FakeLLMBackend.from_env()
     try:
         return genai.Client()
     except Exception as exc:
@@ -96,37 +279,430 @@ def get_genai_client() -> genai.Client:
         ) from exc
 
 
+@lru_cache(maxsize=1)
+def get_response_cache() -> ResponseCache:
+    """Create (and memoize) the response cache, optionally backed by SQLite."""
+
+    backend = SQLiteCacheBackend(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+    return ResponseCache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes=RESPONSE_CACHE_MAX_BYTES,
+        ttl=RESPONSE_CACHE_TTL,
+        backend=backend,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_idempotency_store() -> IdempotencyStore:
+    """Create (and memoize) the processed-message registry, optionally backed by SQLite."""
+
+    backend = SQLiteIdempotencyBackend(IDEMPOTENCY_PATH) if IDEMPOTENCY_PATH else None
+    return IdempotencyStore(
+        max_entries=IDEMPOTENCY_MAX_ENTRIES,
+        ttl=IDEMPOTENCY_TTL,
+        bloom_capacity=IDEMPOTENCY_BLOOM_CAPACITY,
+        backend=backend,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_tracer() -> tracing.Tracer:
+    """Create (and memoize) the tracer configured by TRACE_EXPORTER / TRACE_SAMPLE_RATE."""
+
+    return tracing.Tracer.from_env("chatbot_service")
+
+
+@lru_cache(maxsize=1)
+def get_usage() -> UsageLedger:
+    """Create (and memoize) the token usage ledger that enforces thread/user budgets."""
+
+    return UsageLedger(
+        thread_budget=THREAD_TOKEN_BUDGET,
+        user_budget=USER_TOKEN_BUDGET,
+        window=TOKEN_BUDGET_WINDOW,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_limiter() -> GeminiLimiter:
+    """Create (and memoize) the limiter shared by the consumer and /chat."""
+
+    return GeminiLimiter(
+        requests_per_minute=GEMINI_RPM,
+        tokens_per_minute=GEMINI_TPM,
+        initial_concurrency=GEMINI_CONCURRENCY,
+        min_concurrency=GEMINI_MIN_CONCURRENCY,
+        max_concurrency=GEMINI_MAX_CONCURRENCY,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_router() -> ModelRouter:
+    """Create (and memoize) the router that picks, hedges and falls back between models."""
+
+    return ModelRouter(
+        GEMINI_MODELS,
+        hedge_percentile=GEMINI_HEDGE_PERCENTILE,
+        hedge_min_delay=GEMINI_HEDGE_MIN_DELAY,
+        hedge_max_ratio=GEMINI_HEDGE_MAX_RATIO,
+        max_workers=max(2 * CONSUMER_WORKERS, 8),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_prompt_cache() -> PromptCacheManager:
+    """Create (and memoize) the manager of the cached system instruction."""
+
+    return PromptCacheManager(
+        get_genai_client,
+        [route.name for route in GEMINI_MODELS],
+        SYSTEM_INSTRUCTION,
+        ttl=PROMPT_CACHE_TTL,
+        refresh_margin=PROMPT_CACHE_REFRESH_MARGIN,
+        enabled=PROMPT_CACHE_ENABLED,
+    )
+
+
+def generation_profile(question: str) -> GenerationProfile:
+    """Perfil de generación según la clase de la pregunta"""
+    if not GENERATION_PROFILES_ENABLED:
+        return UNBOUNDED
+    return GENERATION_PROFILES[classify(question)]
+
+
+def reply_cache_key(question: str, model: str = None) -> str:
+    """Clave de caché de la respuesta de ``model`` (por defecto, el que prefiere el perfil de la pregunta)"""
+    return make_cache_key(question, PROMPT_VERSION, model or generation_profile(question).model or GEMINI_MODEL)
+
+
+def generation_config(model: str, timeout: float, json_output: bool = False,
+                      profile: GenerationProfile = UNBOUNDED) -> types.GenerateContentConfig:
+    """Configuración por llamada: instrucción de sistema en caché (o completa si no hay caché vigente)
+    y los límites del perfil de la pregunta.
+
+    El timeout HTTP acota también los intentos abandonados por el router.
+    """
+    cached_content = get_prompt_cache().cached_content(model)
+    # El perfil es el mismo para todos los modelos de la ruta: el presupuesto se ajusta a cada uno
+    thinking_budget = thinking_budget_for(model, profile.thinking_budget)
+    return types.GenerateContentConfig(
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)),
+        response_mime_type="application/json" if json_output else None,
+        cached_content=cached_content,
+        system_instruction=None if cached_content else SYSTEM_INSTRUCTION,
+        max_output_tokens=profile.max_output_tokens,
+        temperature=profile.temperature,
+        thinking_config=(types.ThinkingConfig(thinking_budget=thinking_budget)
+                         if thinking_budget is not None else None),
+    )
+
+
+def is_cached_content_error(exc: BaseException, config: types.GenerateContentConfig) -> bool:
+    """Gemini rechazó el caché de la instrucción (venció, fue eliminado o no es accesible)"""
+    return bool(config.cached_content) and isinstance(exc, errors.ClientError) and exc.code in (400, 403, 404)
+
+
+def generate_content(model: str, contents: str, timeout: float, json_output: bool = False,
+                     profile: GenerationProfile = UNBOUNDED):
+    """generate_content con la instrucción de sistema; si el caché fue rechazado, reintenta sin él"""
+    config = generation_config(model, timeout, json_output, profile)
+    try:
+        return get_genai_client().models.generate_content(model=model, contents=contents, config=config)
+    except Exception as exc:
+        if not is_cached_content_error(exc, config):
+            raise
+        logger.warning(f"Caché de prompt rechazado para {model}: {exc}")
+        get_prompt_cache().invalidate(model)
+        config = generation_config(model, timeout, json_output, profile)
+        return get_genai_client().models.generate_content(model=model, contents=contents, config=config)
+
+
+async def generate_content_async(model: str, contents: str, timeout: float,
+                                 profile: GenerationProfile = UNBOUNDED):
+    """Variante asíncrona de generate_content"""
+    config = generation_config(model, timeout, profile=profile)
+    try:
+        return await get_genai_client().aio.models.generate_content(model=model, contents=contents, config=config)
+    except Exception as exc:
+        if not is_cached_content_error(exc, config):
+            raise
+        logger.warning(f"Caché de prompt rechazado para {model}: {exc}")
+        get_prompt_cache().invalidate(model)
+        config = generation_config(model, timeout, profile=profile)
+        return await get_genai_client().aio.models.generate_content(model=model, contents=contents, config=config)
+
+
+async def generate_content_stream(model: str, contents: str, timeout: float,
+                                  profile: GenerationProfile = UNBOUNDED):
+    """Fragmentos de generate_content_stream; si el caché fue rechazado antes del primer fragmento, reintenta sin él"""
+    client = get_genai_client()
+    config = generation_config(model, timeout, profile=profile)
+    stream = None
+    started = False
+    try:
+        try:
+            stream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+            async for chunk in stream:
+                started = True
+                yield chunk
+            return
+        except Exception as exc:
+            if started or not is_cached_content_error(exc, config):
+                raise
+            logger.warning(f"Caché de prompt rechazado para {model}: {exc}")
+            get_prompt_cache().invalidate(model)
+        if stream is not None and hasattr(stream, "aclose"):
+            await stream.aclose()
+        config = generation_config(model, timeout, profile=profile)
+        stream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+        async for chunk in stream:
+            yield chunk
+    finally:
+        # También cuando el cliente se desconecta (CancelledError) o el llamador cierra el generador
+        if stream is not None and hasattr(stream, "aclose"):
+            await stream.aclose()
+
+
+@lru_cache(maxsize=1)
+def get_batcher() -> MicroBatcher:
+    """Create (and memoize) the consumer micro-batcher."""
+
+    return MicroBatcher(_generate_batch, MICRO_BATCH_SIZE, MICRO_BATCH_WAIT_MS / 1000)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación gruesa de tokens (~4 caracteres por token) para el presupuesto por minuto"""
+    return len(text) // 4 + 1
+
+
 def build_prompt(message: str) -> str:
     """Construct the instruction prompt expected by Gemini."""
 
     return PROMPT_TEMPLATE.format(mensaje=message.strip())
 
 
+def build_batch_prompt(messages: list[str]) -> str:
+    """Prompt de un micro-lote; los mensajes van en una sola línea JSON con ids desde 1"""
+    items = [{"id": index, "mensaje": message.strip()} for index, message in enumerate(messages, start=1)]
+    return BATCH_PROMPT_TEMPLATE.format(mensajes=json.dumps(items, ensure_ascii=False))
+
+
+class EmptyReplyError(ValueError):
+    """El modelo respondió sin contenido."""
+
+
+def extract_reply(response) -> str:
+    """Obtiene el texto de la respuesta de Gemini; una respuesta vacía es un error"""
+    reply = (response.text or "").strip() if hasattr(response, "text") else ""
+    if not reply:
+        metrics.EMPTY_REPLIES_TOTAL.inc()
+        # Considerar una respuesta vacía como un error para que sea reintentado
+        raise EmptyReplyError("El modelo no entregó contenido en la respuesta.")
+    return reply
+
+
+# Coalescencia de llamadas en curso: preguntas idénticas simultáneas comparten una sola llamada a Gemini.
+# El consumidor y /chat no se coalescen entre sí: /chat falla rápido (CHAT_QUEUE_TIMEOUT) y se
+# cancela con el cliente, mientras que el consumidor espera al limitador en vez de fallar el mensaje
+_inflight = SingleFlight()
+_inflight_chat = SingleFlight()
+
+
+class _ModelAttempt:
+    """Intento para el router (``attempt(model, timeout, hedge)``).
+
+    El primer intento usa el permiso de la petición; los fallbacks toman uno
+    propio (esperando a lo sumo su deadline) y los hedges solo si hay cupo
+    inmediato. Cada intento libera su permiso cuando termina su llamada,
+    aunque el router ya lo haya abandonado por deadline, para que el
+    limitador siga contando las llamadas en curso. ``model`` y
+    ``used_tokens`` corresponden al intento que respondió.
+    """
+
+    def __init__(self, prompt: str, tokens: int, permit, profile: GenerationProfile, json_output: bool = False):
+        self.prompt = prompt
+        self.tokens = tokens
+        self.profile = profile
+        self.json_output = json_output
+        self.model = None
+        self.used_tokens = None
+        self._permit = permit
+        self._lock = threading.Lock()
+
+    def _take_permit(self):
+        with self._lock:
+            permit, self._permit = self._permit, None
+        return permit
+
+    def release_unclaimed(self) -> None:
+        """Libera el permiso de la petición si ningún intento llegó a tomarlo"""
+        permit = self._take_permit()
+        if permit is not None:
+            permit.release(sample_latency=False)
+
+    def _answered(self, response, permit, model: str) -> str:
+        get_usage().record(response, self.profile.name, model)
+        reply = extract_reply(response)
+        self.model = model
+        self.used_tokens = permit.used_tokens
+        return reply
+
+    def __call__(self, model: str, timeout: float, hedge: bool) -> str:
+        permit = self._take_permit() or get_limiter().acquire(self.tokens, timeout=0 if hedge else timeout)
+        with permit:
+            response = generate_content(model, self.prompt, timeout, self.json_output, self.profile)
+            permit.record_usage(response)
+        return self._answered(response, permit, model)
+
+
+class _ModelAttemptAsync(_ModelAttempt):
+    """Variante asíncrona de _ModelAttempt; el router cancela los intentos abandonados"""
+
+    async def __call__(self, model: str, timeout: float, hedge: bool) -> str:
+        permit = self._take_permit() or await get_limiter().acquire_async(self.tokens,
+                                                                          timeout=0 if hedge else timeout)
+        with permit:
+            response = await generate_content_async(model, self.prompt, timeout, self.profile)
+            permit.record_usage(response)
+        return self._answered(response, permit, model)
+
+
+def _generate_reply(question: str) -> str:
+    """Llama a Gemini (vía el router de modelos) y guarda la respuesta en caché.
+
+    Espera cupo en el limitador sin timeout: en el consumidor esto detiene el
+    consumo (el prefetch impide recibir más mensajes) en vez de fallar mensajes.
+    El uso real de tokens se descuenta del presupuesto del thread y del
+    usuario, y la respuesta se guarda bajo el modelo que la generó.
+    """
+    prompt = build_prompt(question)
+    tokens = estimate_tokens(prompt)
+    profile = generation_profile(question)
+    permit = get_limiter().acquire(tokens)
+    attempt = _ModelAttempt(prompt, tokens, permit, profile)
+    try:
+        reply = get_router().generate(attempt, profile.model)
+    finally:
+        attempt.release_unclaimed()
+    get_usage().charge(current_scope(), attempt.used_tokens or tokens)
+    get_response_cache().set(reply_cache_key(question, attempt.model), reply)
+    return reply
+
+
+def _generate_batch(items: list[tuple]) -> list:
+    """Responde un micro-lote de (pregunta, UsageScope) con una sola llamada.
+
+    Retorna una respuesta o BatchItemError por pregunta; el uso de tokens se
+    reparte en partes iguales entre los presupuestos de sus threads.
+    """
+    questions = [question for question, _ in items]
+    if len(questions) == 1:
+        # Lote de uno: lo ejecuta el mismo hilo que lo envió, con su UsageScope
+        return [process_question_with_gemini(questions[0])]
+
+    prompt = build_batch_prompt(questions)
+    tokens = estimate_tokens(prompt)
+    profile = combine([generation_profile(question) for question in questions])
+    permit = get_limiter().acquire(tokens)
+    attempt = _ModelAttempt(prompt, tokens, permit, profile, json_output=True)
+    try:
+        text = get_router().generate(attempt, profile.model)
+    except Exception as e:
+        logger.error("Error al procesar el lote de %d preguntas con Gemini: %s", len(questions), e)
+        raise
+    finally:
+        attempt.release_unclaimed()
+    share = (attempt.used_tokens or tokens) // len(items)
+    for _, scope in items:
+        get_usage().charge(scope, share)
+
+    cache = get_response_cache()
+    results = []
+    for question, reply in zip(questions, parse_batch_reply(text, len(questions))):
+        if reply is None:
+            results.append(BatchItemError("El lote no trajo respuesta para esta pregunta"))
+            continue
+        cache.set(reply_cache_key(question, attempt.model), reply)
+        results.append(reply)
+    return results
+
+
+async def _generate_reply_async(question: str) -> str:
+    """Variante asíncrona de _generate_reply; falla con LimiterTimeout si no hay cupo a tiempo"""
+    prompt = build_prompt(question)
+    tokens = estimate_tokens(prompt)
+    profile = generation_profile(question)
+    permit = await get_limiter().acquire_async(tokens, timeout=CHAT_QUEUE_TIMEOUT)
+    attempt = _ModelAttemptAsync(prompt, tokens, permit, profile)
+    try:
+        reply = await get_router().generate_async(attempt, profile.model)
+    finally:
+        attempt.release_unclaimed()
+    get_response_cache().set(reply_cache_key(question, attempt.model), reply)
+    return reply
+
+
 def process_question_with_gemini(question: str) -> str:
     """Procesa una pregunta usando la API de Gemini"""
+    with get_tracer().child_span("gemini.generate", kind="CLIENT", model=GEMINI_MODEL) as span:
+        cache_key = reply_cache_key(question)
+        cached = get_response_cache().get(cache_key)
+        span.set("cache_hit", cached is not None)
+        if cached is not None:
+            return cached
+        # Antes de llamar al modelo: el thread o el usuario pueden haber agotado su presupuesto
+        get_usage().check(current_scope())
+
+        try:
+            return _inflight.do(cache_key, _generate_reply, question)
+        except Exception as e:
+            # Registrar el error y RE-LANZAR la excepción
+            # Esto es crucial para que el callback active la lógica de reintentos/DLX
+            logger.error("Error al procesar con Gemini: %s", e)
+            raise
+
+
+async def process_question_with_gemini_async(question: str) -> str:
+    """Variante asíncrona de process_question_with_gemini (no bloquea el event loop)"""
+    cache_key = reply_cache_key(question)
+    cached = get_response_cache().get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        prompt = build_prompt(question)
-        response = get_genai_client().models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-        )
-        
-        reply = (response.text or "").strip() if hasattr(response, "text") else ""
-        if not reply:
-            # Considerar una respuesta vacía como un error para que sea reintentado
-            raise ValueError("El modelo no entregó contenido en la respuesta.")
-        
-        return reply
+        return await _inflight_chat.do_async(cache_key, _generate_reply_async, question)
     except Exception as e:
-        # Registrar el error y RE-LANZAR la excepción
-        # Esto es crucial para que el callback active la lógica de reintentos/DLX
-        logger.error(f"Error al procesar con Gemini: {e}")
+        logger.error("Error al procesar con Gemini: %s", e)
         raise
 
 
-def get_rabbitmq_connection():
+def answer_question(question: str, batchable: bool = False) -> str:
+    """Respuesta para el consumidor: en micro-lotes si MICRO_BATCH_SIZE > 1 y ``batchable``.
+
+    Solo se agrupan las preguntas del carril bulk sin thread: en un mismo prompt,
+    la pregunta de un usuario podría dirigir las respuestas que reciben otros, y
+    a una pregunta interactiva el lote solo le agrega espera. Una pregunta que el
+    lote no respondió se procesa sola; si falla la llamada del lote completo,
+    cada mensaje sigue su propio ciclo de reintentos.
+    """
+    if MICRO_BATCH_SIZE <= 1 or not batchable:
+        return process_question_with_gemini(question)
+
+    cached = get_response_cache().get(reply_cache_key(question))
+    if cached is not None:
+        return cached
+    scope = current_scope()
+    get_usage().check(scope)
+    try:
+        with get_tracer().child_span("gemini.batch", kind="CLIENT", model=GEMINI_MODEL):
+            return get_batcher().submit((question, scope))
+    except BatchItemError:
+        return process_question_with_gemini(question)
+
+
+def get_rabbitmq_connection(attempts: int = 5):
     """Establece conexión con RabbitMQ con reintentos"""
-    max_retries = 5
+    max_retries = attempts
     retry_delay = 5
     
     for attempt in range(max_retries):
@@ -158,12 +734,50 @@ def get_retry_count(properties) -> int:
     return 0
 
 
-def send_response_to_thread(thread_id: str, user_id: str, response: str):
-    """Envía la respuesta directamente como mensaje al thread usando la API del servicio de mensajes"""
+@lru_cache(maxsize=1)
+def get_delivery() -> MessagesDelivery:
+    """Create (and memoize) the pooled client used to deliver replies to threads."""
+
+    return MessagesDelivery(
+        MESSAGES_SERVICE_URL,
+        str(uuid.UUID(CHATBOT_USER_ID)),
+        max_retries=DELIVERY_MAX_RETRIES,
+        outbox_size=DELIVERY_OUTBOX_SIZE,
+        workers=DELIVERY_WORKERS,
+        breaker=CircuitBreaker(DELIVERY_BREAKER_THRESHOLD, DELIVERY_BREAKER_RESET),
+        on_give_up=spill_undelivered,
+    )
+
+
+# Canal del consumidor actual, para publicar desde hilos que no son el de la conexión
+_spill_channel: ThreadSafeChannel | None = None
+
+
+def spill_undelivered(job) -> None:
+    """Publica en la cola de respuestas una entrega del outbox que agotó sus reintentos"""
+    if not DELIVERY_SPILLOVER:
+        return
+    channel = _spill_channel
+    if channel is None:
+        logger.error(f"Sin conexión a RabbitMQ: se pierde la respuesta para el thread {job.thread_id}")
+        return
+    publish_response_event(
+        channel, job.context.get("question"), job.payload["content"], job.context.get("question_id"),
+        job.thread_id, job.context.get("user_id"),
+    )
+
+
+def send_response_to_thread(thread_id: str, user_id: str, response: str, question: str = None,
+                            question_id: str = None) -> bool:
+    """Envía la respuesta directamente como mensaje al thread usando la API del servicio de mensajes.
+
+    Retorna True si la respuesta fue entregada (modo sync) o aceptada en el outbox (modo outbox).
+    ``question`` y ``question_id`` permiten publicarla en la cola de respuestas si el
+    outbox agota los reintentos.
+    """
     try:
         # Validar que thread_id sea un UUID válido
         thread_uuid = uuid.UUID(thread_id)
-        bot_uuid = uuid.UUID(CHATBOT_USER_ID)
         
         # Preparar el payload
         payload = {
@@ -172,220 +786,585 @@ def send_response_to_thread(thread_id: str, user_id: str, response: str):
             "paths": None
         }
         
-        # Hacer la llamada HTTP al servicio de mensajes
-        url = f"{MESSAGES_SERVICE_URL}/threads/{thread_uuid}/messages"
-        headers = {
-            "X-User-Id": str(bot_uuid),  # Usar el user_id del bot
-            "Content-Type": "application/json"
-        }
-        
-        logger.info("=" * 80)
-        logger.info("ENVIANDO RESPUESTA AL THREAD")
-        logger.info("=" * 80)
-        logger.info(f"URL: {url}")
-        logger.info(f"Thread ID: {thread_id}")
-        logger.info(f"Respuesta: {len(response)} caracteres")
-        
-        with httpx.Client(timeout=30.0) as client:
-            http_response = client.post(url, json=payload, headers=headers)
-            
-            if http_response.status_code == 201:
-                logger.info("✅ RESPUESTA ENVIADA EXITOSAMENTE AL THREAD")
-                logger.info(f"Status: {http_response.status_code}")
-                logger.info("=" * 80)
-            else:
-                logger.error(f"❌ Error al enviar respuesta: {http_response.status_code}")
-                logger.error(f"Response: {http_response.text}")
-                logger.info("=" * 80)
+        started = time.perf_counter()
+        delivery = get_delivery()
+        with get_tracer().child_span("messages.post", kind="CLIENT", mode=DELIVERY_MODE) as span:
+            # El servicio de mensajes puede continuar la traza
+            traceparent = span.traceparent() or tracing.current_traceparent()
+            if DELIVERY_MODE == "outbox":
+                context = {"question": question, "question_id": question_id, "user_id": user_id}
+                accepted = delivery.enqueue(str(thread_uuid), payload, traceparent, context)
+                span.set("accepted", accepted)
+                log_event(logger, "delivery_enqueued", thread_id=thread_id, chars=len(response),
+                          accepted=accepted, ms=elapsed_ms(started))
+                return accepted
+
+            delivered = delivery.send(str(thread_uuid), payload, traceparent)
+            span.set("delivered", delivered)
+            log_event(logger, "delivery_sent", thread_id=thread_id, chars=len(response),
+                      delivered=delivered, ms=elapsed_ms(started))
+            return delivered
                 
     except ValueError as e:
-        logger.error(f"Error: UUID inválido - {e}")
-    except httpx.RequestError as e:
-        logger.error(f"Error de conexión al servicio de mensajes: {e}")
+        logger.error("Error: UUID inválido - %s", e)
     except Exception as e:
-        logger.error(f"Error inesperado al enviar respuesta: {e}")
+        logger.error("Error inesperado al enviar respuesta: %s", e)
+    return False
 
 
-def publish_response_event(channel, question: str, response: str, question_id: str):
+def publish_response_event(channel, question: str, response: str, question_id: str,
+                           thread_id: str = None, user_id: str = None):
     """Publica la respuesta de Gemini como evento en la cola de respuestas (fallback)"""
     try:
-        message_body = {
-            "question_id": question_id,
-            "question": question,
-            "response": response,
-            "timestamp": time.time(),
-            "processed_by": "chatbot_service"
-        }
-        
+        # Con thread_id: respuesta que no se pudo entregar al thread (spill-over)
+        message = envelope.ResponseMessage(
+            question_id=question_id,
+            question=question,
+            response=response,
+            timestamp=time.time(),
+            processed_by="chatbot_service",
+            thread_id=thread_id or None,
+            user_id=user_id if thread_id else None,
+        )
         channel.basic_publish(
             exchange='',
             routing_key=RESPONSES_QUEUE,
-            body=json.dumps(message_body),
+            body=envelope.encode(message, ENVELOPE_CONTENT_TYPE),
             properties=pika.BasicProperties(
                 delivery_mode=2,  # Mensaje persistente
-                content_type='application/json'
+                content_type=ENVELOPE_CONTENT_TYPE,
+                headers=get_tracer().inject(envelope.headers(ENVELOPE_CONTENT_TYPE)),
             )
         )
         
-        logger.info("=" * 80)
-        logger.info("EVENTO DE RESPUESTA PUBLICADO (FALLBACK)")
-        logger.info("=" * 80)
-        logger.info(f"Cola: {RESPONSES_QUEUE}")
-        logger.info(f"Question ID: {question_id}")
-        logger.info(f"Respuesta: {len(response)} caracteres")
-        logger.info("=" * 80)
+        log_event(logger, "fallback_published", queue=RESPONSES_QUEUE, question_id=question_id,
+                  thread_id=thread_id, chars=len(response))
         
     except Exception as e:
-        logger.error(f"Error al publicar respuesta (fallback): {e}")
+        logger.error("Error al publicar respuesta (fallback): %s", e)
         raise
 
 
+def record_queue_wait(span, properties, message, received_at: float) -> None:
+    """Espera en cola desde la última publicación (o el timestamp del mensaje), como métrica y span hijo"""
+    published = tracing.published_at(properties) or message.timestamp
+    if not published:
+        return
+    # Los relojes de los servicios pueden diferir levemente
+    wait = max(received_at - published, 0.0)
+    metrics.STAGE_QUEUE_WAIT.observe(wait)
+    span.set("queue_wait_ms", round(wait * 1000, 2))
+    if span.recording:
+        get_tracer().start_span("rabbitmq.queue_wait", parent=span.context, start=received_at - wait).finish(received_at)
+
+
+# Apagado en curso: los mensajes que aún no empezaron se devuelven a la cola
+_draining = threading.Event()
+
+
 def callback(ch, method, properties, body):
     """Callback que se ejecuta cuando llega un mensaje de la cola de preguntas"""
+    if _draining.is_set():
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        return
+
     retry_count = get_retry_count(properties)
+    started = time.perf_counter()
+    received_at = time.time()
+    question_id = thread_id = user_id = None
+    # Continúa la traza del productor (o la inicia, según el muestreo)
+    span = get_tracer().start_span(
+        "chatbot.process", parent=tracing.extract(properties.headers), kind="CONSUMER", start=received_at,
+        attributes={"queue": getattr(method, "routing_key", None), "retry": retry_count},
+    )
+    span_token = tracing.activate(span)
+    metrics.MESSAGES_IN_FLIGHT.inc()
     
     try:
-        message_data = json.loads(body)
-
-        thread_id = None
-        user_id = None
-        question = None
-        question_id = None
-
-        # Formato 1: Mensaje de INF326-tarea-2-main (viene el objeto message directamente)
-        if "thread_id" in message_data and "content" in message_data:
-            thread_id = str(message_data.get("thread_id", ""))
-            user_id = str(message_data.get("user_id", ""))
-            question = message_data.get("content", "")
-            question_id = str(message_data.get("id", "unknown"))
-        # Formato 2: Mensaje original del quiz_service
-        elif "question" in message_data:
-            question = message_data.get("question", "")
-            question_id = message_data.get("question_id", "unknown")
-        else:
-            # Formato desconocido, intentar un fallback
-            question = str(message_data)
-            question_id = "unknown"
+        # Una sola pasada: versión por header, serialización por content_type
+        message, message_format = envelope.decode_question(body, properties.content_type, properties.headers)
+        question = message.question
+        question_id = message.question_id
+        thread_id = message.thread_id
+        user_id = message.user_id
+        metrics.FORMAT_COUNTERS[message_format].inc()
+        metrics.STAGE_DECODE.observe(time.perf_counter() - started)
+        record_queue_wait(span, properties, message, received_at)
+        span.set("question_id", question_id)
+        span.set("thread_id", thread_id)
+        span.set("format", message_format)
         
-        logger.info("=" * 80)
-        logger.info("NUEVO MENSAJE RECIBIDO")
-        logger.info("=" * 80)
-        logger.info(f"Question ID: {question_id}")
-        logger.info(f"Thread ID: {thread_id}")
-        logger.info(f"User ID: {user_id}")
-        logger.info(f"Reintento: {retry_count}/{MAX_RETRIES}")
-        logger.info(f"PREGUNTA: {question}")
-        logger.info("-" * 80)
+        log_event(
+            logger, "message_received",
+            question_id=question_id, thread_id=thread_id, user_id=user_id, format=message_format,
+            retry=retry_count, bytes=len(body),
+            question=question if sample_payload() else None,
+        )
         
         if not question:
             logger.warning("Pregunta vacía, descartando mensaje.")
+            span.set("outcome", "empty")
             ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
-        # Procesar con Gemini
-        logger.info("Procesando con Gemini AI...")
-        response = process_question_with_gemini(question)
-        
-        logger.info("RESPUESTA DE GEMINI:")
-        logger.info("-" * 80)
-        logger.info(response)
-        logger.info("=" * 80)
+        # Idempotencia: una reentrega (crash antes del ack, ack perdido) no repite la llamada ni la entrega
+        idempotency = get_idempotency_store()
+        idempotency_key = message_key(question_id, thread_id, body)
+        record = idempotency.get(idempotency_key, redelivered=bool(getattr(method, 'redelivered', False)))
+        if record is not None and record.done:
+            metrics.DUPLICATES_ACKED.inc()
+            log_event(logger, "duplicate_acked", question_id=question_id, retry=retry_count)
+            span.set("outcome", "duplicate")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        if record is not None and record.reply:
+            # La respuesta ya se generó en un intento anterior: solo falta entregarla
+            response = record.reply
+            span.set("reply_reused", True)
+            metrics.DUPLICATES_REUSED.inc()
+            log_event(logger, "reply_reused", question_id=question_id, chars=len(response))
+        else:
+            # Procesar con Gemini
+            model_started = time.perf_counter()
+            with usage_scope(thread_id, user_id):
+                response = answer_question(
+                    question, batchable=not thread_id and envelope.lane(properties.headers) == envelope.BULK,
+                )
+            metrics.STAGE_MODEL.observe(time.perf_counter() - model_started)
+            idempotency.record_reply(idempotency_key, response)
+            log_event(
+                logger, "model_replied",
+                question_id=question_id, chars=len(response), ms=elapsed_ms(model_started),
+                response=response if sample_payload() else None,
+            )
         
         # Enviar respuesta directamente al thread si tenemos thread_id
         if thread_id and user_id:
-            send_response_to_thread(thread_id, user_id, response)
+            stage_started = time.perf_counter()
+            delivered = send_response_to_thread(thread_id, user_id, response, question, question_id)
+            metrics.STAGE_DELIVERY.observe(time.perf_counter() - stage_started)
+            if not delivered and DELIVERY_SPILLOVER:
+                logger.warning("No se pudo entregar al thread, publicando en cola de respuestas.")
+                stage_started = time.perf_counter()
+                publish_response_event(ch, question, response, question_id, thread_id, user_id)
+                metrics.STAGE_FALLBACK.observe(time.perf_counter() - stage_started)
         else:
             # Fallback: publicar en cola de respuestas (comportamiento original)
-            logger.warning("No se encontró thread_id/user_id, publicando en cola de respuestas de fallback.")
+            stage_started = time.perf_counter()
             publish_response_event(ch, question, response, question_id)
+            metrics.STAGE_FALLBACK.observe(time.perf_counter() - stage_started)
         
         # Confirmar mensaje procesado
+        idempotency.mark_done(idempotency_key)
+        stage_started = time.perf_counter()
         ch.basic_ack(delivery_tag=method.delivery_tag)
-        logger.info("MENSAJE PROCESADO (ACK)")
-        logger.info("=" * 80)
-        logger.info("")
+        metrics.STAGE_ACK.observe(time.perf_counter() - stage_started)
+        span.set("outcome", "acked")
+        log_event(logger, "message_acked", question_id=question_id, ms=elapsed_ms(started))
         
     except Exception as e:
-        logger.error("=" * 80)
-        logger.error(f"ERROR: {e}")
-        logger.error("=" * 80)
+        span.record_error(e)
+        log_event(
+            logger, "message_failed", logging.ERROR,
+            question_id=question_id, retry=retry_count, error=str(e), ms=elapsed_ms(started),
+        )
         
+        headers = dict(properties.headers or {})
+        # Último error, para filtrar al reprocesar la DLQ
+        headers[ERROR_HEADER] = f"{type(e).__name__}: {e}"[:500]
+
         # Verificar si se debe reintentar o enviar a DLX
-        if retry_count < MAX_RETRIES:
-            logger.warning(f"Reintentando... ({retry_count + 1}/{MAX_RETRIES})")
-            
-            # Crear headers con contador incrementado
-            headers = properties.headers or {}
+        if isinstance(e, BudgetExceeded):
+            # Sin presupuesto, reintentar dentro de la misma ventana no sirve: va directo a la
+            # DLX (republicado, porque basic_nack no permite agregar el header del error) y se
+            # reprocesa desde la DLQ más adelante
+            republish_and_ack(
+                ch, method.delivery_tag,
+                exchange=DLX_EXCHANGE,
+                routing_key="failed_questions",
+                body=body,
+                properties=republished_properties(properties, headers),
+            )
+            metrics.DEAD_LETTERED_TOTAL.inc()
+            span.set("outcome", "budget_exceeded")
+            log_event(logger, "message_dead_lettered", logging.WARNING, question_id=question_id,
+                      retry=retry_count, budget=e.scope)
+            # Un aviso por thread y ventana, aunque lleguen (o se reprocesen) varias preguntas
+            if thread_id and user_id and get_usage().notify_once(thread_id):
+                send_response_to_thread(thread_id, user_id, BUDGET_EXCEEDED_REPLY)
+        elif retry_count < MAX_RETRIES:
+            # Contador incrementado
             headers['x-retry-count'] = retry_count + 1
+            # El próximo intento será hijo de este; la espera en cola se mide desde ahora
+            get_tracer().inject(headers, span)
             
-            # Usar la cola desde la cual se recibió el mensaje (routing_key del método)
-            retry_queue = method.routing_key if hasattr(method, 'routing_key') and method.routing_key else QUESTIONS_QUEUE
+            # Usar la cola desde la cual se recibió el mensaje (routing_key del método). Con shards
+            # el routing_key es el número de shard: el reintento vuelve a la cola principal y se reenruta
+            if SHARD_COUNT > 0:
+                source_queue = BULK_QUEUE if BULK_QUEUE and method.routing_key == BULK_QUEUE else QUESTIONS_QUEUE
+            else:
+                source_queue = method.routing_key if hasattr(method, 'routing_key') and method.routing_key else QUESTIONS_QUEUE
+            retry_queue = source_queue
+            delay_ms = None
+            
+            # Enviar a la cola de espera del nivel correspondiente, que devuelve el mensaje
+            # a la cola de trabajo cuando vence su TTL (en vez de reintentar de inmediato)
+            if RETRY_DELAY_ENABLED and source_queue in _delayed_retry_queues:
+                tier, delay = choose_retry_delay(retry_count, RETRY_DELAYS, retry_after_hint(e))
+                retry_queue = retry_queue_name(source_queue, tier)
+                delay_ms = int(delay * 1000)
             
-            # Republicar mensaje con nuevo contador
-            ch.basic_publish(
+            # Republicar mensaje con nuevo contador y confirmar el original, que ya no debe llegar a la DLX
+            republish_and_ack(
+                ch, method.delivery_tag,
                 exchange='',
                 routing_key=retry_queue,
                 body=body,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,
-                    headers=headers,
-                    content_type='application/json'
-                )
+                properties=republished_properties(properties, headers),
+            )
+            metrics.RETRIES_TOTAL.inc()
+            span.set("outcome", "retried")
+            span.set("retry_queue", retry_queue)
+            log_event(
+                logger, "message_retried", logging.WARNING,
+                question_id=question_id, attempt=retry_count + 1, max_retries=MAX_RETRIES,
+                queue=retry_queue, delay_ms=delay_ms,
             )
-            
-            # Rechazar mensaje original (no requeue porque ya lo republicamos)
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            logger.info(f"Mensaje reencolado (intento {retry_count + 1})")
         else:
             # Máximo de reintentos alcanzado, enviar a DLX
-            logger.error(f"Máximo de reintentos. Enviando a DLX...")
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        
-        logger.info("=" * 80)
-        logger.info("")
+            metrics.DEAD_LETTERED_TOTAL.inc()
+            span.set("outcome", "dead_lettered")
+            log_event(logger, "message_dead_lettered", logging.ERROR, question_id=question_id, retry=retry_count)
+    finally:
+        metrics.MESSAGES_IN_FLIGHT.dec()
+        tracing.deactivate(span_token)
+        span.finish()
+
+
+def republished_properties(properties, headers: dict) -> pika.BasicProperties:
+    """Propiedades de un mensaje republicado: persistente, con ``headers`` y la serialización e identificadores originales"""
+    return pika.BasicProperties(
+        delivery_mode=2,
+        headers=headers,
+        content_type=properties.content_type or 'application/json',
+        timestamp=properties.timestamp,
+        message_id=properties.message_id,
+        correlation_id=properties.correlation_id,
+        app_id=properties.app_id,
+    )
+
+
+def republish_and_ack(ch, delivery_tag, **publish) -> None:
+    """Republica un mensaje y confirma el original solo si la publicación salió.
 
+    En el pool ambas operaciones van en un mismo callback del hilo de la conexión
+    (si la publicación falla el original vuelve a la cola); en modo síncrono un
+    error de publicación se propaga sin ack y el broker lo reentrega.
+    """
+    if isinstance(ch, ThreadSafeChannel):
+        ch.publish_and_ack(delivery_tag, **publish)
+        return
+    ch.basic_publish(**publish)
+    ch.basic_ack(delivery_tag=delivery_tag)
 
-def start_consumer():
-    """Inicia el consumidor de RabbitMQ en un hilo separado"""
+
+# Colas de trabajo cuyas colas de reintento diferido existen en el broker
+_delayed_retry_queues: set[str] = set()
+
+
+def check_delayed_retry_queues(connection, source_queue: str) -> bool:
+    """Verifica que existan las colas <cola>.retry.N; si falta alguna se reintenta de inmediato"""
+    for tier in range(1, len(RETRY_DELAYS) + 1):
+        # Un queue_declare pasivo fallido cierra el canal, por eso se usa uno desechable
+        probe = connection.channel()
+        try:
+            probe.queue_declare(queue=retry_queue_name(source_queue, tier), durable=True, passive=True)
+        except pika.exceptions.ChannelClosedByBroker:
+            logger.warning(
+                f"No existe {retry_queue_name(source_queue, tier)}; los reintentos de {source_queue} serán inmediatos"
+            )
+            _delayed_retry_queues.discard(source_queue)
+            return False
+        probe.close()
+    _delayed_retry_queues.add(source_queue)
+    return True
+
+
+def get_ordering_key(body, properties) -> str | None:
+    """Clave que determina el orden de procesamiento: mensajes del mismo thread van en serie"""
     try:
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        
-        # Las colas ya están declaradas en definitions.json
-        # Pero verificamos que existan (passive=True no crea, solo verifica)
-        channel.queue_declare(queue=QUESTIONS_QUEUE, durable=True, passive=True)
-        
-        # Configurar QoS para procesar un mensaje a la vez
-        channel.basic_qos(prefetch_count=1)
-        
+        message, _ = envelope.decode_question(body, properties.content_type, properties.headers)
+    except envelope.EnvelopeError:
+        return None
+    return message.thread_id or None
+
+
+_worker_pool: ConsumerWorkerPool | None = None
+
+
+def get_worker_pool() -> ConsumerWorkerPool:
+    """Crea (una sola vez) el pool de workers del consumidor"""
+    global _worker_pool
+    if _worker_pool is None:
+        bulk_workers = BULK_MAX_WORKERS or CONSUMER_WORKERS - max(1, CONSUMER_WORKERS // 4)
+        _worker_pool = ConsumerWorkerPool(
+            CONSUMER_WORKERS,
+            lanes=[
+                Lane(envelope.INTERACTIVE, weight=LANE_INTERACTIVE_WEIGHT),
+                Lane(envelope.BULK, weight=LANE_BULK_WEIGHT, max_active=max(bulk_workers, 1),
+                     max_wait=BULK_MAX_WAIT),
+            ],
+            on_wait=lambda lane, seconds: metrics.LANE_WAIT[lane].observe(seconds),
+        )
+    return _worker_pool
+
+
+def build_message_handler(connection, channel, on_done=None, lane: str = envelope.INTERACTIVE):
+    """Retorna el on_message_callback según el modo configurado (síncrono o pool de workers).
+
+    ``on_done(method)`` se ejecuta en el hilo de la conexión cuando termina cada mensaje.
+    ``lane`` es el carril del pool para los mensajes sin header ``x-lane``.
+    """
+    if MICRO_BATCH_SIZE > CONSUMER_WORKERS:
+        logger.warning(
+            f"MICRO_BATCH_SIZE={MICRO_BATCH_SIZE} supera CONSUMER_WORKERS={CONSUMER_WORKERS}: "
+            "los lotes no pasarán de CONSUMER_WORKERS preguntas"
+        )
+    if CONSUMER_WORKERS <= 1:
+        if on_done is None:
+            return callback
+
+        def on_message_sync(ch, method, properties, body):
+            callback(ch, method, properties, body)
+            on_done(method)
+
+        return on_message_sync
+
+    pool = get_worker_pool()
+    safe_channel = ThreadSafeChannel(connection, channel)
+
+    def process(ch, method, properties, body):
+        try:
+            callback(ch, method, properties, body)
+        finally:
+            if on_done is not None:
+                # Se agenda después del ack, que ya está en la cola de callbacks de la conexión
+                connection.add_callback_threadsafe(lambda: on_done(method))
+
+    def on_message(ch, method, properties, body):
+        # Gemini y la entrega al thread corren en el pool; ack/nack vuelven
+        # al hilo de la conexión a través de safe_channel
+        pool.submit(get_ordering_key(body, properties), process, safe_channel, method, properties, body,
+                    lane=envelope.lane(properties.headers, lane))
+
+    return on_message
+
+
+_shards: ShardCoordinator | None = None
+# Canal y consumer tag del carril bulk, para cancelarlo al apagar
+_bulk_consumer: tuple | None = None
+
+
+def setup_consumer(connection):
+    """Declara y registra los consumidores sobre una conexión nueva; retorna el canal a consumir"""
+    global _shards, _spill_channel
+    channel = connection.channel()
+    _spill_channel = ThreadSafeChannel(connection, channel)
+
+    # Las colas ya están declaradas en definitions.json
+    # Pero verificamos que existan (passive=True no crea, solo verifica)
+    channel.queue_declare(queue=QUESTIONS_QUEUE, durable=True, passive=True)
+    if RETRY_DELAY_ENABLED:
+        check_delayed_retry_queues(connection, QUESTIONS_QUEUE)
+
+    if SHARD_COUNT > 0:
+        # El prefetch se comparte entre los consumidores de todos los shards del canal
+        channel.basic_qos(prefetch_count=max(CONSUMER_PREFETCH, 1), global_qos=True)
+        _shards = ShardCoordinator(
+            connection, channel,
+            handler=None,
+            ordering_key=get_ordering_key,
+            replica_id=REPLICA_ID,
+            queue=QUESTIONS_QUEUE,
+            shards=SHARD_COUNT,
+            queue_arguments={
+                "x-dead-letter-exchange": DLX_EXCHANGE,
+                "x-dead-letter-routing-key": "failed_questions",
+            },
+            heartbeat_interval=SHARD_HEARTBEAT_INTERVAL,
+            member_timeout=SHARD_MEMBER_TIMEOUT,
+        )
+        _shards.handler = build_message_handler(connection, channel, on_done=_shards.done)
+        _shards.start()
+    else:
+        # Configurar QoS: un mensaje a la vez en modo síncrono, N en modo pool
+        channel.basic_qos(prefetch_count=max(CONSUMER_PREFETCH, 1))
+
         # Configurar el consumidor
-        channel.basic_consume(queue=QUESTIONS_QUEUE, on_message_callback=callback, auto_ack=False)
-        
-        logger.info("=" * 80)
-        logger.info("CONSUMIDOR RABBITMQ INICIADO")
-        logger.info("=" * 80)
-        logger.info(f"Escuchando: {QUESTIONS_QUEUE}")
-        logger.info(f"Publicando en: {RESPONSES_QUEUE}")
-        logger.info(f"DLX: {DLX_EXCHANGE}")
-        logger.info(f"Max reintentos: {MAX_RETRIES}")
-        logger.info("=" * 80)
-        logger.info("")
-        
-        channel.start_consuming()
-        
-    except Exception as e:
-        logger.error(f"Error en el consumidor: {e}")
-        time.sleep(5)
-        # Reintentar
-        start_consumer()
+        channel.basic_consume(
+            queue=QUESTIONS_QUEUE,
+            on_message_callback=build_message_handler(connection, channel),
+            auto_ack=False,
+        )
+
+    if BULK_QUEUE:
+        setup_bulk_lane(connection)
+
+    logger.info("=" * 80)
+    logger.info("CONSUMIDOR RABBITMQ INICIADO")
+    logger.info("=" * 80)
+    logger.info(f"Escuchando: {QUESTIONS_QUEUE}")
+    logger.info(f"Publicando en: {RESPONSES_QUEUE}")
+    logger.info(f"DLX: {DLX_EXCHANGE}")
+    logger.info(f"Max reintentos: {MAX_RETRIES}")
+    logger.info(f"Workers: {CONSUMER_WORKERS} (prefetch {CONSUMER_PREFETCH})")
+    if SHARD_COUNT > 0:
+        logger.info(f"Shards: {SHARD_COUNT} (réplica {REPLICA_ID})")
+    if BULK_QUEUE:
+        logger.info(f"Carril bulk: {BULK_QUEUE} (prefetch {BULK_PREFETCH})")
+    logger.info("=" * 80)
+    logger.info("")
+    return channel
+
+
+def setup_bulk_lane(connection) -> None:
+    """Consume el carril bulk en un canal propio, para que su prefetch no ocupe el de los threads"""
+    global _bulk_consumer
+    channel = connection.channel()
+    # Se declara si no existe (mismos argumentos que en definitions.json)
+    channel.queue_declare(queue=BULK_QUEUE, durable=True, arguments={
+        "x-dead-letter-exchange": DLX_EXCHANGE,
+        "x-dead-letter-routing-key": "failed_questions",
+    })
+    if RETRY_DELAY_ENABLED:
+        check_delayed_retry_queues(connection, BULK_QUEUE)
+    channel.basic_qos(prefetch_count=max(BULK_PREFETCH, 1))
+    # Sin shards: quiz_service publica aquí solo preguntas sin thread (las de un thread van a
+    # QUESTIONS_QUEUE, que sí se reparte por thread), así que cualquier réplica puede tomarlas
+    consumer_tag = channel.basic_consume(
+        queue=BULK_QUEUE,
+        on_message_callback=build_message_handler(connection, channel, lane=envelope.BULK),
+        auto_ack=False,
+    )
+    _bulk_consumer = (channel, consumer_tag)
+
+
+def stop_fetching() -> None:
+    """Deja de aceptar mensajes nuevos: los que ya están en el pool se devuelven a la cola"""
+    global _bulk_consumer
+    _draining.set()
+    if _shards is not None:
+        _shards.stop()
+    # El canal principal lo detiene el supervisor; el del carril bulk seguiría recibiendo
+    # (y devolviendo) mensajes hasta el plazo de apagado
+    bulk, _bulk_consumer = _bulk_consumer, None
+    if bulk is not None:
+        channel, consumer_tag = bulk
+        try:
+            if channel.is_open:
+                channel.basic_cancel(consumer_tag)
+        except Exception as e:
+            logger.warning(f"No se pudo cancelar el consumidor del carril bulk: {e}")
+
+
+def consumer_idle() -> bool:
+    return _worker_pool is None or _worker_pool.in_flight == 0
+
+
+@lru_cache(maxsize=1)
+def get_supervisor() -> ConsumerSupervisor:
+    """Create (and memoize) the supervisor that keeps the RabbitMQ consumer connected."""
+
+    return ConsumerSupervisor(
+        connect=lambda: get_rabbitmq_connection(attempts=1),
+        setup=setup_consumer,
+        idle=consumer_idle,
+        on_stop=stop_fetching,
+        backoff_base=CONSUMER_RECONNECT_BASE,
+        backoff_max=CONSUMER_RECONNECT_MAX,
+    )
+
+
+# Se activa cuando el Gemini respondió al menos una vez (cliente creado, API key válida, pool HTTP abierto)
+_model_ready = threading.Event()
+
+
+def prewarm() -> None:
+    """Crea por adelantado los clientes y recursos que la primera petición pagaría en frío"""
+    started = time.perf_counter()
+    get_response_cache()
+    get_idempotency_store()
+    get_limiter()
+    get_router()
+    # Cliente HTTP del servicio de mensajes (pool y contexto TLS)
+    get_delivery()
+    attempts = 0
+    while not _model_ready.is_set() and not _draining.is_set():
+        try:
+            # Valida la API key y abre la conexión al modelo
+            client = get_genai_client()
+            client.models.get(model=GEMINI_MODEL)
+            _model_ready.set()
+        except Exception as exc:
+            delay = get_supervisor().backoff(attempts)
+            attempts += 1
+            logger.warning(f"Gemini aún no está disponible ({exc}); reintentando en {delay:.1f}s")
+            _draining.wait(delay)
+    logger.info(f"Precalentamiento terminado en {elapsed_ms(started)} ms")
 
 
 @app.on_event("startup")
 async def startup_event():
     """Inicia el consumidor de RabbitMQ cuando la aplicación arranca"""
-    consumer_thread = threading.Thread(target=start_consumer, daemon=True)
-    consumer_thread.start()
-    logger.info("Hilo consumidor de RabbitMQ iniciado")
+    # Registrar la instrucción de sistema en caché y mantenerla vigente en segundo plano
+    get_prompt_cache().start()
+    threading.Thread(target=prewarm, daemon=True, name="prewarm").start()
+    get_supervisor().start()
+    logger.info("Supervisor del consumidor de RabbitMQ iniciado")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Apagado ordenado: deja de consumir, termina lo que está en proceso y devuelve el resto a la cola"""
+    started = time.monotonic()
+    stopped = await asyncio.to_thread(get_supervisor().stop, SHUTDOWN_GRACE_PERIOD)
+    if DELIVERY_MODE == "outbox":
+        remaining = max(SHUTDOWN_GRACE_PERIOD - (time.monotonic() - started), 0)
+        await asyncio.to_thread(get_delivery().drain, remaining)
+    get_prompt_cache().stop()
+    get_response_cache().close()
+    get_idempotency_store().close()
+    get_tracer().close()
+    logger.info(f"Consumidor detenido ({'ordenado' if stopped else 'plazo vencido'})")
+
+
+@app.get("/live")
+async def live() -> dict:
+    """Liveness: el proceso responde y el hilo del consumidor sigue vivo."""
+
+    supervisor = get_supervisor()
+    if supervisor.state != "stopped" and not supervisor.alive:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=supervisor.stats())
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready() -> dict:
+    """Readiness: consumiendo de RabbitMQ, modelo disponible y sin apagado en curso."""
+
+    checks = {
+        "broker": get_supervisor().consuming,
+        "model": _model_ready.is_set(),
+        "draining": _draining.is_set(),
+    }
+    if not checks["broker"] or not checks["model"] or checks["draining"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={**checks, "consumer": get_supervisor().stats()},
+        )
+    return {"status": "ready", **checks}
 
 
 @app.get("/health")
@@ -395,35 +1374,315 @@ async def health() -> dict:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+    """Métricas en formato Prometheus."""
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+async def cache_stats() -> dict:
+    """Estadísticas de la caché de respuestas, de las llamadas coalescidas, del caché de prompt y del registro de idempotencia."""
+
+    return {
+        **get_response_cache().stats(),
+        "inflight": _inflight.stats(),
+        "inflight_chat": _inflight_chat.stats(),
+        "prompt": get_prompt_cache().stats(),
+        "idempotency": get_idempotency_store().stats(),
+    }
+
+
+@app.get("/limits")
+async def limits() -> dict:
+    """Límites actuales de llamadas a Gemini, concurrencia adaptativa y tiempo de espera en cola."""
+
+    return get_limiter().stats()
+
+
+@app.get("/usage")
+async def usage() -> dict:
+    """Tokens usados por clase de pregunta y por modelo, y estado de los presupuestos por thread y usuario."""
+
+    return get_usage().stats()
+
+
+@app.get("/models")
+async def models() -> dict:
+    """Modelos configurados, latencias recientes, hedges lanzados y fallbacks."""
+
+    return get_router().stats()
+
+
+@app.get("/shards")
+async def shards() -> dict:
+    """Shards asignados a esta réplica, réplicas vivas y estado del router de la cola principal."""
+
+    if _shards is None:
+        return {"enabled": False, "replica_id": REPLICA_ID}
+    return {"enabled": True, **_shards.stats()}
+
+
+@app.get("/delivery/stats")
+async def delivery_stats() -> dict:
+    """Estado del outbox de entregas y del circuit breaker del servicio de mensajes."""
+
+    return get_delivery().stats()
+
+
+def build_replay_job(queue: str, filters: ReplayFilter, **options) -> ReplayJob:
+    """Arma el reproceso de una DLQ hacia la cola de la que provienen sus mensajes"""
+    if queue == FAILED_QUESTIONS_QUEUE:
+        # Con shards, el backlog real está en las colas de shard; las preguntas del quiz vuelven al carril bulk
+        capacity_queues = [QUESTIONS_QUEUE] + [shard_queue_name(QUESTIONS_QUEUE, n) for n in range(SHARD_COUNT)]
+        if BULK_QUEUE:
+            capacity_queues.append(BULK_QUEUE)
+        return ReplayJob(get_rabbitmq_connection, queue, QUESTIONS_QUEUE, filters,
+                         capacity_queues=capacity_queues, bulk_target=BULK_QUEUE or None, **options)
+    if queue == FAILED_RESPONSES_QUEUE:
+        # Nada consume gemini_responses: no se espera a que aparezca un consumidor
+        return ReplayJob(get_rabbitmq_connection, queue, RESPONSES_QUEUE, filters, responses=True,
+                         require_consumer=False, **options)
+    raise ValueError(f"{queue} no es una DLQ conocida ({FAILED_QUESTIONS_QUEUE}, {FAILED_RESPONSES_QUEUE})")
+
+
+_replay_jobs: dict[str, ReplayJob] = {}
+
+
+def require_admin(x_admin_token: str | None = Header(default=None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Endpoints de administración desactivados: falta ADMIN_TOKEN.")
+    if not secrets.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de administración inválido.")
+
+
+def get_replay_job(job_id: str) -> ReplayJob:
+    job = _replay_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No existe ese reproceso.")
+    return job
+
+
+@app.post("/admin/dlq/replay", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(require_admin)])
+def start_dlq_replay(request: ReplayRequest) -> dict:
+    """Inicia el reproceso de una DLQ a ritmo controlado (o solo su inspección, con dry_run)."""
+
+    if any(job.active and job.source == request.queue for job in _replay_jobs.values()):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Ya hay un reproceso en curso para {request.queue}.",
+        )
+    try:
+        job = build_replay_job(
+            request.queue,
+            ReplayFilter(request.thread_id, request.format, request.error, request.older_than, request.newer_than),
+            rate=request.rate,
+            max_backlog=request.max_backlog,
+            limit=request.limit,
+            reset_retries=request.reset_retries,
+            dry_run=request.dry_run,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    _replay_jobs[job.id] = job
+    job.start()
+    return job.progress()
+
+
+@app.get("/admin/dlq/replay", dependencies=[Depends(require_admin)])
+def list_dlq_replays() -> list[dict]:
+    """Progreso de los reprocesos iniciados en esta réplica."""
+
+    return [job.progress() for job in _replay_jobs.values()]
+
+
+@app.get("/admin/dlq/replay/{job_id}", dependencies=[Depends(require_admin)])
+def dlq_replay_progress(job_id: str) -> dict:
+    """Progreso de un reproceso."""
+
+    return get_replay_job(job_id).progress()
+
+
+@app.delete("/admin/dlq/replay/{job_id}", dependencies=[Depends(require_admin)])
+def cancel_dlq_replay(job_id: str) -> dict:
+    """Detiene un reproceso; lo leído y no republicado vuelve a la DLQ."""
+
+    job = get_replay_job(job_id)
+    job.cancel()
+    return job.progress()
+
+
+# Estadísticas de los componentes expuestas como gauges en /metrics (se calculan al hacer scrape)
+metrics.register_stats("chatbot_response_cache", lambda: get_response_cache().stats())
+metrics.register_stats("chatbot_tracing", lambda: get_tracer().stats())
+metrics.register_stats("chatbot_usage", lambda: get_usage().stats())
+metrics.register_stats("chatbot_idempotency", lambda: get_idempotency_store().stats())
+metrics.register_stats("chatbot_singleflight", lambda: _inflight.stats())
+metrics.register_stats("chatbot_singleflight_chat", lambda: _inflight_chat.stats())
+metrics.register_stats("chatbot_gemini_limiter", lambda: get_limiter().stats())
+metrics.register_stats("chatbot_delivery", lambda: get_delivery().stats())
+metrics.register_stats("chatbot_model_router", lambda: get_router().stats())
+metrics.register_stats("chatbot_micro_batch", lambda: get_batcher().stats())
+metrics.register_stats("chatbot_prompt_cache", lambda: get_prompt_cache().stats())
+metrics.CONSUMER_CONNECTED.set_function(lambda: int(get_supervisor().consuming))
+metrics.register_stats("chatbot_lanes", lambda: _worker_pool.stats() if _worker_pool is not None else {})
+metrics.register_stats("chatbot_shards", lambda: _shards.stats() if _shards is not None else {})
+
+
+# Limita las llamadas concurrentes a Gemini desde /chat; el resto espera
+# hasta CHAT_QUEUE_TIMEOUT segundos antes de recibir un 503 (un evento error en /chat/stream)
+_chat_semaphore = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest) -> ChatResponse:
+    started = time.perf_counter()
+    metrics.CHAT_IN_FLIGHT.inc()
+    try:
+        return await answer_chat(request)
+    finally:
+        metrics.CHAT_IN_FLIGHT.dec()
+        metrics.CHAT_LATENCY.observe(time.perf_counter() - started)
+
+
+async def answer_chat(request: ChatRequest) -> ChatResponse:
+    """Lógica de /chat: valida, espera turno y consulta a Gemini"""
     if not request.message or not request.message.strip():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Debes enviar un mensaje para obtener una respuesta.",
         )
 
-    prompt = build_prompt(request.message)
-
     try:
-        response = get_genai_client().models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
+        await asyncio.wait_for(_chat_semaphore.acquire(), timeout=CHAT_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El servicio está saturado, intenta nuevamente en unos segundos.",
         )
+
+    try:
+        reply = await process_question_with_gemini_async(request.message)
     except HTTPException:
         raise
+    except LimiterTimeout as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Se alcanzó el límite de uso del modelo, intenta nuevamente en unos segundos.",
+        ) from exc
+    except EmptyReplyError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="El modelo no entregó contenido en la respuesta.",
+        ) from exc
     except Exception as exc:  
         logger.exception("Gemini request failed")
         raise HTTPException(
             status_code=status.HTTP_502_BAD_GATEWAY,
             detail="El modelo no pudo generar una respuesta en este momento.",
         ) from exc
+    finally:
+        _chat_semaphore.release()
 
-    reply = (response.text or "").strip() if hasattr(response, "text") else ""
-    if not reply:
+    return ChatResponse(reply=reply)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Serializa un evento server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request) -> StreamingResponse:
+    """Variante de /chat que envía la respuesta por server-sent events a medida que Gemini la genera.
+
+    Eventos: `chunk` ({"text": ...}) por cada fragmento, y al final `done`
+    ({"reply": ..., "cached": ...}) o `error` ({"detail": ...}). Si el servicio
+    está saturado, la respuesta es directamente un `error`.
+    """
+    if not request.message or not request.message.strip():
         raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail="El modelo no entregó contenido en la respuesta.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Debes enviar un mensaje para obtener una respuesta.",
         )
 
-    return ChatResponse(reply=reply)
\ No newline at end of file
+    # Como en /chat, la latencia se mide desde que llega la petición, también con la respuesta en caché
+    started = time.perf_counter()
+    cache = get_response_cache()
+    cache_key = reply_cache_key(request.message)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        async def cached_events():
+            try:
+                yield format_sse("chunk", {"text": cached})
+                yield format_sse("done", {"reply": cached, "cached": True})
+            finally:
+                metrics.CHAT_STREAM_LATENCY.observe(time.perf_counter() - started)
+
+        return StreamingResponse(cached_events(), media_type="text/event-stream")
+
+    async def events():
+        # El cupo se toma dentro del generador: si Starlette nunca lo inicia
+        # (cliente desconectado antes del primer envío) no queda tomado
+        try:
+            await asyncio.wait_for(_chat_semaphore.acquire(), timeout=CHAT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            yield format_sse("error", {"detail": "El servicio está saturado, intenta nuevamente en unos segundos."})
+            metrics.CHAT_STREAM_LATENCY.observe(time.perf_counter() - started)
+            return
+
+        stream = None
+        permit = None
+        chunks = []
+        chunk = None
+        profile = generation_profile(request.message)
+        model = profile.model or GEMINI_MODEL
+        try:
+            prompt = build_prompt(request.message)
+            permit = await get_limiter().acquire_async(estimate_tokens(prompt), timeout=CHAT_QUEUE_TIMEOUT)
+            stream = generate_content_stream(model, prompt, GEMINI_MODELS[0].deadline, profile)
+            async for chunk in stream:
+                if await http_request.is_disconnected():
+                    logger.info("Cliente desconectado, cancelando la generación")
+                    return
+                permit.record_usage(chunk)
+                text = getattr(chunk, "text", None) or ""
+                if text:
+                    chunks.append(text)
+                    yield format_sse("chunk", {"text": text})
+            # El último fragmento trae el uso acumulado de la respuesta
+            if chunk is not None:
+                get_usage().record(chunk, profile.name, model)
+
+            reply = "".join(chunks).strip()
+            if not reply:
+                metrics.EMPTY_REPLIES_TOTAL.inc()
+                yield format_sse("error", {"detail": "El modelo no entregó contenido en la respuesta."})
+                return
+            cache.set(cache_key, reply)
+            yield format_sse("done", {"reply": reply, "cached": False})
+        except HTTPException as exc:
+            yield format_sse("error", {"detail": exc.detail})
+        except LimiterTimeout:
+            yield format_sse("error", {"detail": "Se alcanzó el límite de uso del modelo, intenta nuevamente en unos segundos."})
+        except Exception as exc:
+            logger.exception("Gemini stream failed")
+            if permit is not None:
+                permit.release(exc, sample_latency=False)
+            yield format_sse("error", {"detail": "El modelo no pudo generar una respuesta en este momento."})
+        finally:
+            # Cerrar el stream de Gemini también cuando el cliente se desconecta (CancelledError)
+            if stream is not None:
+                await stream.aclose()
+            if permit is not None:
+                permit.release(sample_latency=False)
+            _chat_semaphore.release()
+            metrics.CHAT_STREAM_LATENCY.observe(time.perf_counter() - started)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
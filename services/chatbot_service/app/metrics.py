@@ -0,0 +1,80 @@
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+# Buckets pensados para etapas que van de microsegundos (decode/ack) a decenas de segundos (Gemini)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    "chatbot_pipeline_stage_seconds",
+    "Duración de cada etapa del callback del consumidor",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+CHAT_REQUEST_SECONDS = Histogram(
+    "chatbot_chat_request_seconds",
+    "Latencia de las peticiones HTTP a /chat y /chat/stream",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+MESSAGES_TOTAL = Counter("chatbot_messages_total", "Mensajes recibidos por formato", ["format"])
+RETRIES_TOTAL = Counter("chatbot_retries_total", "Mensajes republicados para reintento")
+DEAD_LETTERED_TOTAL = Counter("chatbot_dead_lettered_total", "Mensajes enviados a la DLX")
+DUPLICATES_TOTAL = Counter(
+    "chatbot_duplicate_messages_total",
+    "Reentregas de mensajes ya procesados (acked: solo se confirmó; reused: se reutilizó la respuesta)",
+    ["action"],
+)
+EMPTY_REPLIES_TOTAL = Counter("chatbot_empty_replies_total", "Respuestas vacías del modelo")
+MESSAGES_IN_FLIGHT = Gauge("chatbot_messages_in_flight", "Mensajes del consumidor en proceso")
+CHAT_IN_FLIGHT = Gauge("chatbot_chat_in_flight", "Peticiones a /chat en proceso")
+LANE_WAIT_SECONDS = Histogram(
+    "chatbot_lane_wait_seconds",
+    "Espera de cada mensaje en el pool del consumidor antes de tomar un worker, por carril",
+    ["lane"],
+    buckets=LATENCY_BUCKETS,
+)
+CONSUMER_CONNECTED = Gauge("chatbot_consumer_connected", "1 si el consumidor está conectado a RabbitMQ")
+
+# Hijos con etiquetas ya resueltas: en el hot path solo se llama a observe()/inc()
+STAGE_QUEUE_WAIT = PIPELINE_STAGE_SECONDS.labels("queue_wait")
+STAGE_DECODE = PIPELINE_STAGE_SECONDS.labels("decode")
+STAGE_MODEL = PIPELINE_STAGE_SECONDS.labels("model")
+STAGE_DELIVERY = PIPELINE_STAGE_SECONDS.labels("delivery")
+STAGE_FALLBACK = PIPELINE_STAGE_SECONDS.labels("fallback_publish")
+STAGE_ACK = PIPELINE_STAGE_SECONDS.labels("ack")
+CHAT_LATENCY = CHAT_REQUEST_SECONDS.labels("/chat")
+CHAT_STREAM_LATENCY = CHAT_REQUEST_SECONDS.labels("/chat/stream")
+DUPLICATES_ACKED = DUPLICATES_TOTAL.labels("acked")
+DUPLICATES_REUSED = DUPLICATES_TOTAL.labels("reused")
+LANE_WAIT = {
+    "interactive": LANE_WAIT_SECONDS.labels("interactive"),
+    "bulk": LANE_WAIT_SECONDS.labels("bulk"),
+}
+FORMAT_COUNTERS = {
+    "thread": MESSAGES_TOTAL.labels("thread"),
+    "quiz": MESSAGES_TOTAL.labels("quiz"),
+    "unknown": MESSAGES_TOTAL.labels("unknown"),
+}
+
+
+class StatsCollector:
+    """Expone como gauges los valores numéricos de un ``stats()`` existente.
+
+    Se evalúa solo cuando Prometheus hace scrape, así que no agrega costo al
+    procesamiento de mensajes.
+    """
+
+    def __init__(self, prefix: str, stats_fn):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        for key, value in self.stats_fn().items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.prefix} {key}", value=value)
+
+
+def register_stats(prefix: str, stats_fn) -> None:
+    REGISTRY.register(StatsCollector(prefix, stats_fn))
@@ -0,0 +1,134 @@
+import re
+import unicodedata
+from dataclasses import dataclass, fields, replace
+
+# Clases de pregunta (las mismas que distingue SYSTEM_INSTRUCTION)
+CONCEPT = "concept"
+CODE = "code"
+BUGFIX = "bugfix"
+CLASSES = (CONCEPT, CODE, BUGFIX)
+
+_BUGFIX_WORDS = re.compile(
+    r"\b(error\w*|corrig\w*|correg\w*|arregl\w*|falla\w*|bugs?|no funciona|no compila|excepcion\w*|"
+    r"exception|traceback|depur\w*|revis\w*|esta mal|fix)\b"
+)
+_CODE_WORDS = re.compile(
+    r"\b(codigo|ejemplo\w*|snippet|crea|escrib\w*|implement\w*|complet\w*|optimiz\w*|refactoriz\w*|"
+    r"funcion\w*|programa\w*|script|como (hago|hacer|se hace|puedo))\b"
+)
+# Sintaxis de código en el mensaje original: bloques, llamadas, asignaciones, llaves
+_CODE_SYNTAX = re.compile(r"```|\w\(|\s=\s|[;{}]|=>|\bdef |\breturn\b")
+
+
+def _normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def classify(question: str) -> str:
+    """Clase de la pregunta por palabras clave y sintaxis de código, sin llamar al modelo"""
+    text = _normalize(question)
+    if _BUGFIX_WORDS.search(text):
+        return BUGFIX
+    if _CODE_WORDS.search(text) or _CODE_SYNTAX.search(question):
+        return CODE
+    return CONCEPT
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """Parámetros de generación de una clase de pregunta; None deja el default del modelo.
+
+    ``max_output_tokens`` incluye los tokens de razonamiento. ``thinking_budget``
+    0 desactiva el razonamiento y -1 lo deja dinámico; en cada llamada se ajusta
+    a lo que admite el modelo (``thinking_budget_for``), porque el mismo perfil
+    se usa en los fallbacks y hedges. ``model`` debe ser uno de GEMINI_MODELS:
+    pasa a ser el primero de la ruta y el resto queda como fallback.
+    """
+
+    name: str
+    max_output_tokens: int | None = None
+    thinking_budget: int | None = None
+    temperature: float | None = None
+    model: str | None = None
+
+
+DEFAULT_PROFILES = {
+    # Explicaciones: cortas y sin razonamiento
+    CONCEPT: GenerationProfile(CONCEPT, max_output_tokens=1024, thinking_budget=0, temperature=0.7),
+    CODE: GenerationProfile(CODE, max_output_tokens=2048, thinking_budget=512, temperature=0.4),
+    # Encontrar un error sí se beneficia de razonar, pero la respuesta es acotada
+    BUGFIX: GenerationProfile(BUGFIX, max_output_tokens=2048, thinking_budget=1024, temperature=0.2),
+}
+
+# Sin perfiles: la configuración por defecto del modelo
+UNBOUNDED = GenerationProfile("default")
+
+# thinking_budget que admite cada familia de modelos: (mínimo, máximo, si acepta 0 para desactivarlo).
+# Las más específicas primero: gemini-2.5-flash-lite también empieza con gemini-2.5-flash
+THINKING_LIMITS = (
+    ("gemini-2.5-flash-lite", (512, 24576, True)),
+    ("gemini-2.5-flash", (1, 24576, True)),
+    ("gemini-2.5-pro", (128, 32768, False)),
+)
+
+
+def thinking_budget_for(model: str, budget: int | None) -> int | None:
+    """``budget`` ajustado al rango del modelo; None si no se pide o el modelo no admite ``thinking_config``.
+
+    Un modelo fuera de THINKING_LIMITS (sin razonamiento, o de una familia que
+    no se conoce) usa su configuración por defecto: enviarle el presupuesto
+    haría fallar la llamada con un 400.
+    """
+    if budget is None:
+        return None
+    name = model.removeprefix("models/")
+    limits = next((limits for prefix, limits in THINKING_LIMITS if name.startswith(prefix)), None)
+    if limits is None:
+        return None
+    minimum, maximum, can_disable = limits
+    if budget < 0:
+        return -1
+    if budget == 0:
+        # gemini-2.5-pro no puede dejar de razonar: se usa el mínimo
+        return 0 if can_disable else minimum
+    return max(minimum, min(budget, maximum))
+
+
+_CONVERTERS = {"max_output_tokens": int, "thinking_budget": int, "temperature": float, "model": str}
+
+
+def parse_profile(spec: str, base: GenerationProfile) -> GenerationProfile:
+    """Aplica ``"clave=valor,..."`` sobre ``base``; un valor vacío vuelve al default del modelo"""
+    changes = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        key, _, value = part.partition("=")
+        key, value = key.strip(), value.strip()
+        if key not in _CONVERTERS:
+            raise ValueError(f"Parámetro de perfil desconocido: {key} (válidos: {', '.join(_CONVERTERS)})")
+        changes[key] = _CONVERTERS[key](value) if value else None
+    return replace(base, **changes)
+
+
+def combine(profiles: list[GenerationProfile], name: str = "batch") -> GenerationProfile:
+    """Perfil de un micro-lote: suma de los límites de salida, mayor razonamiento y menor temperatura"""
+    values = {}
+    for field in fields(GenerationProfile):
+        if field.name == "name":
+            continue
+        items = [getattr(profile, field.name) for profile in profiles]
+        if any(item is None for item in items):
+            # Alguna pregunta usa el default del modelo: el lote también
+            values[field.name] = None
+        elif field.name == "max_output_tokens":
+            values[field.name] = sum(items)
+        elif field.name == "thinking_budget":
+            values[field.name] = -1 if -1 in items else max(items)
+        elif field.name == "temperature":
+            values[field.name] = min(items)
+        else:
+            values[field.name] = items[0] if len(set(items)) == 1 else None
+    return GenerationProfile(name, **values)
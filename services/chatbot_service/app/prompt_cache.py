@@ -0,0 +1,250 @@
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+
+DISPLAY_PREFIX = "chatbot-prompt-"
+
+
+def prompt_fingerprint(system_instruction: str) -> str:
+    return hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16]
+
+
+def is_too_small_error(exc: BaseException) -> bool:
+    """Gemini rechazó el caché por no alcanzar su mínimo de tokens: reintentar no sirve"""
+    return isinstance(exc, errors.ClientError) and exc.code == 400 and "too small" in str(exc).lower()
+
+
+def _same_model(a: str, b: str) -> bool:
+    # La API retorna "models/<modelo>"
+    return (a or "").split("/")[-1] == (b or "").split("/")[-1]
+
+
+@dataclass
+class _CacheEntry:
+    name: str
+    expires_at: float  # time.monotonic()
+
+
+class PromptCacheManager:
+    """Registra la instrucción de sistema fija como contenido en caché de Gemini (uno por modelo).
+
+    - Al iniciar adopta un caché existente con la misma huella del template
+      (otras réplicas o un reinicio) o crea uno nuevo; los cachés de un
+      template anterior se eliminan.
+    - Un hilo en segundo plano extiende el TTL ``refresh_margin`` segundos
+      antes de que venza y lo recrea si desapareció.
+    - Las peticiones nunca esperan por el caché: ``cached_content(model)``
+      retorna None si no hay uno vigente y el llamador envía la instrucción
+      como ``system_instruction`` en cada llamada.
+
+    Si la creación falla se reintenta cada ``retry_interval`` segundos y
+    mientras tanto se usa el fallback. Un rechazo por estar debajo del mínimo
+    de tokens del modelo no cambia mientras no cambie el template: el caché de
+    ese modelo queda desactivado para esta huella.
+    """
+
+    def __init__(self, client_factory, models: list[str], system_instruction: str,
+                 ttl: float = 3600, refresh_margin: float = 300, retry_interval: float = 300,
+                 enabled: bool = True):
+        self.client_factory = client_factory
+        self.models = list(dict.fromkeys(models))
+        self.system_instruction = system_instruction
+        self.fingerprint = prompt_fingerprint(system_instruction)
+        self.display_name = f"{DISPLAY_PREFIX}{self.fingerprint}"
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.retry_interval = retry_interval
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._entries: dict[str, _CacheEntry] = {}
+        self._retry_at: dict[str, float] = {}
+        self._too_small: set[str] = set()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.created = 0
+        self.adopted = 0
+        self.refreshed = 0
+        self.deleted_stale = 0
+        self.failures = 0
+        self.uncached_calls = 0
+
+    def cached_content(self, model: str) -> str | None:
+        """Nombre del caché vigente para ``model`` (None = enviar la instrucción completa)"""
+        if self.enabled:
+            with self._lock:
+                entry = self._entries.get(model)
+                # Margen para que el caché no venza durante la llamada
+                if entry is not None and entry.expires_at - time.monotonic() > 30:
+                    return entry.name
+                self.uncached_calls += 1
+        return None
+
+    def invalidate(self, model: str) -> None:
+        """Olvida el caché de ``model`` (p. ej. si Gemini lo rechazó); el hilo de refresco lo recrea"""
+        with self._lock:
+            self._entries.pop(model, None)
+            self._retry_at.pop(model, None)
+
+    @staticmethod
+    def _expires_at(cache) -> float:
+        expire_time = getattr(cache, "expire_time", None)
+        if expire_time is None:
+            return time.monotonic()
+        remaining = (expire_time - datetime.now(timezone.utc)).total_seconds()
+        return time.monotonic() + remaining
+
+    def _ttl(self) -> str:
+        return f"{int(self.ttl)}s"
+
+    def _adopt_or_create(self, client, model: str) -> _CacheEntry:
+        adopted = None
+        for cache in client.caches.list():
+            display_name = getattr(cache, "display_name", None) or ""
+            if not display_name.startswith(DISPLAY_PREFIX) or not _same_model(cache.model, model):
+                continue
+            if display_name == self.display_name and adopted is None:
+                adopted = cache
+            elif display_name != self.display_name:
+                # Caché de un template anterior
+                client.caches.delete(name=cache.name)
+                self.deleted_stale += 1
+                logger.info(f"Caché de prompt obsoleto eliminado: {cache.name}")
+
+        if adopted is not None:
+            # Extender de inmediato: no se sabe cuánto le queda
+            cache = client.caches.update(name=adopted.name, config=types.UpdateCachedContentConfig(ttl=self._ttl()))
+            self.adopted += 1
+        else:
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=self.system_instruction,
+                    display_name=self.display_name,
+                    ttl=self._ttl(),
+                ),
+            )
+            self.created += 1
+            logger.info(f"Caché de prompt creado para {model}: {cache.name}")
+        return _CacheEntry(cache.name, self._expires_at(cache))
+
+    def _failed(self, model: str, exc: BaseException) -> None:
+        self.failures += 1
+        if is_too_small_error(exc):
+            logger.warning(
+                f"La instrucción de sistema no alcanza el mínimo de tokens de {model} para el caché de prompt; "
+                f"se desactiva para el template {self.fingerprint}"
+            )
+            with self._lock:
+                self._entries.pop(model, None)
+                self._too_small.add(model)
+            return
+        logger.warning(
+            f"Sin caché de prompt para {model} ({exc}); se enviará la instrucción completa "
+            f"y se reintentará en {self.retry_interval:.0f}s"
+        )
+        with self._lock:
+            self._entries.pop(model, None)
+            self._retry_at[model] = time.monotonic() + self.retry_interval
+
+    def _refresh_model(self, client, model: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if model in self._too_small:
+                return
+            entry = self._entries.get(model)
+            retry_at = self._retry_at.get(model, 0)
+        if entry is None and now < retry_at:
+            return
+        if entry is not None and entry.expires_at - now > self.refresh_margin:
+            return
+
+        try:
+            if entry is None:
+                entry = self._adopt_or_create(client, model)
+            else:
+                try:
+                    cache = client.caches.update(name=entry.name, config=types.UpdateCachedContentConfig(ttl=self._ttl()))
+                    entry = _CacheEntry(cache.name, self._expires_at(cache))
+                    self.refreshed += 1
+                except Exception as exc:
+                    # Venció o fue eliminado: crear otro
+                    logger.warning(f"No se pudo extender el caché de prompt {entry.name}: {exc}")
+                    entry = self._adopt_or_create(client, model)
+        except Exception as exc:
+            self._failed(model, exc)
+            return
+
+        with self._lock:
+            self._entries[model] = entry
+
+    def refresh(self) -> None:
+        """Crea, adopta o extiende los cachés que lo necesiten"""
+        if not self.enabled:
+            return
+        try:
+            client = self.client_factory()
+        except Exception as exc:
+            for model in self.models:
+                self._failed(model, exc)
+            return
+        for model in self.models:
+            self._refresh_model(client, model)
+
+    def _next_check(self) -> float:
+        now = time.monotonic()
+        deadlines = []
+        with self._lock:
+            for model in self.models:
+                entry = self._entries.get(model)
+                if entry is not None:
+                    deadlines.append(entry.expires_at - self.refresh_margin)
+                elif model not in self._too_small:
+                    deadlines.append(self._retry_at.get(model, now))
+        if not deadlines:
+            return 300.0
+        return min(max(min(deadlines) - now, 1.0), 300.0)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Error al refrescar el caché de prompt")
+            self._stop.wait(self._next_check())
+
+    def start(self) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True, name="prompt-cache")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            caches = {
+                model: {"name": entry.name, "expires_in_s": round(entry.expires_at - now, 1)}
+                for model, entry in self._entries.items()
+            }
+            return {
+                "enabled": self.enabled,
+                "fingerprint": self.fingerprint,
+                "caches": caches,
+                "created": self.created,
+                "adopted": self.adopted,
+                "refreshed": self.refreshed,
+                "deleted_stale": self.deleted_stale,
+                "failures": self.failures,
+                "too_small": sorted(self._too_small),
+                "uncached_calls": self.uncached_calls,
+            }
@@ -0,0 +1,227 @@
+import asyncio
+import threading
+import time
+
+
+class LimiterTimeout(Exception):
+    """No se obtuvo cupo para llamar al modelo dentro del tiempo de espera."""
+
+
+class TokenBucket:
+    """Token bucket con recarga continua; ``per_minute=0`` significa sin límite."""
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.per_minute = per_minute
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.per_minute / 60.0)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Segundos hasta que haya ``amount`` tokens (0 si ya los hay)"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        # Una petición más grande que la capacidad pasa con el bucket lleno
+        amount = min(amount, self.capacity)
+        if self._tokens >= amount:
+            return 0.0
+        return (amount - self._tokens) * 60.0 / self.per_minute
+
+    def take(self, amount: float) -> None:
+        """Descuenta tokens; puede quedar negativo al corregir con el uso real"""
+        if not self.unlimited:
+            self._tokens -= amount
+
+    @property
+    def available(self) -> float | None:
+        if self.unlimited:
+            return None
+        self._refill(time.monotonic())
+        return round(self._tokens, 2)
+
+
+class Permit:
+    """Cupo para una llamada al modelo. Se libera al salir del bloque ``with``."""
+
+    def __init__(self, limiter: "GeminiLimiter", tokens: float, waited: float):
+        self._limiter = limiter
+        self.tokens = tokens
+        self.waited = waited
+        self.started = time.monotonic()
+        self.used_tokens = None
+        self._released = False
+
+    def record_usage(self, response) -> None:
+        """Registra el uso real de tokens informado por Gemini (usage_metadata)"""
+        usage = getattr(response, "usage_metadata", None)
+        total = getattr(usage, "total_token_count", None)
+        if total:
+            self.used_tokens = total
+
+    def release(self, exc: BaseException = None, sample_latency: bool = True) -> None:
+        """Libera el cupo (idempotente). ``sample_latency=False`` para llamadas en streaming"""
+        if not self._released:
+            self._released = True
+            self._limiter.release(self, exc, sample_latency)
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release(exc)
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """429 o 5xx del modelo: señal de que hay que bajar la concurrencia"""
+    code = getattr(exc, "code", None)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+
+class GeminiLimiter:
+    """Limitador compartido para las llamadas a Gemini.
+
+    Combina dos token buckets (peticiones por minuto y tokens por minuto) con
+    un límite de concurrencia adaptativo AIMD: sube de a poco con cada
+    respuesta exitosa y se reduce multiplicativamente ante 429/5xx o cuando
+    la latencia se dispara respecto de la línea base.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 initial_concurrency: float = 8, min_concurrency: float = 1,
+                 max_concurrency: float = 32, backoff_factor: float = 0.5,
+                 latency_factor: float = 2.0, latency_backoff: float = 0.9):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = float(initial_concurrency)
+        self.min_concurrency = float(min_concurrency)
+        self.max_concurrency = float(max_concurrency)
+        self.backoff_factor = backoff_factor
+        self.latency_factor = latency_factor
+        self.latency_backoff = latency_backoff
+
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.latency_baseline = None
+        self._samples = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.acquired = 0
+        self.overloads = 0
+
+    def _try_acquire(self, tokens: float) -> float:
+        """Toma el cupo si es posible (retorna 0) o retorna cuánto conviene esperar"""
+        if self.in_flight >= max(int(self.concurrency), 1):
+            return 0.5
+        now = time.monotonic()
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.in_flight += 1
+        return 0.0
+
+    def _granted(self, tokens: float, started: float) -> Permit:
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return Permit(self, tokens, waited)
+
+    def acquire(self, tokens: float = 0, timeout: float = None) -> Permit:
+        """Bloquea hasta obtener cupo. Sin timeout espera indefinidamente."""
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    wait = self._try_acquire(tokens)
+                    if wait == 0:
+                        return self._granted(tokens, started)
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise LimiterTimeout("Sin cupo para llamar al modelo")
+                        wait = min(wait, remaining)
+                    self._cond.wait(timeout=wait)
+            finally:
+                self.waiting -= 1
+
+    async def acquire_async(self, tokens: float = 0, timeout: float = None) -> Permit:
+        """Variante asíncrona de ``acquire`` que no bloquea el event loop"""
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire(tokens)
+                    if wait == 0:
+                        return self._granted(tokens, started)
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LimiterTimeout("Sin cupo para llamar al modelo")
+                    wait = min(wait, remaining)
+                await asyncio.sleep(min(wait, 0.05))
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self, permit: Permit, exc: BaseException = None, sample_latency: bool = True) -> None:
+        latency = time.monotonic() - permit.started
+        with self._cond:
+            self.in_flight -= 1
+            if permit.used_tokens is not None and permit.used_tokens > permit.tokens:
+                # Corregir la estimación con el uso real
+                self.tokens.take(permit.used_tokens - permit.tokens)
+
+            if exc is not None and is_overload_error(exc):
+                self.overloads += 1
+                self.concurrency = max(self.min_concurrency, self.concurrency * self.backoff_factor)
+            elif exc is None and sample_latency:
+                spike = (
+                    self._samples >= 10
+                    and self.latency_baseline
+                    and latency > self.latency_baseline * self.latency_factor
+                )
+                if spike:
+                    self.concurrency = max(self.min_concurrency, self.concurrency * self.latency_backoff)
+                else:
+                    # Incremento aditivo: +1 por cada "ventana" completa de llamadas exitosas
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self._samples += 1
+                if self.latency_baseline is None:
+                    self.latency_baseline = latency
+                else:
+                    self.latency_baseline = 0.9 * self.latency_baseline + 0.1 * latency
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "concurrency_limit": round(self.concurrency, 2),
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "requests_per_minute": self.requests.per_minute,
+                "requests_available": self.requests.available,
+                "tokens_per_minute": self.tokens.per_minute,
+                "tokens_available": self.tokens.available,
+                "latency_baseline_ms": round(self.latency_baseline * 1000, 1) if self.latency_baseline else None,
+                "acquired": self.acquired,
+                "overloads": self.overloads,
+                "avg_queue_wait_ms": round(self.total_wait / self.acquired * 1000, 2) if self.acquired else 0.0,
+                "max_queue_wait_ms": round(self.max_wait * 1000, 2),
+            }
@@ -0,0 +1,404 @@
+"""Reproceso de las colas de mensajes fallidos (DLQ).
+
+Uso desde services/chatbot_service (con la misma configuración del servicio)::
+
+    python -m app.replay failed_questions_queue --rate 5 --error 429 --older-than 60
+    python -m app.replay failed_questions_queue --dry-run --thread <thread_id>
+
+También disponible en ``POST /admin/dlq/replay``.
+"""
+
+import argparse
+import copy
+import logging
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from . import envelope, tracing
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RETRY_HEADER = "x-retry-count"
+ERROR_HEADER = "x-last-error"
+REPLAY_HEADER = "x-replay-count"
+
+
+@dataclass
+class MessageInfo:
+    question_id: str
+    thread_id: str | None
+    format: str
+    error: str | None
+    retry_count: int
+    dead_lettered_at: float | None  # epoch
+
+
+def _epoch(value) -> float | None:
+    if isinstance(value, datetime):
+        # pika entrega los timestamps AMQP como datetime UTC sin zona
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
+def dead_lettered_at(properties) -> float | None:
+    """Momento en que el mensaje llegó a la DLQ (x-death), o su timestamp si no lo hay"""
+    deaths = (properties.headers or {}).get("x-death") or []
+    if deaths and isinstance(deaths[0], dict):
+        moment = _epoch(deaths[0].get("time"))
+        if moment is not None:
+            return moment
+    return _epoch(properties.timestamp)
+
+
+def describe(properties, body: bytes, responses: bool = False) -> MessageInfo:
+    """Resume un mensaje de la DLQ para filtrarlo e inspeccionarlo"""
+    headers = properties.headers or {}
+    info = MessageInfo(
+        question_id="unknown",
+        thread_id=None,
+        format="unknown",
+        error=headers.get(ERROR_HEADER),
+        retry_count=int(headers.get(RETRY_HEADER, 0) or 0),
+        dead_lettered_at=dead_lettered_at(properties),
+    )
+    try:
+        if responses and envelope.VERSION_HEADER in headers:
+            message = envelope.decode(body, properties.content_type, headers)
+        else:
+            # Las respuestas v1 tienen los campos del formato del quiz (question_id, question)
+            message, info.format = envelope.decode_question(body, properties.content_type, headers)
+    except envelope.EnvelopeError:
+        return info
+    if responses:
+        info.format = "response"
+    info.question_id = message.question_id
+    info.thread_id = message.thread_id
+    return info
+
+
+@dataclass
+class ReplayFilter:
+    """Criterios de selección; los que quedan en None no filtran"""
+    thread_id: str | None = None
+    format: str | None = None
+    error: str | None = None  # subcadena de x-last-error, sin distinguir mayúsculas
+    older_than: float | None = None  # segundos desde que llegó a la DLQ
+    newer_than: float | None = None
+
+    def matches(self, info: MessageInfo, now: float) -> bool:
+        if self.thread_id is not None and info.thread_id != self.thread_id:
+            return False
+        if self.format is not None and info.format != self.format:
+            return False
+        if self.error is not None and self.error.lower() not in (info.error or "").lower():
+            return False
+        if self.older_than is not None or self.newer_than is not None:
+            if info.dead_lettered_at is None:
+                return False
+            age = now - info.dead_lettered_at
+            if self.older_than is not None and age < self.older_than:
+                return False
+            if self.newer_than is not None and age > self.newer_than:
+                return False
+        return True
+
+
+def replay_properties(properties, reset_retries: bool = True):
+    """Propiedades para republicar: reinicia el contador de reintentos y quita el historial de x-death"""
+    replayed = copy.copy(properties)
+    headers = dict(properties.headers or {})
+    if reset_retries:
+        headers[RETRY_HEADER] = 0
+    headers.pop("x-death", None)
+    headers.pop("x-first-death-exchange", None)
+    headers.pop("x-first-death-queue", None)
+    headers.pop("x-first-death-reason", None)
+    headers[REPLAY_HEADER] = int(headers.get(REPLAY_HEADER, 0) or 0) + 1
+    # La espera en cola se mide desde la republicación, no desde el envío original
+    headers[tracing.PUBLISHED_AT_HEADER] = time.time()
+    replayed.headers = headers
+    replayed.expiration = None
+    replayed.delivery_mode = 2
+    return replayed
+
+
+class ReplayJob:
+    """Recorre una DLQ y republica en ``target`` los mensajes que cumplen el filtro.
+
+    - Lee con ``basic_get`` a lo sumo tantos mensajes como tenía la cola al
+      empezar, así que no retiene la cola en memoria ni da vueltas sobre los
+      que van llegando.
+    - Los que no cumplen el filtro (o todos, en ``dry_run``) quedan sin ack
+      hasta el final y vuelven a la DLQ en su orden original. Si se acumulan
+      ``hold_limit`` o pasan ``hold_timeout`` segundos (el broker cierra el
+      canal al vencer su ``consumer_timeout``), se republican al final de la
+      DLQ, también en orden, y se confirman.
+    - Republica con publisher confirms y recién entonces confirma el original.
+      Con ``bulk_target``, las preguntas del carril bulk (``x-lane: bulk``) sin
+      thread vuelven a esa cola en lugar de a ``target``; las de un thread van
+      siempre a ``target``, la única que se reparte por thread.
+    - Ritmo: a lo sumo ``rate`` mensajes por segundo, y se pausa mientras
+      las colas de ``capacity_queues`` tengan ``max_backlog`` mensajes o más,
+      o (con ``require_consumer``) ``target`` no tenga consumidores.
+    """
+
+    def __init__(self, connection_factory, source: str, target: str, filters: ReplayFilter = None,
+                 rate: float = 5, max_backlog: int = 50, capacity_queues: list[str] = None,
+                 limit: int = None, reset_retries: bool = True, dry_run: bool = False,
+                 responses: bool = False, sample_size: int = 20, capacity_interval: float = 0.5,
+                 require_consumer: bool = True, hold_limit: int = 1000, hold_timeout: float = 600,
+                 bulk_target: str = None):
+        # Un TokenBucket sin cuota no limita: el reproceso saturaría de nuevo la cola de trabajo
+        if rate <= 0:
+            raise ValueError("rate debe ser mayor que 0")
+        if max_backlog < 1:
+            raise ValueError("max_backlog debe ser al menos 1")
+        if limit is not None and limit < 1:
+            raise ValueError("limit debe ser al menos 1")
+        self.id = uuid.uuid4().hex[:12]
+        self.connection_factory = connection_factory
+        self.source = source
+        self.target = target
+        self.filters = filters or ReplayFilter()
+        self.rate = rate
+        self.max_backlog = max_backlog
+        self.capacity_queues = list(capacity_queues or [target])
+        self.limit = limit
+        self.reset_retries = reset_retries
+        self.dry_run = dry_run
+        self.responses = responses
+        self.sample_size = sample_size
+        self.capacity_interval = capacity_interval
+        self.require_consumer = require_consumer
+        self.bulk_target = bulk_target
+        self.hold_limit = hold_limit
+        self.hold_timeout = hold_timeout
+        # Leídos sin ack que no se republican en target: (delivery_tag, properties, body)
+        self._held: list[tuple] = []
+        self._held_since = None
+        self._moving = False
+        self._bucket = TokenBucket(per_minute=rate * 60, capacity=1)
+        self._cancel = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.state = "pending"
+        self.error = None
+        self.total = None
+        self.scanned = 0
+        self.matched = 0
+        self.replayed = 0
+        self.skipped = 0
+        self.moved_to_tail = 0
+        self.waited_s = 0.0
+        self.sample: list[dict] = []
+        self.started_at = None
+        self.finished_at = None
+
+    def target_for(self, info: MessageInfo, properties) -> str:
+        if self.bulk_target and info.thread_id is None and envelope.lane(properties.headers) == envelope.BULK:
+            return self.bulk_target
+        return self.target
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("pending", "running", "waiting")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, daemon=True, name=f"dlq-replay-{self.id}")
+        self._thread.start()
+
+    def join(self, timeout: float = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _has_capacity(self, channel) -> bool:
+        backlog = 0
+        for queue in self.capacity_queues:
+            result = channel.queue_declare(queue=queue, durable=True, passive=True)
+            backlog += result.method.message_count
+            if self.require_consumer and queue == self.target and result.method.consumer_count == 0:
+                return False
+        return backlog < self.max_backlog
+
+    def _hold(self, channel, method, properties, body) -> None:
+        self._held.append((method.delivery_tag, properties, body))
+        if self._held_since is None:
+            self._held_since = time.monotonic()
+        self._release_held(channel)
+
+    def _release_held(self, channel) -> None:
+        """Pasa al final de la DLQ los mensajes retenidos si son demasiados o llevan mucho tiempo sin ack"""
+        if not self._held:
+            return
+        # Una vez que se empezó a mover, se mueve todo para conservar el orden
+        if not (self._moving or len(self._held) >= self.hold_limit
+                or time.monotonic() - self._held_since >= self.hold_timeout):
+            return
+        self._moving = True
+        for delivery_tag, properties, body in self._held:
+            channel.basic_publish(exchange="", routing_key=self.source, body=body, properties=properties,
+                                  mandatory=True)
+            channel.basic_ack(delivery_tag=delivery_tag)
+            self.moved_to_tail += 1
+        self._held = []
+        self._held_since = None
+
+    def _wait_for_capacity(self, connection, channel) -> bool:
+        """Espera turno según el ritmo y la capacidad del consumidor. False si se canceló"""
+        next_check = 0.0
+        while not self._cancel.is_set():
+            self._release_held(channel)
+            now = time.monotonic()
+            if now >= next_check:
+                if not self._has_capacity(channel):
+                    self.state = "waiting"
+                    connection.sleep(self.capacity_interval)
+                    self.waited_s += self.capacity_interval
+                    continue
+                next_check = now + self.capacity_interval
+            wait = self._bucket.wait_time(1, now)
+            if wait > 0:
+                connection.sleep(wait)
+                continue
+            self._bucket.take(1)
+            self.state = "running"
+            return True
+        return False
+
+    def run(self) -> None:
+        self.started_at = time.time()
+        self.state = "running"
+        connection = None
+        channel = None
+        try:
+            connection = self.connection_factory()
+            channel = connection.channel()
+            # También en dry_run: los retenidos pueden republicarse al final de la DLQ
+            channel.confirm_delivery()
+            self.total = channel.queue_declare(queue=self.source, durable=True, passive=True).method.message_count
+            logger.info(f"Replay {self.id}: {self.total} mensajes en {self.source} -> {self.target}")
+
+            while self.scanned < self.total and not self._cancel.is_set():
+                if self.limit is not None and self.matched >= self.limit:
+                    break
+                method, properties, body = channel.basic_get(queue=self.source, auto_ack=False)
+                if method is None:
+                    break
+                self.scanned += 1
+                info = describe(properties, body, self.responses)
+                if not self.filters.matches(info, time.time()):
+                    self.skipped += 1
+                    self._hold(channel, method, properties, body)
+                    continue
+                self.matched += 1
+                if len(self.sample) < self.sample_size:
+                    self.sample.append(asdict(info))
+                if self.dry_run:
+                    self._hold(channel, method, properties, body)
+                    continue
+                if not self._wait_for_capacity(connection, channel):
+                    break
+                channel.basic_publish(
+                    exchange="",
+                    routing_key=self.target_for(info, properties),
+                    body=body,
+                    properties=replay_properties(properties, self.reset_retries),
+                    mandatory=True,
+                )
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+                self.replayed += 1
+            self.state = "cancelled" if self._cancel.is_set() else "done"
+        except Exception as exc:
+            self.state = "failed"
+            self.error = str(exc)
+            logger.error(f"Replay {self.id} falló: {exc}")
+        finally:
+            if channel is not None and channel.is_open and self.scanned > self.replayed + self.moved_to_tail:
+                # Devuelve a la DLQ, en orden, todo lo leído y no republicado
+                channel.basic_nack(delivery_tag=0, multiple=True, requeue=True)
+            if connection is not None and connection.is_open:
+                connection.close()
+            self.finished_at = time.time()
+            logger.info(f"Replay {self.id} {self.state}: {self.replayed} republicados de {self.scanned} leídos")
+
+    def progress(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        remaining = max((self.total or 0) - self.scanned, 0)
+        rate = self.scanned / elapsed if elapsed > 0 else 0.0
+        return {
+            "id": self.id,
+            "state": self.state,
+            "source": self.source,
+            "target": self.target,
+            "dry_run": self.dry_run,
+            "filters": asdict(self.filters),
+            "total": self.total,
+            "scanned": self.scanned,
+            "matched": self.matched,
+            "replayed": self.replayed,
+            "skipped": self.skipped,
+            "moved_to_tail": self.moved_to_tail,
+            "elapsed_s": round(elapsed, 1),
+            "waited_for_capacity_s": round(self.waited_s, 1),
+            "eta_s": round(remaining / rate, 1) if rate > 0 and self.active else None,
+            "error": self.error,
+            "sample": self.sample,
+        }
+
+
+def main_cli() -> None:
+    from . import main
+
+    parser = argparse.ArgumentParser(description="Reprocesa mensajes de una DLQ")
+    parser.add_argument("queue", help="DLQ de origen (p. ej. failed_questions_queue)")
+    parser.add_argument("--rate", type=float, default=main.REPLAY_RATE, help="Mensajes por segundo")
+    parser.add_argument("--max-backlog", type=int, default=main.REPLAY_MAX_BACKLOG)
+    parser.add_argument("--limit", type=int, help="Máximo de mensajes a republicar")
+    parser.add_argument("--thread", dest="thread_id")
+    parser.add_argument("--format", choices=["thread", "quiz", "unknown", "response"])
+    parser.add_argument("--error", help="Subcadena del último error registrado")
+    parser.add_argument("--older-than", type=float, help="Segundos mínimos en la DLQ")
+    parser.add_argument("--newer-than", type=float, help="Segundos máximos en la DLQ")
+    parser.add_argument("--keep-retries", action="store_true", help="No reiniciar x-retry-count")
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar e inspeccionar")
+    args = parser.parse_args()
+
+    job = main.build_replay_job(
+        args.queue,
+        ReplayFilter(args.thread_id, args.format, args.error, args.older_than, args.newer_than),
+        rate=args.rate,
+        max_backlog=args.max_backlog,
+        limit=args.limit,
+        reset_retries=not args.keep_retries,
+        dry_run=args.dry_run,
+    )
+    job.start()
+    while job.active:
+        job.join(1)
+        progress = job.progress()
+        print(
+            f"{progress['state']:<9} leídos {progress['scanned']}/{progress['total'] or '?'}  "
+            f"seleccionados {progress['matched']}  republicados {progress['replayed']}  "
+            f"eta {progress['eta_s'] if progress['eta_s'] is not None else '-'}s"
+        )
+    progress = job.progress()
+    for info in progress["sample"]:
+        print(info)
+    if progress["error"]:
+        raise SystemExit(f"Error: {progress['error']}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,73 @@
+import random
+import re
+
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*s?\s*$")
+
+
+def parse_delays(raw: str) -> list[float]:
+    """Convierte "5,30,120" en [5.0, 30.0, 120.0]"""
+    return [float(part) for part in raw.split(",") if part.strip()]
+
+
+def retry_queue_name(source_queue: str, tier: int) -> str:
+    """Nombre de la cola de espera del nivel ``tier`` (1..N) para ``source_queue``"""
+    return f"{source_queue}.retry.{tier}"
+
+
+def _find_retry_delay(details) -> str | None:
+    if isinstance(details, dict):
+        if "retryDelay" in details:
+            return details["retryDelay"]
+        values = details.values()
+    elif isinstance(details, list):
+        values = details
+    else:
+        return None
+    for value in values:
+        found = _find_retry_delay(value)
+        if found is not None:
+            return found
+    return None
+
+
+def retry_after_hint(exc: BaseException) -> float | None:
+    """Segundos sugeridos por el servidor antes de reintentar, si el error los trae.
+
+    Considera el header ``Retry-After`` de la respuesta HTTP y el ``RetryInfo``
+    (``retryDelay: "23s"``) que Gemini incluye en los errores 429.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            match = _DURATION.match(str(value))
+            if match:
+                return float(match.group(1))
+
+    delay = _find_retry_delay(getattr(exc, "details", None))
+    if delay is not None:
+        match = _DURATION.match(str(delay))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def choose_retry_delay(retry_count: int, delays: list[float], retry_after: float = None) -> tuple[int, float]:
+    """Elige el nivel de espera (1..N) para el siguiente intento y su retardo en segundos (el TTL del nivel).
+
+    El nivel crece con ``retry_count`` (backoff exponencial definido por los TTL
+    de las colas). Si el servidor indicó un ``retry_after``, se sube al primer
+    nivel que lo respete. El jitter va entre niveles: la mitad de las veces se
+    usa el siguiente, para que los mensajes que fallaron juntos no vuelvan
+    todos al mismo tiempo. No se usa ``expiration`` por mensaje: en una cola
+    clásica solo vence el mensaje de la cabeza, así que uno más corto detrás
+    de otro más largo esperaría de todos modos lo del primero.
+    """
+    tier = min(retry_count, len(delays) - 1)
+    if retry_after:
+        while tier < len(delays) - 1 and delays[tier] < retry_after:
+            tier += 1
+    if tier < len(delays) - 1 and random.random() < 0.5:
+        tier += 1
+    return tier + 1, delays[tier]
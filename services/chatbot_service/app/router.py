@@ -0,0 +1,313 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+
+class ModelDeadlineExceeded(TimeoutError):
+    """El modelo no respondió dentro de su deadline."""
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    name: str
+    deadline: float
+
+
+def parse_models(spec: str, default_deadline: float) -> list[ModelRoute]:
+    """Parsea ``"modelo[:deadline],..."`` (deadline en segundos) en orden de preferencia"""
+    routes = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, deadline = part.partition(":")
+        routes.append(ModelRoute(name.strip(), float(deadline) if deadline else default_deadline))
+    if not routes:
+        raise ValueError("Se requiere al menos un modelo")
+    return routes
+
+
+class LatencyWindow:
+    """Últimas latencias exitosas de un modelo, para calcular el percentil de hedging"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, pct: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+
+class _Attempt:
+    __slots__ = ("route", "hedge", "started", "deadline_at")
+
+    def __init__(self, route: ModelRoute, hedge: bool):
+        self.route = route
+        self.hedge = hedge
+        self.started = time.monotonic()
+        self.deadline_at = self.started + route.deadline
+
+
+class ModelRouter:
+    """Enruta cada generación por una lista ordenada de modelos.
+
+    - Cada modelo tiene su deadline; si se vence o el modelo falla, se pasa al
+      siguiente de inmediato (sin pasar por el ciclo de reintentos del consumidor).
+    - Hedging: si el intento principal no respondió al llegar al percentil
+      ``hedge_percentile`` de su latencia reciente, se lanza un segundo intento
+      (al siguiente modelo, o al mismo si hay uno solo) y se usa el primero que
+      termine. El perdedor se cancela (en la variante síncrona se abandona: el
+      timeout HTTP del SDK lo acota).
+    - ``hedge_max_ratio`` acota los hedges a una fracción de las peticiones
+      para no amplificar la carga cuando todo el backend está lento.
+
+    ``attempt(model, timeout, hedge)`` es la llamada real al modelo. Con
+    ``model`` se prefiere otro de los modelos configurados para esa petición.
+    """
+
+    def __init__(self, routes: list[ModelRoute], hedge_percentile: float = 95,
+                 hedge_min_delay: float = 0.5, hedge_min_samples: int = 20,
+                 hedge_max_ratio: float = 0.1, window_size: int = 200, max_workers: int = 32):
+        self.routes = list(routes)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self._latency = {route.name: LatencyWindow(window_size) for route in self.routes}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.deadlines_exceeded = 0
+        self.failures = 0
+        self.served_by = {route.name: 0 for route in self.routes}
+
+    @property
+    def primary(self) -> str:
+        return self.routes[0].name
+
+    def hedge_delay(self, model: str) -> float | None:
+        """Segundos tras los cuales conviene lanzar un hedge (None = no hay datos suficientes)"""
+        if self.hedge_percentile <= 0:
+            return None
+        window = self._latency[model]
+        if len(window) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, window.percentile(self.hedge_percentile))
+
+    def _hedge_allowed(self) -> bool:
+        with self._lock:
+            return self.hedges < self.hedge_max_ratio * self.requests
+
+    def routes_for(self, model: str = None) -> list[ModelRoute]:
+        """Rutas con ``model`` primero (si es uno de los configurados) y el resto como fallback"""
+        if model is None or model == self.primary:
+            return self.routes
+        preferred = [route for route in self.routes if route.name == model]
+        return preferred + [route for route in self.routes if route.name != model] if preferred else self.routes
+
+    @staticmethod
+    def _next_route(routes: list[ModelRoute], index: int, attempt: _Attempt) -> ModelRoute:
+        """Destino del hedge: el siguiente modelo, o el mismo si no hay otro"""
+        return routes[index] if index < len(routes) else attempt.route
+
+    def _record_success(self, attempt: _Attempt) -> None:
+        with self._lock:
+            self._latency[attempt.route.name].add(time.monotonic() - attempt.started)
+            self.served_by[attempt.route.name] += 1
+            if attempt.hedge:
+                self.hedge_wins += 1
+
+    def _record_failure(self, exc: BaseException) -> None:
+        with self._lock:
+            self.failures += 1
+            if isinstance(exc, ModelDeadlineExceeded):
+                self.deadlines_exceeded += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    @staticmethod
+    def _final_error(errors: list[tuple[_Attempt, BaseException]]) -> BaseException:
+        # El error de un hedge (p. ej. sin cupo en el limitador) no representa al modelo
+        for attempt, exc in reversed(errors):
+            if not attempt.hedge:
+                return exc
+        return errors[-1][1]
+
+    def _wait_timeout(self, pending, hedge_at: float | None) -> float:
+        now = time.monotonic()
+        limit = min(attempt.deadline_at for attempt in pending.values())
+        if hedge_at is not None:
+            limit = min(limit, hedge_at)
+        return max(limit - now, 0)
+
+    def generate(self, attempt_fn, model: str = None):
+        """Variante síncrona (consumidor): los intentos corren en un pool de hilos propio"""
+        self._start()
+        routes = self.routes_for(model)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch(route: ModelRoute, hedge: bool) -> _Attempt:
+            attempt = _Attempt(route, hedge)
+            future = self._executor.submit(attempt_fn, route.name, route.deadline, hedge)
+            pending[future] = attempt
+            return attempt
+
+        primary = launch(routes[0], hedge=False)
+        index = 1
+        delay = self.hedge_delay(primary.route.name)
+        hedge_at = primary.started + delay if delay is not None else None
+
+        while pending:
+            done, _ = wait(pending, timeout=self._wait_timeout(pending, None if hedged else hedge_at),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    self._record_failure(exc)
+                    errors.append((attempt, exc))
+                    continue
+                self._record_success(attempt)
+                for loser in pending:
+                    loser.cancel()
+                return result
+
+            now = time.monotonic()
+            for future, attempt in list(pending.items()):
+                if now >= attempt.deadline_at:
+                    # No se puede interrumpir el hilo: se abandona y se sigue con el próximo modelo
+                    del pending[future]
+                    future.cancel()
+                    exc = ModelDeadlineExceeded(f"{attempt.route.name} superó {attempt.route.deadline}s")
+                    self._record_failure(exc)
+                    errors.append((attempt, exc))
+
+            if not hedged and hedge_at is not None and now >= hedge_at and pending:
+                hedged = True
+                if self._hedge_allowed():
+                    route = self._next_route(routes, index, primary)
+                    index += route is not primary.route
+                    with self._lock:
+                        self.hedges += 1
+                    launch(route, hedge=True)
+
+            if not pending and index < len(routes):
+                with self._lock:
+                    self.fallbacks += 1
+                launch(routes[index], hedge=False)
+                index += 1
+
+        raise self._final_error(errors)
+
+    async def generate_async(self, attempt_fn, model: str = None):
+        """Variante asíncrona (/chat): el intento perdedor se cancela de verdad"""
+        self._start()
+        routes = self.routes_for(model)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch(route: ModelRoute, hedge: bool) -> _Attempt:
+            attempt = _Attempt(route, hedge)
+            task = asyncio.ensure_future(attempt_fn(route.name, route.deadline, hedge))
+            pending[task] = attempt
+            return attempt
+
+        primary = launch(routes[0], hedge=False)
+        index = 1
+        delay = self.hedge_delay(primary.route.name)
+        hedge_at = primary.started + delay if delay is not None else None
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=self._wait_timeout(pending, None if hedged else hedge_at),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    attempt = pending.pop(task)
+                    exc = task.exception()
+                    if exc is not None:
+                        self._record_failure(exc)
+                        errors.append((attempt, exc))
+                        continue
+                    self._record_success(attempt)
+                    return task.result()
+
+                now = time.monotonic()
+                for task, attempt in list(pending.items()):
+                    if now >= attempt.deadline_at:
+                        del pending[task]
+                        task.cancel()
+                        exc = ModelDeadlineExceeded(f"{attempt.route.name} superó {attempt.route.deadline}s")
+                        self._record_failure(exc)
+                        errors.append((attempt, exc))
+
+                if not hedged and hedge_at is not None and now >= hedge_at and pending:
+                    hedged = True
+                    if self._hedge_allowed():
+                        route = self._next_route(routes, index, primary)
+                        index += route is not primary.route
+                        with self._lock:
+                            self.hedges += 1
+                        launch(route, hedge=True)
+
+                if not pending and index < len(routes):
+                    with self._lock:
+                        self.fallbacks += 1
+                    launch(routes[index], hedge=False)
+                    index += 1
+        finally:
+            # Cancelar el perdedor (o todo, si la petición se canceló)
+            for task in pending:
+                task.cancel()
+
+        raise self._final_error(errors)
+
+    def stats(self) -> dict:
+        delay = self.hedge_delay(self.primary)
+        with self._lock:
+            models = {}
+            for route in self.routes:
+                window = self._latency[route.name]
+                p50 = window.percentile(50)
+                p99 = window.percentile(99)
+                models[route.name] = {
+                    "deadline_s": route.deadline,
+                    "served": self.served_by[route.name],
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+                }
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+                "fallbacks": self.fallbacks,
+                "deadlines_exceeded": self.deadlines_exceeded,
+                "failures": self.failures,
+                "models": models,
+            }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,279 @@
+import functools
+import hashlib
+import json
+import logging
+import time
+import zlib
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+
+def shard_queue_name(queue: str, shard: int) -> str:
+    return f"{queue}.shard.{shard}"
+
+
+def shard_exchange_name(queue: str) -> str:
+    return f"{queue}.shards"
+
+
+def members_exchange_name(queue: str) -> str:
+    return f"{queue}.members"
+
+
+def shard_for(key: str | bytes, shards: int) -> int:
+    """Shard de una clave (estable entre procesos, a diferencia de ``hash()``)"""
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return zlib.crc32(key) % shards
+
+
+def _score(member: str, shard: int) -> int:
+    digest = hashlib.blake2b(f"{member}:{shard}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_owner(shard: int, members) -> str:
+    """Rendezvous hashing: al entrar o salir una réplica solo se mueven los shards que gana o pierde"""
+    return max(members, key=lambda member: (_score(member, shard), member))
+
+
+def assign_shards(replica_id: str, members, shards: int) -> set[int]:
+    return {shard for shard in range(shards) if shard_owner(shard, members) == replica_id}
+
+
+class Membership:
+    """Réplicas vivas según los heartbeats recibidos en los últimos ``timeout`` segundos"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._last_seen: dict[str, float] = {}
+
+    def heartbeat(self, replica_id: str, now: float) -> bool:
+        """Registra un heartbeat; retorna True si la réplica es nueva"""
+        new = replica_id not in self._last_seen
+        self._last_seen[replica_id] = now
+        return new
+
+    def expire(self, now: float) -> list[str]:
+        expired = [replica for replica, seen in self._last_seen.items() if now - seen > self.timeout]
+        for replica in expired:
+            del self._last_seen[replica]
+        return expired
+
+    def live(self) -> set[str]:
+        return set(self._last_seen)
+
+
+class ShardCoordinator:
+    """Consumo particionado de la cola de preguntas entre varias réplicas.
+
+    - Router: la réplica que obtiene el consumidor exclusivo de ``queue``
+      republica cada mensaje en el exchange directo ``<queue>.shards`` con el
+      shard de su clave de orden (``thread_id``) como routing key. Las demás
+      réplicas quedan en espera y reintentan en cada heartbeat.
+    - Shards: cada réplica publica heartbeats en el exchange fanout
+      ``<queue>.members`` y consume los shards que le asigna el rendezvous
+      hashing sobre las réplicas vivas. Las colas de shard tienen
+      ``x-single-active-consumer``, así que aunque dos réplicas discrepen
+      durante un rebalanceo solo una recibe mensajes de cada shard.
+    - Al ceder un shard se dejan de despachar sus mensajes nuevos, se espera
+      a que terminen los que están en proceso y recién entonces se cancela el
+      consumidor y se devuelven los retenidos a la cola (en su posición
+      original): el siguiente dueño continúa sin reordenar el thread.
+
+    Todo corre en el hilo de la conexión (callbacks de pika y ``call_later``);
+    ``done(method)`` debe llamarse desde ese hilo al terminar cada mensaje.
+    """
+
+    def __init__(self, connection, channel, handler, ordering_key, replica_id: str, queue: str,
+                 shards: int, queue_arguments: dict = None, heartbeat_interval: float = 5,
+                 member_timeout: float = 15, router_prefetch: int = 100):
+        self.connection = connection
+        self.channel = channel
+        self.handler = handler
+        self.ordering_key = ordering_key
+        self.replica_id = replica_id
+        self.queue = queue
+        self.shards = shards
+        self.queue_arguments = dict(queue_arguments or {})
+        self.heartbeat_interval = heartbeat_interval
+        self.router_prefetch = router_prefetch
+        self.exchange = shard_exchange_name(queue)
+        self.members_exchange = members_exchange_name(queue)
+        self.membership = Membership(member_timeout)
+
+        self._ready = False
+        self._consumers: dict[int, str] = {}
+        self._draining: set[int] = set()
+        self._held: dict[int, list] = {}
+        self._in_flight: dict[int, int] = {}
+        self._tags: dict[int, int] = {}
+        self._router_channel = None
+        self._stopped = False
+        self.owned: set[int] = set()
+        self.routed = 0
+        self.rebalances = 0
+        self.handoffs = 0
+
+    def declare(self) -> None:
+        self.channel.exchange_declare(exchange=self.exchange, exchange_type="direct", durable=True)
+        arguments = {**self.queue_arguments, "x-single-active-consumer": True}
+        for shard in range(self.shards):
+            name = shard_queue_name(self.queue, shard)
+            self.channel.queue_declare(queue=name, durable=True, arguments=arguments)
+            self.channel.queue_bind(queue=name, exchange=self.exchange, routing_key=str(shard))
+        self.channel.exchange_declare(exchange=self.members_exchange, exchange_type="fanout", durable=True)
+
+    def start(self) -> None:
+        self.declare()
+        result = self.channel.queue_declare(queue="", exclusive=True, auto_delete=True)
+        members_queue = result.method.queue
+        self.channel.queue_bind(queue=members_queue, exchange=self.members_exchange)
+        self.channel.basic_consume(queue=members_queue, on_message_callback=self._on_heartbeat, auto_ack=True)
+        self._claim_router()
+        self._beat()
+        # El primer rebalanceo espera un intervalo para conocer a las demás réplicas
+        self.connection.call_later(self.heartbeat_interval, self._tick)
+
+    # --- router -------------------------------------------------------------
+
+    def _claim_router(self) -> None:
+        if self._router_channel is not None or self._stopped:
+            return
+        channel = self.connection.channel()
+        try:
+            channel.confirm_delivery()
+            channel.basic_qos(prefetch_count=self.router_prefetch)
+            channel.basic_consume(queue=self.queue, on_message_callback=self._route, exclusive=True)
+        except pika.exceptions.ChannelClosedByBroker:
+            # Otra réplica tiene el consumidor exclusivo
+            return
+        self._router_channel = channel
+        logger.info(f"Réplica {self.replica_id}: enrutando {self.queue} -> {self.exchange}")
+
+    def _route(self, ch, method, properties, body) -> None:
+        key = self.ordering_key(body, properties) or body
+        shard = shard_for(key, self.shards)
+        try:
+            ch.basic_publish(exchange=self.exchange, routing_key=str(shard), body=body, properties=properties)
+        except pika.exceptions.NackError:
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        self.routed += 1
+
+    # --- membresía ----------------------------------------------------------
+
+    def _beat(self) -> None:
+        body = json.dumps({"replica": self.replica_id}).encode("utf-8")
+        self.channel.basic_publish(exchange=self.members_exchange, routing_key="", body=body)
+
+    def _on_heartbeat(self, ch, method, properties, body) -> None:
+        try:
+            replica_id = json.loads(body)["replica"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Heartbeat inválido: {body!r}")
+            return
+        if self.membership.heartbeat(str(replica_id), time.monotonic()) and self._ready:
+            logger.info(f"Réplica {replica_id} se unió")
+            self.rebalance()
+
+    def _tick(self) -> None:
+        if self._stopped:
+            return
+        self._beat()
+        expired = self.membership.expire(time.monotonic())
+        if expired:
+            logger.warning(f"Réplicas sin heartbeat: {', '.join(expired)}")
+        self._claim_router()
+        self._ready = True
+        self.rebalance()
+        self.connection.call_later(self.heartbeat_interval, self._tick)
+
+    # --- shards -------------------------------------------------------------
+
+    def rebalance(self) -> None:
+        if self._stopped:
+            return
+        owned = assign_shards(self.replica_id, self.membership.live() | {self.replica_id}, self.shards)
+        if owned != self.owned:
+            self.rebalances += 1
+            logger.info(f"Réplica {self.replica_id}: shards {sorted(owned)}")
+        self.owned = owned
+
+        for shard in sorted(owned):
+            if shard in self._draining:
+                self._resume(shard)
+            elif shard not in self._consumers:
+                self._consumers[shard] = self.channel.basic_consume(
+                    queue=shard_queue_name(self.queue, shard),
+                    on_message_callback=functools.partial(self._on_message, shard),
+                )
+        for shard in list(self._consumers):
+            if shard not in owned and shard not in self._draining:
+                self._draining.add(shard)
+                self._held.setdefault(shard, [])
+                self._maybe_release(shard)
+
+    def _on_message(self, shard, ch, method, properties, body) -> None:
+        if shard in self._draining:
+            self._held[shard].append((ch, method, properties, body))
+            self._maybe_release(shard)
+            return
+        self._dispatch(shard, ch, method, properties, body)
+
+    def _dispatch(self, shard, ch, method, properties, body) -> None:
+        self._in_flight[shard] = self._in_flight.get(shard, 0) + 1
+        self._tags[method.delivery_tag] = shard
+        self.handler(ch, method, properties, body)
+
+    def done(self, method) -> None:
+        shard = self._tags.pop(method.delivery_tag, None)
+        if shard is None:
+            return
+        self._in_flight[shard] -= 1
+        if shard in self._draining:
+            self._maybe_release(shard)
+
+    def _resume(self, shard: int) -> None:
+        self._draining.discard(shard)
+        for delivery in self._held.pop(shard, []):
+            self._dispatch(shard, *delivery)
+
+    def _maybe_release(self, shard: int) -> None:
+        if self._in_flight.get(shard, 0) > 0:
+            return
+        self.channel.basic_cancel(self._consumers.pop(shard))
+        for _, method, _, _ in self._held.pop(shard, []):
+            self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+        self._draining.discard(shard)
+        self._in_flight.pop(shard, None)
+        self.handoffs += 1
+        logger.info(f"Réplica {self.replica_id}: shard {shard} liberado")
+
+    def stop(self) -> None:
+        """Deja de enrutar y de rebalancear (apagado); corre en el hilo de la conexión"""
+        self._stopped = True
+        channel, self._router_channel = self._router_channel, None
+        if channel is not None and channel.is_open:
+            # Lo que el router tenía sin ack vuelve a la cola principal y lo toma otra réplica
+            channel.close()
+
+    def stats(self) -> dict:
+        members = sorted(self.membership.live() | {self.replica_id})
+        return {
+            "replica_id": self.replica_id,
+            "shards": self.shards,
+            "members": members,
+            "member_count": len(members),
+            "owned": sorted(self.owned),
+            "owned_count": len(self.owned),
+            "consuming": sorted(self._consumers),
+            "draining": sorted(self._draining),
+            "router": self._router_channel is not None,
+            "routed": self.routed,
+            "rebalances": self.rebalances,
+            "handoffs": self.handoffs,
+        }
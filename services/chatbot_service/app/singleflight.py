@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _Abandoned(Exception):
+    """El líder se canceló o se interrumpió sin un resultado ni un error que compartir"""
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una sola ejecución.
+
+    La primera llamada (líder) ejecuta la función; las que llegan mientras
+    está en curso esperan su resultado. Si el líder falla, todos los que
+    esperaban reciben la misma excepción y la clave se libera, de modo que
+    el siguiente intento vuelve a ejecutar la función. Si el líder termina
+    con algo que no es un ``Exception`` (``CancelledError``, ``KeyboardInterrupt``)
+    la interrupción es solo suya: los que esperaban vuelven a intentar, y
+    uno de ellos pasa a ser el líder.
+
+    Sirve tanto para hilos (``do``) como para corrutinas (``do_async``); ambos
+    comparten las llamadas en curso a través de ``concurrent.futures.Future``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key: str, future: Future, result=None, error: BaseException = None) -> None:
+        # Liberar la clave antes de notificar para no envenenar intentos posteriores
+        with self._lock:
+            del self._calls[key]
+            if error is not None:
+                self.failures += 1
+        if error is not None:
+            future.set_exception(error if isinstance(error, Exception) else _Abandoned())
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn, *args):
+        future, leader = self._join(key)
+        while not leader:
+            try:
+                return future.result()
+            except _Abandoned:
+                future, leader = self._join(key)
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def do_async(self, key: str, fn, *args):
+        future, leader = self._join(key)
+        while not leader:
+            try:
+                return await asyncio.wrap_future(future)
+            except _Abandoned:
+                future, leader = self._join(key)
+        try:
+            result = await fn(*args)
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "upstream_calls": self.leaders,
+                "coalesced": self.coalesced,
+                "failures": self.failures,
+            }
@@ -0,0 +1,148 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConsumerSupervisor:
+    """Mantiene vivo el consumidor de RabbitMQ en un hilo propio.
+
+    - ``connect()`` abre una conexión (un solo intento) y ``setup(connection)``
+      declara y registra los consumidores, retornando el canal sobre el que se
+      llama ``start_consuming``.
+    - Ante cualquier error se reconecta con backoff exponencial y jitter
+      completo, en un ciclo (sin recursión). El backoff vuelve a cero si la
+      conexión anterior duró al menos ``stable_after`` segundos.
+    - ``stop(deadline)`` deja de recibir mensajes, sigue atendiendo la
+      conexión para que los acks de los mensajes en proceso lleguen al broker
+      mientras ``idle()`` sea False o hasta el deadline, y cierra la conexión:
+      lo que quede sin ack vuelve a la cola.
+    """
+
+    def __init__(self, connect, setup, idle=None, on_stop=None, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, stable_after: float = 30.0):
+        self.connect = connect
+        self.setup = setup
+        self.idle = idle or (lambda: True)
+        self.on_stop = on_stop
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._connection = None
+        self._channel = None
+        self._deadline = None
+        self.state = "stopped"
+        self.last_error = None
+        self.connected_since = None
+        self.connections = 0
+        self.failures = 0
+
+    @property
+    def consuming(self) -> bool:
+        return self.state == "consuming"
+
+    @property
+    def alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def backoff(self, attempts: int) -> float:
+        """Backoff exponencial con jitter completo"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempts)))
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.state = "starting"
+        self._thread = threading.Thread(target=self._run, daemon=True, name="rabbitmq-consumer")
+        self._thread.start()
+
+    def _run(self) -> None:
+        attempts = 0
+        while not self._stop.is_set():
+            self.state = "connecting"
+            started = None
+            try:
+                self._connection = self.connect()
+                self._channel = self.setup(self._connection)
+                started = time.monotonic()
+                self.connections += 1
+                self.connected_since = time.time()
+                self.state = "consuming"
+                if self._stop.is_set():
+                    break
+                self._channel.start_consuming()
+                if self._stop.is_set():
+                    self._drain()
+                    break
+                raise ConnectionError("start_consuming terminó sin que se pidiera detener el consumidor")
+            except Exception as exc:
+                if self._stop.is_set():
+                    break
+                self.failures += 1
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                logger.error(f"Error en el consumidor: {exc}")
+            finally:
+                self.connected_since = None
+                self._close()
+
+            if started is not None and time.monotonic() - started >= self.stable_after:
+                attempts = 0
+            delay = self.backoff(attempts)
+            attempts += 1
+            self.state = "reconnecting"
+            logger.info(f"Reconectando el consumidor en {delay:.1f}s (intento {attempts})")
+            self._stop.wait(delay)
+        self.state = "stopped"
+
+    def _request_stop(self) -> None:
+        # Corre en el hilo de la conexión
+        if self.on_stop is not None:
+            self.on_stop()
+        self._channel.stop_consuming()
+
+    def _drain(self) -> None:
+        self.state = "draining"
+        while not self.idle() and time.monotonic() < self._deadline:
+            # Los workers agendan sus acks en el hilo de la conexión: hay que seguir atendiéndola
+            self._connection.process_data_events(time_limit=0.1)
+        self._connection.process_data_events(time_limit=0)
+        if not self.idle():
+            logger.warning("Se venció el plazo de apagado con mensajes en proceso; volverán a la cola")
+
+    def _close(self) -> None:
+        connection, self._connection, self._channel = self._connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception as exc:
+                logger.warning(f"Error al cerrar la conexión: {exc}")
+
+    def stop(self, timeout: float = 25.0) -> bool:
+        """Apagado ordenado; retorna False si no terminó dentro de ``timeout`` segundos"""
+        self._deadline = time.monotonic() + timeout
+        self._stop.set()
+        connection = self._connection
+        if connection is not None and self.state == "consuming":
+            try:
+                connection.add_callback_threadsafe(self._request_stop)
+            except Exception as exc:
+                logger.warning(f"No se pudo detener el consumo: {exc}")
+        if self._thread is None:
+            return True
+        self._thread.join(timeout + 1)
+        return not self._thread.is_alive()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "alive": self.alive,
+            "consuming": self.consuming,
+            "connections": self.connections,
+            "failures": self.failures,
+            "connected_since": self.connected_since,
+            "last_error": self.last_error,
+        }
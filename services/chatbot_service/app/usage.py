@@ -0,0 +1,196 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+class BudgetExceeded(Exception):
+    """El thread o el usuario agotó su presupuesto de tokens en la ventana actual."""
+
+    def __init__(self, scope: str, key: str, used: int, budget: int):
+        super().__init__(f"Presupuesto de tokens agotado para el {scope} {key}: {used}/{budget}")
+        self.scope = scope
+        self.key = key
+        self.used = used
+        self.budget = budget
+
+
+@dataclass(frozen=True)
+class UsageScope:
+    thread_id: str | None = None
+    user_id: str | None = None
+
+
+_scope: contextvars.ContextVar = contextvars.ContextVar("usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope(thread_id: str | None, user_id: str | None):
+    """Atribuye al thread y usuario dados las llamadas al modelo hechas dentro del bloque"""
+    token = _scope.set(UsageScope(thread_id, user_id))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def current_scope() -> UsageScope | None:
+    return _scope.get()
+
+
+@dataclass
+class TokenUsage:
+    prompt: int = 0
+    cached: int = 0
+    output: int = 0
+    thinking: int = 0
+    truncated: bool = False
+
+    @property
+    def total(self) -> int:
+        return self.prompt + self.output + self.thinking
+
+    @classmethod
+    def from_response(cls, response) -> "TokenUsage | None":
+        """Uso informado por Gemini (``usage_metadata``); None si la respuesta no lo trae"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return None
+        candidates = getattr(response, "candidates", None) or []
+        return cls(
+            prompt=getattr(usage, "prompt_token_count", None) or 0,
+            cached=getattr(usage, "cached_content_token_count", None) or 0,
+            output=getattr(usage, "candidates_token_count", None) or 0,
+            thinking=getattr(usage, "thoughts_token_count", None) or 0,
+            truncated=any(str(getattr(candidate, "finish_reason", "")).endswith("MAX_TOKENS")
+                          for candidate in candidates),
+        )
+
+
+def _counters() -> dict:
+    return {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0,
+            "thinking_tokens": 0, "truncated": 0}
+
+
+def _add(counters: dict, usage: TokenUsage) -> None:
+    counters["calls"] += 1
+    counters["prompt_tokens"] += usage.prompt
+    counters["cached_tokens"] += usage.cached
+    counters["output_tokens"] += usage.output
+    counters["thinking_tokens"] += usage.thinking
+    counters["truncated"] += usage.truncated
+
+
+class UsageLedger:
+    """Tokens consumidos por clase de pregunta, modelo, thread y usuario.
+
+    - ``record`` suma el uso real de cada llamada (incluidos hedges y
+      fallbacks) a los totales, por perfil y por modelo.
+    - ``charge`` descuenta tokens del presupuesto del thread y del usuario;
+      ``check`` falla con ``BudgetExceeded`` antes de llamar al modelo si
+      alguno ya está agotado (la llamada en curso puede pasarse del límite).
+    - Los presupuestos valen por ventanas fijas de ``window`` segundos. Se
+      recuerdan a lo sumo ``max_keys`` threads y usuarios (LRU): uno olvidado
+      vuelve a empezar de cero.
+    - ``notify_once`` permite avisar a un thread una sola vez por ventana que
+      agotó su presupuesto (también si sus mensajes se reprocesan desde la DLQ).
+    - Es un límite blando por réplica: el gasto vive en la memoria del proceso.
+      Con shards un thread cae siempre en la misma réplica, pero un usuario
+      con threads en N réplicas puede gastar hasta N veces su presupuesto, y
+      un reinicio lo pone en cero.
+    """
+
+    def __init__(self, thread_budget: int = 0, user_budget: int = 0, window: float = 86400.0,
+                 max_keys: int = 100000):
+        self.thread_budget = thread_budget
+        self.user_budget = user_budget
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._spent = {"thread": OrderedDict(), "user": OrderedDict()}
+        self._notified: OrderedDict[str, float] = OrderedDict()
+        self._totals = _counters()
+        self._profiles: dict[str, dict] = {}
+        self._models: dict[str, dict] = {}
+        self.rejected = {"thread": 0, "user": 0}
+
+    def record(self, response, profile: str, model: str) -> TokenUsage | None:
+        usage = TokenUsage.from_response(response)
+        if usage is None:
+            return None
+        with self._lock:
+            _add(self._totals, usage)
+            _add(self._profiles.setdefault(profile, _counters()), usage)
+            _add(self._models.setdefault(model, _counters()), usage)
+        return usage
+
+    def _window_start(self, now: float) -> float:
+        return now - now % self.window
+
+    def _budgets(self, scope: UsageScope | None):
+        if scope is None:
+            return
+        if scope.thread_id and self.thread_budget > 0:
+            yield "thread", scope.thread_id, self.thread_budget
+        if scope.user_id and self.user_budget > 0:
+            yield "user", scope.user_id, self.user_budget
+
+    def spent(self, kind: str, key: str) -> int:
+        """Tokens usados por el thread/usuario en la ventana actual"""
+        with self._lock:
+            entry = self._spent[kind].get(key)
+            if entry is None or entry[0] != self._window_start(time.time()):
+                return 0
+            return entry[1]
+
+    def check(self, scope: UsageScope | None) -> None:
+        for kind, key, budget in self._budgets(scope):
+            used = self.spent(kind, key)
+            if used >= budget:
+                with self._lock:
+                    self.rejected[kind] += 1
+                raise BudgetExceeded(kind, key, used, budget)
+
+    def charge(self, scope: UsageScope | None, tokens: int) -> None:
+        start = self._window_start(time.time())
+        with self._lock:
+            for kind, key, _ in self._budgets(scope):
+                spent = self._spent[kind]
+                entry = spent.get(key)
+                used = entry[1] if entry is not None and entry[0] == start else 0
+                spent[key] = (start, used + tokens)
+                spent.move_to_end(key)
+                while len(spent) > self.max_keys:
+                    spent.popitem(last=False)
+
+    def notify_once(self, thread_id: str) -> bool:
+        """True la primera vez que se pide avisar a ``thread_id`` en la ventana actual"""
+        start = self._window_start(time.time())
+        with self._lock:
+            if self._notified.get(thread_id) == start:
+                return False
+            self._notified[thread_id] = start
+            self._notified.move_to_end(thread_id)
+            while len(self._notified) > self.max_keys:
+                self._notified.popitem(last=False)
+            return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self._totals["calls"]
+            return {
+                **self._totals,
+                "output_tokens_per_call": round(self._totals["output_tokens"] / calls, 1) if calls else 0.0,
+                "thinking_tokens_per_call": round(self._totals["thinking_tokens"] / calls, 1) if calls else 0.0,
+                "rejected_thread": self.rejected["thread"],
+                "rejected_user": self.rejected["user"],
+                "tracked_threads": len(self._spent["thread"]),
+                "tracked_users": len(self._spent["user"]),
+                "thread_budget": self.thread_budget,
+                "user_budget": self.user_budget,
+                "window_s": self.window,
+                "profiles": {name: dict(counters) for name, counters in self._profiles.items()},
+                "models": {name: dict(counters) for name, counters in self._models.items()},
+            }
@@ -0,0 +1,248 @@
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadSafeChannel:
+    """Proxy del canal pika que ejecuta ack/nack/publish en el hilo de la conexión.
+
+    Los canales de ``BlockingConnection`` no son thread-safe, así que los hilos
+    del pool no pueden tocarlos directamente. Cada operación se agenda con
+    ``connection.add_callback_threadsafe`` y se ejecuta dentro del loop de
+    ``start_consuming``.
+    """
+
+    def __init__(self, connection, channel):
+        self._connection = connection
+        self._channel = channel
+
+    def _schedule(self, fn, **kwargs):
+        def run():
+            if not self._channel.is_open:
+                # El broker reentregará el mensaje en la nueva conexión
+                logger.warning(f"Canal cerrado, se descarta {fn.__name__} {kwargs.get('delivery_tag', '')}")
+                return
+            try:
+                fn(**kwargs)
+            except Exception as e:
+                logger.error(f"Error ejecutando {fn.__name__} en el hilo de la conexión: {e}")
+
+        try:
+            self._connection.add_callback_threadsafe(run)
+        except Exception as e:
+            logger.error(f"No se pudo agendar {fn.__name__}, conexión cerrada: {e}")
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._schedule(self._channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._schedule(self._channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._schedule(
+            self._channel.basic_publish,
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties,
+            mandatory=mandatory,
+        )
+
+    def _publish_and_ack(self, delivery_tag, **publish):
+        try:
+            self._channel.basic_publish(**publish)
+        except Exception as e:
+            logger.error(f"No se pudo republicar {delivery_tag}, se devuelve a la cola: {e}")
+            if self._channel.is_open:
+                self._channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            return
+        self._channel.basic_ack(delivery_tag=delivery_tag)
+
+    def publish_and_ack(self, delivery_tag, exchange, routing_key, body, properties=None, mandatory=False):
+        """Publica y confirma ``delivery_tag`` en un mismo callback: el ack solo sale si salió la publicación"""
+        self._schedule(
+            self._publish_and_ack,
+            delivery_tag=delivery_tag,
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties,
+            mandatory=mandatory,
+        )
+
+
+DEFAULT_LANE = "default"
+
+
+@dataclass
+class Lane:
+    """Carril de prioridad del pool.
+
+    - ``weight``: proporción de turnos que recibe cuando hay trabajo en varios carriles.
+    - ``max_active``: workers que el carril puede ocupar a la vez (None = todos); deja
+      capacidad libre para los demás carriles.
+    - ``max_wait``: segundos tras los cuales su mensaje más antiguo pasa primero,
+      sin importar el peso (protección contra inanición).
+    """
+    name: str
+    weight: int = 1
+    max_active: int | None = None
+    max_wait: float | None = None
+
+
+@dataclass
+class _Task:
+    key: object
+    lane: str
+    run: functools.partial
+    enqueued_at: float
+
+
+class ConsumerWorkerPool:
+    """Pool de hilos que procesa mensajes en paralelo manteniendo el orden por clave.
+
+    Los mensajes con la misma clave (por ejemplo el ``thread_id``) se ejecutan
+    en serie y en el orden de llegada; claves distintas avanzan en paralelo.
+    Un mensaje sin clave no tiene restricciones de orden.
+
+    Con varios ``lanes``, cada worker libre elige el siguiente mensaje listo
+    por round-robin ponderado (smooth weighted round-robin) entre los carriles
+    con trabajo y cupo, salvo que algún carril tenga un mensaje que superó su
+    ``max_wait``.
+    """
+
+    def __init__(self, workers: int, lanes: list[Lane] = None, on_wait=None):
+        self.workers = workers
+        self.lanes = {lane.name: lane for lane in (lanes or [Lane(DEFAULT_LANE)])}
+        self._default_lane = next(iter(self.lanes))
+        # on_wait(lane, segundos): tiempo que esperó cada mensaje antes de tomar un worker
+        self._on_wait = on_wait
+        self._lock = threading.Lock()
+        self._ready_cv = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._pending: dict[str, deque] = {}
+        self._ready = {name: deque() for name in self.lanes}
+        self._active = {name: 0 for name in self.lanes}
+        self._credit = {name: 0 for name in self.lanes}
+        self._dispatched = {name: 0 for name in self.lanes}
+        self._aged = {name: 0 for name in self.lanes}
+        self._max_wait = {name: 0.0 for name in self.lanes}
+        self._in_flight = 0
+        self._stopped = False
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True, name=f"chatbot-worker-{i}")
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def submit(self, key, fn, *args, lane: str = None) -> None:
+        """Encola ``fn(*args)`` en ``lane``; si ya hay trabajo para ``key`` espera su turno."""
+        if lane not in self.lanes:
+            lane = self._default_lane
+        task = _Task(key, lane, functools.partial(fn, *args), time.monotonic())
+        with self._lock:
+            self._in_flight += 1
+            if key is not None:
+                if key in self._pending:
+                    self._pending[key].append(task)
+                    return
+                self._pending[key] = deque()
+            self._ready[lane].append(task)
+            self._ready_cv.notify()
+
+    def _pick(self, now: float) -> _Task | None:
+        eligible = [
+            lane for name, lane in self.lanes.items()
+            if self._ready[name] and (lane.max_active is None or self._active[name] < lane.max_active)
+        ]
+        if not eligible:
+            return None
+        if len(eligible) == 1:
+            chosen = eligible[0]
+        else:
+            starved = [
+                lane for lane in eligible
+                if lane.max_wait is not None and now - self._ready[lane.name][0].enqueued_at >= lane.max_wait
+            ]
+            if starved:
+                chosen = min(starved, key=lambda lane: self._ready[lane.name][0].enqueued_at)
+                self._aged[chosen.name] += 1
+            else:
+                total = 0
+                for lane in eligible:
+                    self._credit[lane.name] += lane.weight
+                    total += lane.weight
+                chosen = max(eligible, key=lambda lane: self._credit[lane.name])
+                self._credit[chosen.name] -= total
+        return self._ready[chosen.name].popleft()
+
+    def _worker(self) -> None:
+        while True:
+            with self._lock:
+                task = self._pick(time.monotonic())
+                while task is None:
+                    if self._stopped and not any(self._ready.values()):
+                        return
+                    self._ready_cv.wait()
+                    task = self._pick(time.monotonic())
+                self._active[task.lane] += 1
+                self._dispatched[task.lane] += 1
+                waited = time.monotonic() - task.enqueued_at
+                self._max_wait[task.lane] = max(self._max_wait[task.lane], waited)
+
+            if self._on_wait is not None:
+                self._on_wait(task.lane, waited)
+            try:
+                task.run()
+            except Exception:
+                logger.exception("Error no controlado en el worker del consumidor")
+
+            with self._lock:
+                self._active[task.lane] -= 1
+                self._in_flight -= 1
+                if task.key is not None:
+                    queue = self._pending[task.key]
+                    if queue:
+                        following = queue.popleft()
+                        self._ready[following.lane].append(following)
+                    else:
+                        del self._pending[task.key]
+                # Se liberó un worker (y quizás cupo de un carril)
+                self._ready_cv.notify_all()
+                if self._in_flight == 0:
+                    self._idle.notify_all()
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """Espera a que no queden mensajes en proceso. Retorna False si vence el timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            self._stopped = True
+            self._ready_cv.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self) -> dict:
+        """Por carril: mensajes listos, workers ocupados, despachados, turnos por antigüedad y espera máxima"""
+        with self._lock:
+            stats = {"workers": self.workers, "in_flight": self._in_flight}
+            for name in self.lanes:
+                stats[f"{name}_ready"] = len(self._ready[name])
+                stats[f"{name}_active"] = self._active[name]
+                stats[f"{name}_dispatched"] = self._dispatched[name]
+                stats[f"{name}_aged"] = self._aged[name]
+                stats[f"{name}_max_wait_s"] = round(self._max_wait[name], 3)
+            return stats
@@ -0,0 +1,210 @@
+"""Stand-in en memoria de RabbitMQ para correr el pipeline sin broker.
+
+Implementa solo lo que usan quiz_service y chatbot_service: default exchange,
+exchanges directos con bindings, dead-lettering (nack sin requeue y TTL de
+cola o de mensaje), prefetch y la API de canal de pika que llama ``callback``.
+La topología se carga desde ``rabbitmq/definitions.json``.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pika
+from pika.exceptions import ChannelClosedByBroker
+
+DEFINITIONS_PATH = Path(__file__).resolve().parents[3] / "rabbitmq" / "definitions.json"
+
+
+@dataclass
+class QueuedMessage:
+    body: bytes
+    properties: pika.BasicProperties
+    exchange: str
+    routing_key: str
+    expires_at: float | None = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class InMemoryBroker:
+    def __init__(self, definitions_path: Path = DEFINITIONS_PATH):
+        self._lock = threading.RLock()
+        self.queues: dict[str, deque[QueuedMessage]] = {}
+        self.queue_arguments: dict[str, dict] = {}
+        self.bindings: dict[str, list[tuple[str, str]]] = {}
+        self.dead_lettered: dict[str, int] = {}
+        if definitions_path is not None:
+            self.load_definitions(definitions_path)
+
+    def load_definitions(self, path: Path) -> None:
+        definitions = json.loads(Path(path).read_text())
+        for queue in definitions.get("queues", []):
+            self.declare_queue(queue["name"], queue.get("arguments") or {})
+        for exchange in definitions.get("exchanges", []):
+            self.bindings.setdefault(exchange["name"], [])
+        for binding in definitions.get("bindings", []):
+            self.bindings.setdefault(binding["source"], []).append(
+                (binding["routing_key"], binding["destination"])
+            )
+
+    def declare_queue(self, name: str, arguments: dict = None) -> None:
+        with self._lock:
+            self.queues.setdefault(name, deque())
+            self.queue_arguments[name] = arguments or {}
+
+    def has_queue(self, name: str) -> bool:
+        return name in self.queues
+
+    def depth(self, name: str) -> int:
+        with self._lock:
+            return len(self.queues.get(name, ()))
+
+    def _route(self, exchange: str, routing_key: str) -> list[str]:
+        if exchange == "":
+            return [routing_key] if routing_key in self.queues else []
+        return [queue for key, queue in self.bindings.get(exchange, []) if key == routing_key]
+
+    def publish(self, exchange: str, routing_key: str, body, properties: pika.BasicProperties = None) -> int:
+        """Encola en las colas destino; retorna cuántas colas recibieron el mensaje"""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        properties = properties or pika.BasicProperties()
+        now = time.monotonic()
+        with self._lock:
+            targets = self._route(exchange, routing_key)
+            for queue in targets:
+                ttl = self.queue_arguments[queue].get("x-message-ttl")
+                if properties.expiration is not None:
+                    message_ttl = int(properties.expiration)
+                    ttl = message_ttl if ttl is None else min(ttl, message_ttl)
+                expires_at = now + ttl / 1000 if ttl is not None else None
+                self.queues[queue].append(QueuedMessage(body, properties, exchange, routing_key, expires_at))
+            return len(targets)
+
+    def dead_letter(self, queue: str, message: QueuedMessage, reason: str) -> None:
+        arguments = self.queue_arguments.get(queue, {})
+        exchange = arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+        routing_key = arguments.get("x-dead-letter-routing-key", message.routing_key)
+        headers = dict(message.properties.headers or {})
+        headers["x-death"] = [{"queue": queue, "reason": reason, "count": 1}] + list(headers.get("x-death", []))
+        properties = pika.BasicProperties(
+            delivery_mode=message.properties.delivery_mode,
+            content_type=message.properties.content_type,
+            headers=headers,
+        )
+        with self._lock:
+            self.dead_lettered[queue] = self.dead_lettered.get(queue, 0) + 1
+            self.publish(exchange, routing_key, message.body, properties)
+
+    def expire(self) -> None:
+        """Aplica TTL: los mensajes vencidos en la cabeza de cada cola se envían a su DLX"""
+        now = time.monotonic()
+        with self._lock:
+            for name, queue in self.queues.items():
+                while queue and queue[0].expires_at is not None and queue[0].expires_at <= now:
+                    self.dead_letter(name, queue.popleft(), "expired")
+
+    def get(self, queue: str) -> QueuedMessage | None:
+        with self._lock:
+            messages = self.queues.get(queue)
+            return messages.popleft() if messages else None
+
+    def requeue(self, queue: str, message: QueuedMessage) -> None:
+        with self._lock:
+            self.queues[queue].appendleft(message)
+
+
+class InMemoryConnection:
+    """Imita ``BlockingConnection``: los callbacks agendados corren en el hilo que despacha."""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.is_open = True
+        self._callbacks: deque = deque()
+
+    def add_callback_threadsafe(self, callback) -> None:
+        self._callbacks.append(callback)
+
+    def process_callbacks(self) -> int:
+        processed = 0
+        while self._callbacks:
+            self._callbacks.popleft()()
+            processed += 1
+        return processed
+
+    def channel(self) -> "InMemoryChannel":
+        return InMemoryChannel(self)
+
+
+class InMemoryChannel:
+    """Subconjunto de ``BlockingChannel`` que usa el servicio, con un despachador de consumo."""
+
+    def __init__(self, connection: InMemoryConnection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.is_open = True
+        self.prefetch = 1
+        self._next_tag = 1
+        self._lock = threading.Lock()
+        # delivery_tag -> (cola, mensaje)
+        self.unacked: dict[int, tuple[str, QueuedMessage]] = {}
+        self.listeners = []
+
+    def queue_declare(self, queue: str, durable: bool = False, passive: bool = False, arguments: dict = None):
+        if passive and not self.broker.has_queue(queue):
+            self.is_open = False
+            raise ChannelClosedByBroker(404, f"NOT_FOUND - no queue '{queue}'")
+        if not passive:
+            self.broker.declare_queue(queue, arguments)
+
+    def basic_qos(self, prefetch_count: int = 0) -> None:
+        self.prefetch = prefetch_count or 1
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def _notify(self, event: str, *args) -> None:
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False) -> None:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self._notify("on_publish", exchange, routing_key, body)
+        self.broker.publish(exchange, routing_key, body, properties)
+
+    def basic_ack(self, delivery_tag=0, multiple=False) -> None:
+        with self._lock:
+            queue, message = self.unacked.pop(delivery_tag)
+        self._notify("on_ack", queue, message)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True) -> None:
+        with self._lock:
+            queue, message = self.unacked.pop(delivery_tag)
+        if requeue:
+            self.broker.requeue(queue, message)
+            return
+        self._notify("on_dead_letter", queue, message)
+        self.broker.dead_letter(queue, message, "rejected")
+
+    def dispatch(self, queue: str, handler) -> bool:
+        """Entrega mensajes mientras haya cupo de prefetch. Retorna True si hubo trabajo"""
+        worked = self.connection.process_callbacks() > 0
+        self.broker.expire()
+        while len(self.unacked) < self.prefetch:
+            message = self.broker.get(queue)
+            if message is None:
+                break
+            with self._lock:
+                tag = self._next_tag
+                self._next_tag += 1
+                self.unacked[tag] = (queue, message)
+            method = pika.spec.Basic.Deliver(delivery_tag=tag, exchange=message.exchange, routing_key=message.routing_key)
+            handler(self, method, message.properties, message.body)
+            worked = True
+        return worked
@@ -0,0 +1,83 @@
+"""Micro-benchmark de codificación/decodificación de los mensajes de preguntas.
+
+Compara el camino anterior (``json.dumps`` + ``json.loads`` y detección del
+formato por claves) con el sobre v2 en JSON y msgpack.
+
+Uso (desde services/chatbot_service)::
+
+    python -m bench.envelope --number 200000
+"""
+
+import argparse
+import json
+import timeit
+
+from app import envelope
+
+QUESTION = {
+    "question_id": "6f1c2a4e-93b1-4a55-9f0a-2d1c7e0b8a11",
+    "question": "¿Cuál es la diferencia entre una cola durable y una exclusiva en RabbitMQ?",
+    "timestamp": 1760000000.123,
+    "thread_id": "thread-42",
+    "user_id": "user-7",
+}
+
+
+def legacy_encode() -> bytes:
+    return json.dumps({
+        "id": QUESTION["question_id"],
+        "thread_id": QUESTION["thread_id"],
+        "user_id": QUESTION["user_id"],
+        "content": QUESTION["question"],
+    }).encode("utf-8")
+
+
+def legacy_decode(body: bytes):
+    # Lo que hacía el callback antes del sobre
+    data = json.loads(body)
+    if "thread_id" in data and "content" in data:
+        return str(data.get("id", "unknown")), data["content"], str(data["thread_id"]), str(data.get("user_id", ""))
+    if "question" in data:
+        return data.get("question_id", "unknown"), data["question"], None, None
+    return "unknown", body.decode("utf-8"), None, None
+
+
+def cases() -> dict:
+    message = envelope.QuestionMessage(**QUESTION)
+    legacy_body = legacy_encode()
+    result = {
+        "legacy json": (legacy_encode, lambda: legacy_decode(legacy_body)),
+        "v1 via envelope": (legacy_encode, lambda: envelope.decode_question(legacy_body)),
+    }
+    for content_type in envelope.CONTENT_TYPES:
+        body = envelope.encode(message, content_type)
+        headers = envelope.headers(content_type)
+        result[f"v2 {content_type.split('/')[-1]}"] = (
+            lambda ct=content_type: envelope.encode(message, ct),
+            lambda b=body, ct=content_type, h=headers: envelope.decode_question(b, ct, h),
+        )
+    return result
+
+
+def run(number: int) -> dict:
+    results = {}
+    for name, (encode_fn, decode_fn) in cases().items():
+        body = encode_fn()
+        results[name] = {
+            "bytes": len(body),
+            "encode_ns": round(min(timeit.repeat(encode_fn, number=number, repeat=3)) / number * 1e9),
+            "decode_ns": round(min(timeit.repeat(decode_fn, number=number, repeat=3)) / number * 1e9),
+        }
+    return results
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100_000)
+    args = parser.parse_args()
+    for name, row in run(args.number).items():
+        print(f"{name:<18} {row['bytes']:>4} B  encode {row['encode_ns']:>6} ns  decode {row['decode_ns']:>6} ns")
+
+
+if __name__ == "__main__":
+    main_cli()
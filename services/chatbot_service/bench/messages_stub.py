@@ -0,0 +1,65 @@
+"""Servidor HTTP local que reemplaza al servicio de mensajes (MESSAGES_SERVICE_URL)."""
+
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MessagesServiceStub:
+    """Acepta ``POST /threads/{id}/messages`` con latencia y tasa de error configurables."""
+
+    def __init__(self, latency_ms: float = 5.0, error_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.received = 0
+        self.failed = 0
+        self.connections = set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                time.sleep(stub.latency_ms / 1000)
+                with stub._lock:
+                    stub.connections.add(self.client_address)
+                    fail = random.random() < stub.error_rate
+                    if fail:
+                        stub.failed += 1
+                    elif self.path.startswith("/threads/") and self.path.endswith("/messages"):
+                        stub.received += 1
+                status = 503 if fail else 201
+                body = b'{"status": "error"}' if fail else b'{"status": "created"}'
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MessagesServiceStub":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"received": self.received, "failed": self.failed, "connections": len(self.connections)}
@@ -0,0 +1,425 @@
+"""Benchmark offline del pipeline quiz_service -> RabbitMQ -> callback -> servicio de mensajes.
+
+Usa el backend LLM simulado (``FakeLLMBackend``), un servidor HTTP local en
+lugar de MESSAGES_SERVICE_URL y el broker en memoria de ``bench.broker``.
+El código que se mide es el real: ``publish_question_batch`` de quiz_service
+y ``build_message_handler``/``callback`` de chatbot_service.
+
+Uso (desde services/chatbot_service)::
+
+    python -m bench.run --scenario all --workers 8 --output bench_results.json
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import pika
+
+from app import envelope, main
+from app.retry import retry_queue_name
+from app.singleflight import SingleFlight
+
+from .broker import InMemoryBroker, InMemoryConnection
+from .messages_stub import MessagesServiceStub
+
+QUIZ_APP_DIR = Path(__file__).resolve().parents[2] / "quiz_service" / "app"
+
+
+@dataclass
+class Scenario:
+    name: str
+    messages: int = 200
+    # Mensajes por segundo que publica quiz_service; None publica todo en un solo lote
+    publish_rate: float | None = 100.0
+    # Fracción de mensajes en formato thread (el resto en formato quiz)
+    thread_share: float = 0.5
+    threads: int = 20
+    # El costo por token de entrada permite medir el efecto del caché de prompt
+    llm: dict = field(default_factory=lambda: {"latency_ms": 150.0, "ms_per_prompt_token": 0.2})
+    # Segundos desde el inicio durante los que el LLM falla con la configuración de ``outage``
+    outage_seconds: float = 0.0
+    outage: dict = field(default_factory=dict)
+    # Cuota de peticiones por minuto del limitador (0 = sin límite)
+    gemini_rpm: float = 0.0
+    delivery_latency_ms: float = 5.0
+    delivery_error_rate: float = 0.0
+    # Preguntas de threads (carril interactivo) publicadas en la cola principal mientras corre el quiz
+    interactive_messages: int = 0
+    interactive_rate: float = 10.0
+    timeout: float = 60.0
+
+
+SCENARIOS = {
+    "steady": Scenario("steady"),
+    "burst": Scenario("burst", messages=400, publish_rate=None),
+    "gemini_outage": Scenario(
+        "gemini_outage",
+        messages=150,
+        outage_seconds=1.0,
+        outage={"error_rate": 1.0, "error_code": 429, "retry_after": 0.2},
+    ),
+    # Cola larga de latencia del modelo: la mide el hedging del router
+    "gemini_tail": Scenario("gemini_tail", publish_rate=20.0, llm={"latency_ms": 150.0, "latency_sigma": 1.0}),
+    # Backlog del quiz acotado por la cuota de Gemini: el caso para MICRO_BATCH_SIZE (--micro-batch),
+    # que solo agrupa preguntas del carril bulk sin thread
+    "backlog": Scenario(
+        "backlog",
+        messages=400,
+        publish_rate=None,
+        thread_share=0.0,
+        llm={"latency_ms": 300.0, "ms_per_output_token": 0.5},
+        gemini_rpm=300,
+    ),
+    "slow_delivery": Scenario("slow_delivery", messages=150, thread_share=1.0, delivery_latency_ms=300.0),
+    # Backlog del quiz mientras llegan preguntas de threads: la latencia interactiva no debe crecer
+    "mixed": Scenario(
+        "mixed",
+        messages=400,
+        publish_rate=None,
+        thread_share=0.0,
+        interactive_messages=60,
+        interactive_rate=10.0,
+    ),
+    # Modelo con razonamiento dinámico y costo por token generado: lo acotan los perfiles (--no-profiles)
+    "profiles": Scenario(
+        "profiles",
+        messages=200,
+        publish_rate=None,
+        llm={"latency_ms": 150.0, "ms_per_output_token": 0.2, "reply_chars": 2400, "thinking_tokens": 1500},
+    ),
+}
+
+
+def load_quiz_service():
+    """Importa quiz_service como paquete ``quiz_app`` (ambos servicios se llaman ``app``)"""
+    if "quiz_app.main" in sys.modules:
+        return sys.modules["quiz_app.main"]
+    spec = importlib.util.spec_from_file_location(
+        "quiz_app", QUIZ_APP_DIR / "__init__.py", submodule_search_locations=[str(QUIZ_APP_DIR)]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["quiz_app"] = package
+    spec.loader.exec_module(package)
+    return importlib.import_module("quiz_app.main")
+
+
+class BrokerPublisher:
+    """Reemplaza al RabbitPublisher de quiz_service publicando en el broker en memoria"""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.connected = True
+
+    def publish(self, routing_key, body, properties, exchange=""):
+        self.broker.publish(exchange, routing_key, body, properties)
+
+    def publish_batch(self, routing_key, bodies, properties, exchange="", timeout=None, routing_keys=None):
+        for key, body in zip(routing_keys or [routing_key] * len(bodies), bodies):
+            self.broker.publish(exchange, key, body, properties)
+        return []
+
+
+class OutcomeTracker:
+    """Sigue cada mensaje lógico (por cuerpo) desde su publicación hasta el ack final o la DLX"""
+
+    def __init__(self, *work_queues: str):
+        self.work_queues = work_queues
+        self._lock = threading.Lock()
+        self.published_at: dict[bytes, float] = {}
+        self.lanes: dict[bytes, str] = {}
+        self.retrying: set[bytes] = set()
+        self.latencies: list[float] = []
+        self.lane_latencies: dict[str, list[float]] = {}
+        self.completed = 0
+        self.dead_lettered = 0
+        self.retries = 0
+
+    def mark_published(self, bodies, lane: str = envelope.BULK) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            for body in bodies:
+                body = body.encode("utf-8") if isinstance(body, str) else body
+                self.published_at.setdefault(body, now)
+                self.lanes[body] = lane
+
+    def on_publish(self, exchange, routing_key, body) -> None:
+        if any(routing_key == queue or routing_key.startswith(f"{queue}.retry.") for queue in self.work_queues):
+            with self._lock:
+                if body in self.published_at:
+                    self.retrying.add(body)
+                    self.retries += 1
+
+    def on_ack(self, queue, message) -> None:
+        with self._lock:
+            if message.body in self.retrying:
+                # Se confirmó una entrega que ya fue republicada para reintento
+                self.retrying.discard(message.body)
+                return
+            self.completed += 1
+            latency = time.perf_counter() - self.published_at[message.body]
+            self.latencies.append(latency)
+            self.lane_latencies.setdefault(self.lanes[message.body], []).append(latency)
+
+    def on_dead_letter(self, queue, message) -> None:
+        with self._lock:
+            self.dead_lettered += 1
+
+    @property
+    def settled(self) -> int:
+        with self._lock:
+            return self.completed + self.dead_lettered
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: list[float]) -> dict:
+    values_ms = [value * 1000 for value in values]
+    return {
+        "p50": round(percentile(values_ms, 50), 2),
+        "p95": round(percentile(values_ms, 95), 2),
+        "p99": round(percentile(values_ms, 99), 2),
+        "max": round(max(values_ms, default=0.0), 2),
+    }
+
+
+def configure_service(scenario: Scenario, workers: int, micro_batch: int, prompt_cache: bool,
+                      stub: MessagesServiceStub, retry_delays: list[float], bulk_queue: str, profiles: bool):
+    """Ajusta chatbot_service para el benchmark y retorna el backend LLM simulado"""
+    main.GEMINI_BACKEND = "fake"
+    main.GEMINI_RPM = scenario.gemini_rpm
+    main.CONSUMER_WORKERS = workers
+    main.CONSUMER_PREFETCH = workers
+    main.BULK_PREFETCH = workers
+    main.BULK_QUEUE = bulk_queue
+    main.MICRO_BATCH_SIZE = micro_batch
+    main.PROMPT_CACHE_ENABLED = prompt_cache
+    main.GENERATION_PROFILES_ENABLED = profiles
+    main.RETRY_DELAYS = retry_delays
+    main.MESSAGES_SERVICE_URL = stub.url
+    # La caché y la coalescencia ocultarían el costo del pipeline: se desactivan
+    main.RESPONSE_CACHE_MAX_ENTRIES = 0
+    main._inflight = SingleFlight()
+    if main._worker_pool is not None:
+        main._worker_pool.shutdown(wait=True)
+        main._worker_pool = None
+    for factory in (main.get_genai_client, main.get_response_cache, main.get_limiter, main.get_delivery,
+                    main.get_router, main.get_batcher, main.get_prompt_cache, main.get_idempotency_store,
+                    main.get_usage):
+        factory.cache_clear()
+    return main.get_genai_client()
+
+
+def scale_retry_queues(broker: InMemoryBroker, queues: list[str], retry_delays: list[float]) -> None:
+    """Los TTL de las colas de espera de definitions.json son de producción: el benchmark usa ``retry_delays``"""
+    for queue in queues:
+        for tier, delay in enumerate(retry_delays, start=1):
+            name = retry_queue_name(queue, tier)
+            if broker.has_queue(name):
+                broker.queue_arguments[name] = {**broker.queue_arguments[name], "x-message-ttl": int(delay * 1000)}
+
+
+def run_scenario(scenario: Scenario, workers: int, retry_delays: list[float], micro_batch: int = 1,
+                 prompt_cache: bool = True, lanes: bool = True, profiles: bool = True) -> dict:
+    quiz = load_quiz_service()
+    broker = InMemoryBroker()
+    connection = InMemoryConnection(broker)
+    channel = connection.channel()
+    work_queue = quiz.QUEUE_NAME
+    # Sin carriles, quiz_service publica en la cola principal como antes
+    bulk_queue = quiz.BULK_QUEUE if lanes else ""
+    quiz.PUBLISH_QUEUE = bulk_queue or work_queue
+    tracker = OutcomeTracker(work_queue, *([bulk_queue] if bulk_queue else []))
+    scale_retry_queues(broker, [work_queue, *([bulk_queue] if bulk_queue else [])], retry_delays)
+    channel.listeners.append(tracker)
+    quiz.publisher = BrokerPublisher(broker)
+
+    stub = MessagesServiceStub(scenario.delivery_latency_ms, scenario.delivery_error_rate).start()
+    llm = configure_service(scenario, workers, micro_batch, prompt_cache, stub, retry_delays, bulk_queue, profiles)
+    llm.configure(**scenario.llm)
+    # Registrar la instrucción de sistema antes de empezar (en el servicio lo hace el evento de startup)
+    main.get_prompt_cache().refresh()
+    main.check_delayed_retry_queues(connection, work_queue)
+    channel.basic_qos(prefetch_count=main.CONSUMER_PREFETCH)
+    handler = main.build_message_handler(connection, channel)
+    consumers = [(channel, work_queue, handler)]
+    if bulk_queue:
+        # Como setup_bulk_lane: canal propio con su prefetch
+        bulk_channel = connection.channel()
+        bulk_channel.listeners.append(tracker)
+        main.check_delayed_retry_queues(connection, bulk_queue)
+        bulk_channel.basic_qos(prefetch_count=main.BULK_PREFETCH)
+        consumers.append((bulk_channel, bulk_queue,
+                          main.build_message_handler(connection, bulk_channel, lane=envelope.BULK)))
+
+    thread_ids = [str(uuid.uuid4()) for _ in range(scenario.threads)]
+    items = []
+    for i in range(scenario.messages):
+        question = f"{quiz.QUESTIONS[i % len(quiz.QUESTIONS)]} (#{i})"
+        if i < scenario.messages * scenario.thread_share:
+            items.append(quiz.BatchQuestion(
+                question=question, thread_id=thread_ids[i % len(thread_ids)], user_id=str(uuid.uuid4())
+            ))
+        else:
+            items.append(quiz.BatchQuestion(question=question))
+
+    def publish_all():
+        # Interceptar los cuerpos que arma quiz_service para medir latencia desde la publicación
+        original = quiz.publisher.publish_batch
+
+        def publish_batch(routing_key, bodies, properties, exchange="", timeout=None, routing_keys=None):
+            tracker.mark_published(bodies)
+            return original(routing_key, bodies, properties, exchange, timeout, routing_keys)
+
+        quiz.publisher.publish_batch = publish_batch
+        if scenario.publish_rate is None:
+            quiz.publish_question_batch(items)
+            return
+        step = max(1, int(scenario.publish_rate / 20))
+        for start in range(0, len(items), step):
+            quiz.publish_question_batch(items[start:start + step])
+            time.sleep(step / scenario.publish_rate)
+
+    def publish_interactive():
+        # Preguntas de threads como las publica el servicio de mensajes: cola principal, sin header de carril
+        properties = pika.BasicProperties(content_type=envelope.JSON, headers=envelope.headers())
+        for i in range(scenario.interactive_messages):
+            body = quiz.build_question_message(
+                str(uuid.uuid4()), f"{quiz.QUESTIONS[i % len(quiz.QUESTIONS)]} (chat #{i})",
+                thread_ids[i % len(thread_ids)], str(uuid.uuid4()),
+            )
+            tracker.mark_published([body], envelope.INTERACTIVE)
+            broker.publish("", work_queue, body, properties)
+            time.sleep(1 / scenario.interactive_rate)
+
+    if scenario.outage_seconds:
+        healthy = {key: getattr(llm, key) for key in scenario.outage}
+        llm.configure(**scenario.outage)
+        threading.Timer(scenario.outage_seconds, lambda: llm.configure(**healthy)).start()
+
+    started = time.perf_counter()
+    publishers = [threading.Thread(target=publish_all, daemon=True)]
+    if scenario.interactive_messages:
+        publishers.append(threading.Thread(target=publish_interactive, daemon=True))
+    for publisher_thread in publishers:
+        publisher_thread.start()
+    total = scenario.messages + scenario.interactive_messages
+
+    deadline = started + scenario.timeout
+    while time.perf_counter() < deadline:
+        worked = False
+        for consumer_channel, queue, queue_handler in consumers:
+            worked = consumer_channel.dispatch(queue, queue_handler) or worked
+        if not any(thread.is_alive() for thread in publishers) and tracker.settled >= total:
+            break
+        if not worked:
+            time.sleep(0.001)
+    duration = time.perf_counter() - started
+
+    if main._worker_pool is not None:
+        main._worker_pool.wait_idle(timeout=5)
+    connection.process_callbacks()
+    delivery = main.get_delivery().stats()
+    stub_stats = stub.stats()
+    stub.stop()
+
+    llm_stats = llm.stats()
+    return {
+        "scenario": scenario.name,
+        "config": asdict(scenario),
+        "workers": workers,
+        "micro_batch": micro_batch,
+        "prompt_cache": prompt_cache,
+        "lanes": lanes,
+        "profiles": profiles,
+        "messages": total,
+        "completed": tracker.completed,
+        "timed_out": tracker.settled < total,
+        "duration_s": round(duration, 3),
+        "throughput_msg_s": round(tracker.completed / duration, 2) if duration else 0.0,
+        "latency_ms": latency_summary(tracker.latencies),
+        "lane_latency_ms": {lane: latency_summary(values) for lane, values in tracker.lane_latencies.items()},
+        "retries": tracker.retries,
+        "retry_rate": round(tracker.retries / total, 4),
+        "dead_lettered": tracker.dead_lettered,
+        "dlx_rate": round(tracker.dead_lettered / total, 4),
+        "responses_published": broker.depth(main.RESPONSES_QUEUE),
+        "llm": {
+            **llm_stats,
+            "prompt_tokens_per_call": round(llm_stats["prompt_tokens"] / llm_stats["calls"], 1)
+            if llm_stats["calls"] else 0.0,
+            "generated_tokens_per_call": round(
+                (llm_stats["output_tokens"] + llm_stats["thinking_tokens"]) / llm_stats["calls"], 1
+            ) if llm_stats["calls"] else 0.0,
+        },
+        "usage": main.get_usage().stats(),
+        "micro_batches": main.get_batcher().stats() if micro_batch > 1 else None,
+        "delivery": {**delivery, "stub": stub_stats},
+    }
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", default="all", choices=["all", *SCENARIOS])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--micro-batch", type=int, default=1, help="MICRO_BATCH_SIZE del consumidor")
+    parser.add_argument("--no-prompt-cache", action="store_true",
+                        help="Envía la instrucción de sistema completa en cada llamada")
+    parser.add_argument("--no-lanes", action="store_true",
+                        help="quiz_service publica en la cola principal (sin carril bulk)")
+    parser.add_argument("--no-profiles", action="store_true",
+                        help="Todas las preguntas con la configuración por defecto del modelo")
+    parser.add_argument("--messages", type=int, help="Sobrescribe la cantidad de mensajes de cada escenario")
+    parser.add_argument("--retry-delays", default="0.1,0.3,0.6",
+                        help="TTL de las colas de reintento (segundos), reducidos para el benchmark")
+    parser.add_argument("--output", help="Archivo JSON de resultados")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs del servicio")
+    args = parser.parse_args(argv)
+
+    # Los reintentos esperados del escenario de caída generarían cientos de líneas de log
+    for logger_name in ("app", "quiz_app", "httpx"):
+        logging.getLogger(logger_name).setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    retry_delays = [float(part) for part in args.retry_delays.split(",")]
+
+    results = []
+    for name in names:
+        scenario = SCENARIOS[name]
+        if args.messages:
+            scenario = Scenario(**{**asdict(scenario), "messages": args.messages})
+        result = run_scenario(scenario, args.workers, retry_delays, args.micro_batch, not args.no_prompt_cache,
+                              not args.no_lanes, not args.no_profiles)
+        results.append(result)
+        latency = result["latency_ms"]
+        print(
+            f"{name:<15} {result['throughput_msg_s']:>8.1f} msg/s  "
+            f"p50 {latency['p50']:>8.1f} ms  p95 {latency['p95']:>8.1f} ms  p99 {latency['p99']:>8.1f} ms  "
+            f"retries {result['retry_rate']:.2%}  dlx {result['dlx_rate']:.2%}  "
+            f"llm calls {result['llm']['calls']}  prompt tokens/call {result['llm']['prompt_tokens_per_call']}  "
+            f"generated tokens/call {result['llm']['generated_tokens_per_call']}"
+            + (f"  interactive p95 {result['lane_latency_ms'][envelope.INTERACTIVE]['p95']:.1f} ms"
+               if envelope.INTERACTIVE in result["lane_latency_ms"] else "")
+            + ("  (TIMEOUT)" if result["timed_out"] else "")
+        )
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"results": results}, indent=2))
+    return 0 if not any(result["timed_out"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,151 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from app import envelope, main
+from app.batching import BatchItemError, MicroBatcher, parse_batch_reply
+
+
+def submit_concurrently(batcher, items):
+    results = {}
+
+    def worker(item):
+        try:
+            results[item] = batcher.submit(item)
+        except Exception as exc:
+            results[item] = exc
+
+    threads = [threading.Thread(target=worker, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results
+
+
+def test_full_batch_runs_once_and_splits_results():
+    calls = []
+
+    def run_batch(items):
+        calls.append(list(items))
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(run_batch, max_size=4, max_wait=5)
+    results = submit_concurrently(batcher, ["a", "b", "c", "d"])
+
+    assert results == {"a": "A", "b": "B", "c": "C", "d": "D"}
+    assert len(calls) == 1 and sorted(calls[0]) == ["a", "b", "c", "d"]
+    assert batcher.stats()["avg_batch_size"] == 4
+
+
+def test_partial_batch_flushes_after_max_wait():
+    batcher = MicroBatcher(lambda items: [len(items)] * len(items), max_size=10, max_wait=0.05)
+
+    started = time.monotonic()
+    assert batcher.submit("solo") == 1
+    assert time.monotonic() - started < 1
+
+
+def test_failed_item_does_not_affect_the_rest():
+    def run_batch(items):
+        return [BatchItemError(item) if item == "mala" else item for item in items]
+
+    batcher = MicroBatcher(run_batch, max_size=3, max_wait=5)
+    results = submit_concurrently(batcher, ["una", "mala", "otra"])
+
+    assert results["una"] == "una" and results["otra"] == "otra"
+    assert isinstance(results["mala"], BatchItemError)
+    assert batcher.stats()["failed_items"] == 1
+
+
+def test_batch_call_failure_reaches_every_item():
+    def run_batch(items):
+        raise RuntimeError("modelo caído")
+
+    batcher = MicroBatcher(run_batch, max_size=2, max_wait=5)
+    results = submit_concurrently(batcher, ["a", "b"])
+
+    assert all(isinstance(result, RuntimeError) for result in results.values())
+    with pytest.raises(RuntimeError):
+        MicroBatcher(run_batch, max_size=1, max_wait=0).submit("c")
+
+
+def test_parse_batch_reply_maps_ids_and_marks_missing_items():
+    text = '```json\n{"respuestas": [{"id": 2, "respuesta": "dos"}, {"id": 1, "respuesta": " uno "}, {"id": 9, "respuesta": "x"}]}\n```'
+
+    assert parse_batch_reply(text, 3) == ["uno", "dos", None]
+    assert parse_batch_reply("no es json", 2) == [None, None]
+
+
+def test_base_exception_in_the_leader_does_not_strand_followers():
+    class Abort(BaseException):
+        pass
+
+    def run_batch(items):
+        raise Abort()
+
+    batcher = MicroBatcher(run_batch, max_size=3, max_wait=5)
+    results = {}
+
+    def worker(item):
+        try:
+            results[item] = batcher.submit(item)
+        except BaseException as exc:
+            results[item] = exc
+
+    threads = [threading.Thread(target=worker, args=(item,)) for item in "abc"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert sorted(type(result).__name__ for result in results.values()) == ["Abort", "BatchItemError", "BatchItemError"]
+
+
+def test_only_bulk_questions_without_thread_are_batched(monkeypatch):
+    class Channel:
+        def basic_ack(self, delivery_tag=0, multiple=False):
+            pass
+
+        def basic_publish(self, **kwargs):
+            pass
+
+    batched = []
+
+    def answer_question(question, batchable=False):
+        batched.append((question, batchable))
+        return "respuesta"
+
+    monkeypatch.setattr(main, "answer_question", answer_question)
+    monkeypatch.setattr(main, "send_response_to_thread", lambda *args: True)
+    main.get_idempotency_store.cache_clear()
+    bulk_headers = {**envelope.headers(), envelope.LANE_HEADER: envelope.BULK}
+    messages = [
+        (envelope.QuestionMessage(question_id="q1", question="quiz"), bulk_headers),
+        (envelope.QuestionMessage(question_id="q2", question="lote con thread", thread_id="t1", user_id="u1"),
+         bulk_headers),
+        (envelope.QuestionMessage(question_id="q3", question="interactiva", thread_id="t2", user_id="u2"),
+         envelope.headers()),
+    ]
+    for tag, (message, headers) in enumerate(messages):
+        properties = pika.BasicProperties(content_type=envelope.JSON, headers=headers)
+        method = SimpleNamespace(delivery_tag=tag, redelivered=False, routing_key="quiz_questions")
+        main.callback(Channel(), method, properties, envelope.encode(message))
+    main.get_idempotency_store.cache_clear()
+
+    assert batched == [("quiz", True), ("lote con thread", False), ("interactiva", False)]
+
+
+def test_unbatchable_questions_skip_the_batcher(monkeypatch):
+    monkeypatch.setattr(main, "MICRO_BATCH_SIZE", 4)
+    monkeypatch.setattr(main, "get_batcher", lambda: SimpleNamespace(submit=lambda item: "lote"))
+    monkeypatch.setattr(main, "process_question_with_gemini", lambda question: "sola")
+    main.get_response_cache.cache_clear()
+
+    assert main.answer_question("¿Qué es una API?", batchable=True) == "lote"
+    assert main.answer_question("¿Qué es un proceso?") == "sola"
+    main.get_response_cache.cache_clear()
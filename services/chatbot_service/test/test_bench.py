@@ -0,0 +1,60 @@
+import pytest
+
+from app import main
+from bench.run import SCENARIOS, Scenario, run_scenario
+
+PATCHED = ("GEMINI_BACKEND", "GEMINI_RPM", "CONSUMER_WORKERS", "CONSUMER_PREFETCH", "MICRO_BATCH_SIZE",
+           "PROMPT_CACHE_ENABLED", "RETRY_DELAYS", "MESSAGES_SERVICE_URL", "RESPONSE_CACHE_MAX_ENTRIES",
+           "BULK_QUEUE", "BULK_PREFETCH", "GENERATION_PROFILES_ENABLED", "_inflight", "_worker_pool")
+FACTORIES = (main.get_genai_client, main.get_response_cache, main.get_limiter, main.get_delivery,
+             main.get_router, main.get_batcher, main.get_prompt_cache, main.get_idempotency_store, main.get_usage)
+
+
+@pytest.fixture(autouse=True)
+def restore_service(monkeypatch):
+    for name in PATCHED:
+        monkeypatch.setattr(main, name, getattr(main, name))
+    yield
+    if main._worker_pool is not None:
+        main._worker_pool.shutdown(wait=True)
+    for factory in FACTORIES:
+        factory.cache_clear()
+    main._delayed_retry_queues.clear()
+
+
+def test_offline_pipeline_settles_every_message():
+    scenario = Scenario("smoke", messages=20, publish_rate=None, llm={"latency_ms": 5.0}, timeout=20)
+
+    result = run_scenario(scenario, workers=4, retry_delays=[0.05, 0.1, 0.2])
+
+    assert not result["timed_out"]
+    assert result["completed"] == 20
+    assert result["llm"]["calls"] == 20
+    assert result["delivery"]["stub"]["received"] == 10
+    assert result["responses_published"] == 10
+
+
+def test_outage_is_retried_through_delay_queues():
+    scenario = Scenario(
+        "outage", messages=10, publish_rate=None, llm={"latency_ms": 5.0},
+        outage_seconds=0.2, outage={"error_rate": 1.0, "error_code": 503}, timeout=20,
+    )
+
+    result = run_scenario(scenario, workers=2, retry_delays=[0.05, 0.1, 0.2])
+
+    assert result["completed"] + result["dead_lettered"] == 10
+    assert result["retries"] > 0
+    assert set(SCENARIOS) == {"steady", "burst", "gemini_outage", "gemini_tail", "backlog", "slow_delivery", "mixed",
+                              "profiles"}
+
+
+def test_micro_batching_answers_each_message_with_fewer_calls():
+    # Solo preguntas del quiz: las de un thread no se agrupan
+    scenario = Scenario("batched", messages=16, publish_rate=None, thread_share=0.0, llm={"latency_ms": 20.0},
+                        timeout=20)
+
+    result = run_scenario(scenario, workers=8, retry_delays=[0.05, 0.1, 0.2], micro_batch=8)
+
+    assert result["completed"] == 16
+    assert result["llm"]["calls"] < 16
+    assert result["micro_batches"]["items"] == 16
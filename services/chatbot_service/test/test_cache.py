@@ -0,0 +1,45 @@
+import time
+
+from app.cache import ResponseCache, SQLiteCacheBackend, make_cache_key, normalize_question
+
+
+def test_normalized_questions_share_key():
+    assert normalize_question("  ¿Qué es   una API?\n") == "¿Qué es una API?"
+    assert make_cache_key("Qué es  una API", "1", "m") == make_cache_key(" Qué es una API ", "1", "m")
+    assert make_cache_key("Qué es una API", "1", "m") != make_cache_key("Qué es una API", "2", "m")
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.set("a", "1234")
+    cache.set("b", "1234")
+    cache.get("a")
+    cache.set("c", "1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1234"
+
+    cache.set("d", "123456789")
+    assert cache.stats()["bytes"] <= 10
+    assert cache.stats()["evictions"] >= 2
+
+
+def test_ttl_expiration_counts_as_miss():
+    cache = ResponseCache(ttl=0.01)
+    cache.set("a", "respuesta")
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_sqlite_backend_starts_warm(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(backend=SQLiteCacheBackend(path))
+    cache.set("a", "respuesta")
+    cache.close()
+
+    restarted = ResponseCache(backend=SQLiteCacheBackend(path))
+
+    assert restarted.get("a") == "respuesta"
+    assert restarted.stats()["hits"] == 1
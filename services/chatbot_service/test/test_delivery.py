@@ -0,0 +1,103 @@
+import time
+
+import httpx
+
+from app.delivery import CircuitBreaker, MessagesDelivery
+
+THREAD_ID = "6f1c1f1e-5a7e-4f61-9a57-1d3d2c1b0a99"
+BOT_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def make_delivery(handler, **kwargs):
+    delivery = MessagesDelivery("http://messages", BOT_ID, backoff_base=0.001, backoff_max=0.01, **kwargs)
+    delivery._client = httpx.Client(transport=httpx.MockTransport(handler))
+    return delivery
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_outbox_retries_until_delivered():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503 if len(calls) < 3 else 201)
+
+    delivery = make_delivery(handler)
+    assert delivery.enqueue(THREAD_ID, {"content": "hola"})
+
+    assert wait_for(lambda: delivery.stats()["delivered"] == 1)
+    assert delivery.stats()["retried"] == 2
+    assert calls[-1].headers["X-User-Id"] == BOT_ID
+    assert calls[-1].url.path == f"/threads/{THREAD_ID}/messages"
+    delivery.close()
+
+
+def test_client_errors_are_not_retried():
+    delivery = make_delivery(lambda request: httpx.Response(404))
+
+    assert delivery.send(THREAD_ID, {"content": "hola"}) is False
+    assert delivery.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_breaker_rejects_new_deliveries():
+    delivery = make_delivery(lambda request: httpx.Response(500), breaker=CircuitBreaker(failure_threshold=2))
+
+    delivery.send(THREAD_ID, {"content": "hola"})
+    delivery.send(THREAD_ID, {"content": "hola"})
+
+    assert delivery.breaker.state == CircuitBreaker.OPEN
+    assert delivery.enqueue(THREAD_ID, {"content": "hola"}) is False
+    assert delivery.stats()["rejected"] == 1
+
+
+def test_half_open_breaker_admits_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.acquire() is True
+    assert breaker.acquire() is False
+    assert breaker.allow() is True
+
+    breaker.record_success()
+    assert breaker.acquire() is True and breaker.acquire() is True
+
+
+def test_deliveries_of_a_thread_keep_their_order():
+    calls = []
+
+    def handler(request):
+        content = request.read().decode()
+        # El primer intento de cada respuesta falla: sin serializar, la segunda adelantaría a la primera
+        failed = content not in [call for call, _ in calls]
+        calls.append((content, failed))
+        return httpx.Response(503 if failed else 201)
+
+    delivery = make_delivery(handler, workers=4)
+    for i in range(5):
+        assert delivery.enqueue(THREAD_ID, {"content": f"respuesta {i}"})
+
+    assert wait_for(lambda: delivery.stats()["delivered"] == 5)
+    delivered = [content for content, failed in calls if not failed]
+    assert delivered == sorted(delivered)
+    delivery.close()
+
+
+def test_exhausted_delivery_is_handed_to_give_up():
+    given_up = []
+    delivery = make_delivery(lambda request: httpx.Response(503), max_retries=1, on_give_up=given_up.append)
+
+    assert delivery.enqueue(THREAD_ID, {"content": "hola"}, context={"question_id": "q1"})
+
+    assert wait_for(lambda: given_up)
+    assert given_up[0].context == {"question_id": "q1"} and given_up[0].attempts == 2
+    assert delivery.stats()["dropped"] == 1
+    delivery.close()
@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from app import envelope
+from app.envelope import EnvelopeError, QuestionMessage, ResponseMessage
+
+
+def test_quiz_service_copy_is_identical():
+    here = Path(__file__).resolve().parents[1] / "app" / "envelope.py"
+    quiz = Path(__file__).resolve().parents[2] / "quiz_service" / "app" / "envelope.py"
+    assert quiz.read_bytes() == here.read_bytes()
+
+
+@pytest.mark.parametrize("content_type", envelope.CONTENT_TYPES)
+def test_v2_question_round_trip(content_type):
+    message = QuestionMessage(question_id="q1", question="¿Qué es RabbitMQ?", timestamp=1.5,
+                              thread_id="t1", user_id="u1")
+    body = envelope.encode(message, content_type)
+
+    decoded, message_format = envelope.decode_question(body, content_type, envelope.headers(content_type))
+
+    assert decoded == message
+    assert message_format == "thread"
+
+
+def test_v2_question_without_thread_is_quiz():
+    body = envelope.encode(QuestionMessage(question_id="q1", question="hola"))
+    decoded, message_format = envelope.decode_question(body, envelope.JSON, envelope.headers())
+    assert decoded.thread_id is None
+    assert message_format == "quiz"
+
+
+def test_legacy_thread_message():
+    body = json.dumps({"id": 7, "thread_id": "t1", "user_id": "u1", "content": "hola"}).encode()
+    decoded, message_format = envelope.decode_question(body, "application/json", None)
+    assert message_format == "thread"
+    assert (decoded.question_id, decoded.question, decoded.thread_id, decoded.user_id) == ("7", "hola", "t1", "u1")
+
+
+def test_legacy_quiz_message():
+    body = json.dumps({"question_id": "q1", "question": "hola", "timestamp": 1.0}).encode()
+    decoded, message_format = envelope.decode_question(body, None, {})
+    assert message_format == "quiz"
+    assert (decoded.question_id, decoded.question) == ("q1", "hola")
+
+
+def test_legacy_message_with_other_shape_is_unknown():
+    body = json.dumps({"texto": "hola"}).encode()
+    decoded, message_format = envelope.decode_question(body)
+    assert message_format == "unknown"
+    assert decoded.question == body.decode()
+
+
+def test_invalid_json_raises():
+    with pytest.raises(EnvelopeError):
+        envelope.decode_question(b"{no es json")
+
+
+def test_unsupported_version_or_content_type_raises():
+    body = envelope.encode(QuestionMessage(question_id="q1", question="hola"))
+    with pytest.raises(EnvelopeError):
+        envelope.decode_question(body, envelope.JSON, {envelope.VERSION_HEADER: 3})
+    with pytest.raises(EnvelopeError):
+        envelope.decode_question(body, "text/plain", envelope.headers())
+    with pytest.raises(EnvelopeError):
+        envelope.encode(QuestionMessage(question_id="q1", question="hola"), "text/plain")
+
+
+def test_response_is_rejected_as_question():
+    body = envelope.encode(ResponseMessage(question_id="q1", question="a", response="b", timestamp=1.0,
+                                           processed_by="chatbot_service"))
+    with pytest.raises(EnvelopeError):
+        envelope.decode_question(body, envelope.JSON, envelope.headers())
+
+
+def test_response_json_keeps_previous_keys():
+    body = envelope.encode(ResponseMessage(question_id="q1", question="a", response="b", timestamp=1.0,
+                                           processed_by="chatbot_service"))
+    data = json.loads(body)
+    assert {"question_id", "question", "response", "timestamp", "processed_by"} <= data.keys()
+    assert data["type"] == "response"
+
+
+def test_lane_header_defaults_and_ignores_unknown_values():
+    assert envelope.lane(None) == envelope.INTERACTIVE
+    assert envelope.lane({envelope.LANE_HEADER: b"bulk"}) == envelope.BULK
+    assert envelope.lane({envelope.LANE_HEADER: "urgent"}, envelope.BULK) == envelope.BULK
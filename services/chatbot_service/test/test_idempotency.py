@@ -0,0 +1,151 @@
+import time
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from app import envelope, main
+from app.idempotency import (
+    BloomFilter, IdempotencyRecord, IdempotencyStore, RotatingBloomFilter, SQLiteIdempotencyBackend, message_key,
+)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        raise AssertionError("nack inesperado")
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published.append(routing_key)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    calls = {"model": 0, "delivery": 0}
+    failures = []
+
+    def answer_question(question, batchable=False):
+        calls["model"] += 1
+        return "respuesta"
+
+    def send_response_to_thread(thread_id, user_id, response, question=None, question_id=None):
+        calls["delivery"] += 1
+        if failures:
+            raise failures.pop()
+        return True
+
+    monkeypatch.setattr(main, "answer_question", answer_question)
+    monkeypatch.setattr(main, "send_response_to_thread", send_response_to_thread)
+    monkeypatch.setattr(main, "RETRY_DELAY_ENABLED", False)
+    main.get_idempotency_store.cache_clear()
+    yield calls, failures
+    main.get_idempotency_store.cache_clear()
+
+
+def deliver(channel, tag, redelivered=False):
+    message = envelope.QuestionMessage(question_id="m1", question="hola", thread_id="t1", user_id="u1")
+    properties = pika.BasicProperties(content_type=envelope.JSON, headers=envelope.headers())
+    method = SimpleNamespace(delivery_tag=tag, redelivered=redelivered, routing_key="quiz_questions")
+    main.callback(channel, method, properties, envelope.encode(message))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [f"k{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert sum(f"otro{i}" in bloom for i in range(1000)) < 50
+
+
+def test_rotating_bloom_forgets_after_two_generations():
+    bloom = RotatingBloomFilter(capacity=10)
+    for i in range(30):
+        bloom.add(f"k{i}")
+    assert "k29" in bloom
+    assert bloom.rotations == 2
+
+
+def test_message_key_falls_back_to_body_hash():
+    assert message_key("q1", "t1", b"x") == "t1:q1"
+    assert message_key("unknown", None, b"x") == message_key(None, None, b"x") != message_key(None, None, b"y")
+
+
+def test_store_keeps_reply_until_done_and_evicts_lru():
+    store = IdempotencyStore(max_entries=2)
+    store.record_reply("a", "respuesta")
+    assert store.get("a").reply == "respuesta"
+    store.mark_done("a")
+    record = store.get("a")
+    assert record.done and record.reply is None
+
+    store.mark_done("b")
+    store.mark_done("c")
+    assert store.get("a") is None
+    assert store.stats()["entries"] == 2
+
+
+def test_sqlite_backend_survives_restart_and_bloom_skips_new_ids(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    store = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+    store.record_reply("a", "respuesta")
+    store.close()
+
+    restarted = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+    assert restarted.get("a").reply == "respuesta"
+    assert restarted.get("nuevo") is None
+    assert restarted.stats()["bloom_skips"] == 1
+
+
+def test_redelivered_message_checks_backend_written_by_another_replica(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    replica = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+    other = IdempotencyStore(backend=SQLiteIdempotencyBackend(path))
+
+    other.mark_done("a")
+    other.close()
+
+    assert replica.get("a") is None
+    assert replica.get("a", redelivered=True).done
+
+
+def test_sqlite_backend_reads_writes_not_yet_flushed(tmp_path):
+    backend = SQLiteIdempotencyBackend(str(tmp_path / "idempotency.db"))
+    # Con la base tomada, el escritor no puede aplicar lo encolado
+    with backend._conn_lock:
+        backend.put("a", IdempotencyRecord("respuesta", False, time.time() + 60))
+        assert backend.get("a", time.time()).reply == "respuesta"
+    backend.close()
+
+    reopened = SQLiteIdempotencyBackend(str(tmp_path / "idempotency.db"))
+    assert reopened.get("a", time.time()).reply == "respuesta"
+    reopened.close()
+
+
+def test_redelivery_after_ack_lost_is_only_acked(service):
+    calls, _ = service
+    channel = FakeChannel()
+
+    deliver(channel, 1)
+    deliver(channel, 2, redelivered=True)
+
+    assert calls == {"model": 1, "delivery": 1}
+    assert channel.acked == [1, 2]
+
+
+def test_retry_after_failed_delivery_reuses_the_reply(service):
+    calls, failures = service
+    failures.append(RuntimeError("servicio de mensajes caído"))
+    channel = FakeChannel()
+
+    deliver(channel, 1)
+    assert channel.published == ["quiz_questions"]
+    deliver(channel, 2)
+
+    assert calls == {"model": 1, "delivery": 2}
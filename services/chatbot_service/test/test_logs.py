@@ -0,0 +1,49 @@
+import json
+import logging
+
+from app.logs import JsonFormatter, TextFormatter, log_event
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_logger(level=logging.INFO):
+    logger = logging.getLogger(f"test_logs.{level}")
+    logger.handlers[:] = [ListHandler()]
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+def test_event_fields_render_as_json():
+    logger = make_logger()
+    log_event(logger, "message_acked", question_id="q-1", ms=12.5)
+
+    record = logger.handlers[0].records[0]
+    line = json.loads(JsonFormatter().format(record))
+
+    assert line["event"] == "message_acked"
+    assert line["question_id"] == "q-1"
+    assert line["ms"] == 12.5
+
+
+def test_text_format_skips_empty_fields():
+    logger = make_logger()
+    log_event(logger, "message_received", question_id="q-1", thread_id=None)
+
+    line = TextFormatter("%(message)s").format(logger.handlers[0].records[0])
+
+    assert line == "message_received question_id=q-1"
+
+
+def test_disabled_level_emits_nothing():
+    logger = make_logger(logging.WARNING)
+    log_event(logger, "message_acked", question_id="q-1")
+
+    assert logger.handlers[0].records == []
@@ -0,0 +1,171 @@
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from app import envelope, main
+from app.llm_backends import FakeLLMBackend
+from app.profiles import (
+    BUGFIX, CODE, CONCEPT, DEFAULT_PROFILES, GenerationProfile, classify, combine, parse_profile,
+    thinking_budget_for,
+)
+from app.router import ModelRoute, ModelRouter
+from app.usage import BudgetExceeded, UsageLedger, UsageScope, usage_scope
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("¿Qué es una API?", CONCEPT),
+    ("Explica la diferencia entre un proceso y un hilo", CONCEPT),
+    ("Cómo hago un bucle for en Python?", CODE),
+    ("En Python, crea una función llamada es_palindromo", CODE),
+    ("numeros = [1,2,3]; cuadrados = []", CODE),
+    ("Encuentra el error en este fragmento y corrígelo: for i in range(5) print(i)", BUGFIX),
+    ("Mi script no funciona, lanza una excepción", BUGFIX),
+])
+def test_classify(question, expected):
+    assert classify(question) == expected
+
+
+def test_parse_profile_overrides_and_validates():
+    base = DEFAULT_PROFILES[CODE]
+    profile = parse_profile("max_output_tokens=256, thinking_budget=, model=gemini-2.5-flash-lite", base)
+    assert profile == GenerationProfile(CODE, 256, None, base.temperature, "gemini-2.5-flash-lite")
+    assert parse_profile("", base) == base
+    with pytest.raises(ValueError):
+        parse_profile("top_k=3", base)
+
+
+def test_combine_sums_output_limits():
+    batch = combine([DEFAULT_PROFILES[CONCEPT], DEFAULT_PROFILES[BUGFIX]])
+    assert batch.max_output_tokens == 1024 + 2048
+    assert batch.thinking_budget == 1024
+    assert batch.temperature == 0.2
+    assert combine([DEFAULT_PROFILES[CONCEPT], GenerationProfile("default")]).max_output_tokens is None
+
+
+@pytest.mark.parametrize("model, budget, expected", [
+    ("gemini-2.5-flash", 0, 0),
+    ("gemini-2.5-flash", 100000, 24576),
+    ("gemini-2.5-flash-lite", 256, 512),
+    ("gemini-2.5-pro", 0, 128),
+    ("models/gemini-2.5-pro", 1024, 1024),
+    ("gemini-2.5-pro", -1, -1),
+    ("gemini-2.0-flash", 512, None),
+    ("gemini-2.5-flash", None, None),
+])
+def test_thinking_budget_is_fitted_to_each_model(model, budget, expected):
+    assert thinking_budget_for(model, budget) == expected
+
+
+def test_router_prefers_the_profile_model():
+    router = ModelRouter([ModelRoute("a", 5), ModelRoute("b", 5)])
+    assert [route.name for route in router.routes_for("b")] == ["b", "a"]
+    assert router.routes_for("desconocido") == router.routes
+    assert router.generate(lambda model, timeout, hedge: model, "b") == "b"
+    router.close()
+
+
+def test_ledger_budgets_by_window():
+    ledger = UsageLedger(thread_budget=100, user_budget=150, window=3600)
+    scope = UsageScope("t1", "u1")
+    ledger.check(scope)
+    ledger.charge(scope, 120)
+
+    with pytest.raises(BudgetExceeded) as exc:
+        ledger.check(scope)
+    assert exc.value.scope == "thread"
+    # Otro thread del mismo usuario sigue teniendo cupo de usuario
+    ledger.check(UsageScope("t2", "u1"))
+    ledger.charge(UsageScope("t2", "u1"), 40)
+    with pytest.raises(BudgetExceeded):
+        ledger.check(UsageScope("t3", "u1"))
+    # Sin thread ni usuario (quiz, /chat) no hay presupuesto
+    ledger.check(None)
+    assert ledger.stats()["rejected_thread"] == 1 and ledger.stats()["rejected_user"] == 1
+
+    # Una ventana vieja no cuenta
+    ledger._spent["thread"]["t1"] = (0.0, 500)
+    assert ledger.spent("thread", "t1") == 0
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    backend = FakeLLMBackend(latency_ms=0, reply_chars=2000, thinking_tokens=3000, seed=1)
+    monkeypatch.setattr(main, "get_genai_client", lambda: backend)
+    monkeypatch.setattr(main, "PROMPT_CACHE_ENABLED", False)
+    monkeypatch.setattr(main, "GENERATION_PROFILES_ENABLED", True)
+    monkeypatch.setattr(main, "MICRO_BATCH_SIZE", 1)
+    for factory in (main.get_response_cache, main.get_prompt_cache, main.get_usage):
+        factory.cache_clear()
+    yield backend
+    for factory in (main.get_response_cache, main.get_prompt_cache, main.get_usage):
+        factory.cache_clear()
+
+
+def test_profile_limits_reach_the_model_and_usage_is_recorded(fake_model, monkeypatch):
+    monkeypatch.setattr(main, "THREAD_TOKEN_BUDGET", 500)
+
+    with usage_scope("t1", "u1"):
+        reply = main.answer_question("¿Qué es una API?")
+
+    # Perfil concept: sin razonamiento y a lo sumo 1024 tokens de salida
+    assert reply
+    stats = main.get_usage().stats()
+    assert stats["thinking_tokens"] == 0
+    assert stats["output_tokens"] <= 1024
+    assert stats["profiles"][CONCEPT]["calls"] == 1
+    assert main.get_usage().spent("thread", "t1") > 0
+
+    # El presupuesto del thread ya se agotó: no se llama al modelo
+    calls = fake_model.calls
+    with usage_scope("t1", "u1"), pytest.raises(BudgetExceeded):
+        main.answer_question("Encuentra el error en este código")
+    assert fake_model.calls == calls
+
+
+def test_budget_exceeded_is_dead_lettered_without_retries(monkeypatch):
+    class Channel:
+        def __init__(self):
+            self.nacked = []
+            self.acked = []
+            self.published = []
+
+        def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+            self.nacked.append((delivery_tag, requeue))
+
+        def basic_ack(self, delivery_tag=0, multiple=False):
+            self.acked.append(delivery_tag)
+
+        def basic_publish(self, **kwargs):
+            self.published.append(kwargs)
+
+    def answer_question(question, batchable=False):
+        raise BudgetExceeded("thread", "t1", 10, 5)
+
+    notices = []
+    monkeypatch.setattr(main, "answer_question", answer_question)
+    main.get_usage.cache_clear()
+    monkeypatch.setattr(main, "send_response_to_thread",
+                        lambda thread_id, user_id, response, *args: notices.append((thread_id, response)))
+    main.get_idempotency_store.cache_clear()
+    channel = Channel()
+    thread_id = "6f1c2a9e-0000-4000-8000-000000000001"
+    message = envelope.QuestionMessage(question_id="q1", question="hola", thread_id=thread_id, user_id="u1")
+    properties = pika.BasicProperties(content_type=envelope.JSON, headers=envelope.headers())
+    method = SimpleNamespace(delivery_tag=3, redelivered=False, routing_key="quiz_questions")
+
+    main.callback(channel, method, properties, envelope.encode(message))
+    # Otra pregunta del mismo thread en la misma ventana: no se vuelve a avisar
+    main.callback(channel, SimpleNamespace(delivery_tag=4, redelivered=False, routing_key="quiz_questions"),
+                  properties, envelope.encode(message))
+    main.get_idempotency_store.cache_clear()
+    main.get_usage.cache_clear()
+
+    # Directo a la DLX, con el error para poder filtrarlo al reprocesar
+    assert channel.nacked == []
+    assert channel.acked == [3, 4]
+    published = channel.published[0]
+    assert (published["exchange"], published["routing_key"]) == (main.DLX_EXCHANGE, "failed_questions")
+    assert published["properties"].headers[main.ERROR_HEADER].startswith("BudgetExceeded")
+    assert "x-retry-count" not in published["properties"].headers
+    assert notices == [(thread_id, main.BUDGET_EXCEEDED_REPLY)]
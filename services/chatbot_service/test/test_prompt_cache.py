@@ -0,0 +1,124 @@
+import time
+
+from app import main
+from app.llm_backends import FakeLLMBackend, count_tokens
+from app.prompt_cache import PromptCacheManager
+
+# Por encima del mínimo de tokens que Gemini acepta para un caché
+SYSTEM = "Instrucciones fijas del asistente. " * 130
+
+
+def make_manager(backend, **kwargs):
+    return PromptCacheManager(lambda: backend, ["gemini-2.5-flash"], SYSTEM, **kwargs)
+
+
+def test_refresh_creates_cache_and_only_user_message_is_sent():
+    backend = FakeLLMBackend(latency_ms=0)
+    manager = make_manager(backend)
+    manager.refresh()
+
+    name = manager.cached_content("gemini-2.5-flash")
+    assert name is not None
+    backend.generate_content(
+        "gemini-2.5-flash", "Mensaje del usuario:\n¿Qué es una API?",
+        config=main.types.GenerateContentConfig(cached_content=name),
+    )
+
+    stats = backend.stats()
+    assert stats["prompt_tokens"] == count_tokens("Mensaje del usuario:\n¿Qué es una API?")
+    assert stats["cached_tokens"] == count_tokens(SYSTEM)
+
+
+def test_existing_cache_is_adopted_and_stale_template_deleted():
+    backend = FakeLLMBackend(latency_ms=0)
+    PromptCacheManager(lambda: backend, ["gemini-2.5-flash"], "Template anterior " * 250).refresh()
+    manager = make_manager(backend)
+    # Caché creado por otra réplica con el template actual
+    backend.create_cache("gemini-2.5-flash", config=main.types.CreateCachedContentConfig(
+        system_instruction=SYSTEM, display_name=manager.display_name, ttl="600s",
+    ))
+
+    manager.refresh()
+
+    stats = manager.stats()
+    assert stats["adopted"] == 1 and stats["created"] == 0 and stats["deleted_stale"] == 1
+    assert [cache.display_name for cache in backend.list_caches()] == [manager.display_name]
+
+
+def test_cache_is_extended_before_expiry():
+    backend = FakeLLMBackend(latency_ms=0)
+    manager = make_manager(backend, ttl=600, refresh_margin=60)
+    manager.refresh()
+    manager.refresh()
+    assert manager.stats()["refreshed"] == 0
+
+    manager._entries["gemini-2.5-flash"].expires_at = time.monotonic() + 30
+    manager.refresh()
+
+    assert manager.stats()["refreshed"] == 1
+    assert manager.stats()["caches"]["gemini-2.5-flash"]["expires_in_s"] > 500
+
+
+def test_rejected_cache_falls_back_to_system_instruction():
+    backend = FakeLLMBackend(latency_ms=0)
+
+    def create(model, config=None):
+        raise ConnectionError("sin red")
+
+    backend.caches.create = create
+    manager = make_manager(backend, retry_interval=60)
+    manager.refresh()
+
+    assert manager.cached_content("gemini-2.5-flash") is None
+    assert manager.stats()["failures"] == 1
+    assert manager._next_check() > 30
+
+
+def test_too_small_instruction_disables_the_cache_for_the_template():
+    backend = FakeLLMBackend(latency_ms=0)
+    manager = PromptCacheManager(lambda: backend, ["gemini-2.5-flash"], "Instrucción corta", retry_interval=0)
+    manager.refresh()
+    manager.refresh()
+
+    assert manager.cached_content("gemini-2.5-flash") is None
+    stats = manager.stats()
+    # No se vuelve a intentar: el template no va a crecer sin reiniciar
+    assert stats["failures"] == 1 and stats["too_small"] == ["gemini-2.5-flash"]
+    assert manager._next_check() == 300.0
+
+
+def test_generate_content_retries_without_a_vanished_cache(monkeypatch):
+    backend = FakeLLMBackend(latency_ms=0)
+    manager = make_manager(backend)
+    manager.refresh()
+    monkeypatch.setattr(main, "get_genai_client", lambda: backend)
+    monkeypatch.setattr(main, "get_prompt_cache", lambda: manager)
+    monkeypatch.setattr(main, "SYSTEM_INSTRUCTION", SYSTEM)
+
+    for cache in backend.list_caches():
+        backend.delete_cache(cache.name)
+    response = main.generate_content("gemini-2.5-flash", main.build_prompt("¿Qué es Docker?"), timeout=5)
+
+    assert response.text
+    assert manager.cached_content("gemini-2.5-flash") is None
+    assert backend.stats()["errors"] == 0
+
+
+def test_stream_retries_without_a_rejected_cache(monkeypatch):
+    import asyncio
+
+    backend = FakeLLMBackend(latency_ms=0)
+    manager = make_manager(backend)
+    manager.refresh()
+    monkeypatch.setattr(main, "get_genai_client", lambda: backend)
+    monkeypatch.setattr(main, "get_prompt_cache", lambda: manager)
+    monkeypatch.setattr(main, "SYSTEM_INSTRUCTION", SYSTEM)
+    for cache in backend.list_caches():
+        backend.delete_cache(cache.name)
+
+    async def collect():
+        stream = main.generate_content_stream("gemini-2.5-flash", main.build_prompt("¿Qué es Docker?"), timeout=5)
+        return [chunk.text async for chunk in stream]
+
+    assert "".join(asyncio.run(collect()))
+    assert manager.cached_content("gemini-2.5-flash") is None
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from app.ratelimit import GeminiLimiter, LimiterTimeout
+
+
+class Overloaded(Exception):
+    code = 429
+
+
+def test_concurrency_limit_blocks_until_release():
+    limiter = GeminiLimiter(initial_concurrency=1)
+    permit = limiter.acquire()
+
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire(timeout=0.05)
+
+    permit.release()
+    limiter.acquire(timeout=0.05).release()
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_request_bucket_exhaustion_waits():
+    limiter = GeminiLimiter(requests_per_minute=2)
+    limiter.acquire().release()
+    limiter.acquire().release()
+
+    with pytest.raises(LimiterTimeout):
+        asyncio.run(limiter.acquire_async(timeout=0.05))
+
+
+def test_aimd_backs_off_on_429_and_grows_on_success():
+    limiter = GeminiLimiter(initial_concurrency=8, min_concurrency=1)
+
+    with pytest.raises(Overloaded):
+        with limiter.acquire():
+            raise Overloaded()
+    assert limiter.concurrency == 4
+
+    with limiter.acquire():
+        pass
+    assert limiter.concurrency == pytest.approx(4.25)
+    assert limiter.stats()["overloads"] == 1
+
+
+def test_actual_usage_is_charged_to_token_bucket():
+    class Usage:
+        total_token_count = 500
+
+    class Response:
+        usage_metadata = Usage()
+
+    limiter = GeminiLimiter(tokens_per_minute=1000)
+    with limiter.acquire(tokens=100) as permit:
+        permit.record_usage(Response())
+
+    assert limiter.tokens.available == pytest.approx(500, abs=1)
@@ -0,0 +1,231 @@
+import json
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pika
+import pytest
+from fastapi.testclient import TestClient
+
+from app import envelope, main
+from app.replay import ReplayFilter, ReplayJob, describe, replay_properties
+
+
+class FakeChannel:
+    def __init__(self, messages, depths=None, consumers=1):
+        self.messages = list(messages)
+        self.depths = list(depths or [0])
+        self.consumers = consumers
+        self.unacked = []
+        self.acked = []
+        self.requeued = []
+        self.published = []
+        self.is_open = True
+
+    def confirm_delivery(self):
+        pass
+
+    def queue_declare(self, queue, durable=False, passive=False):
+        if queue == "dlq":
+            count = len(self.messages)
+        else:
+            count = self.depths.pop(0) if len(self.depths) > 1 else self.depths[0]
+        return SimpleNamespace(method=SimpleNamespace(message_count=count, consumer_count=self.consumers))
+
+    def basic_get(self, queue, auto_ack=False):
+        if not self.messages:
+            return None, None, None
+        properties, body = self.messages.pop(0)
+        tag = len(self.acked) + len(self.unacked) + 1
+        self.unacked.append((tag, properties, body))
+        return SimpleNamespace(delivery_tag=tag), properties, body
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published.append((routing_key, body, properties))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+        self.unacked = [entry for entry in self.unacked if entry[0] != delivery_tag]
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.requeued.extend(body for _, _, body in self.unacked)
+        self.unacked = []
+
+
+class FakeConnection:
+    def __init__(self, channel):
+        self._channel = channel
+        self.is_open = True
+        self.slept = 0.0
+
+    def channel(self):
+        return self._channel
+
+    def sleep(self, seconds):
+        self.slept += seconds
+
+    def close(self):
+        self.is_open = False
+
+
+def question(question_id, thread_id=None, error=None, died_at=None):
+    message = envelope.QuestionMessage(question_id=question_id, question="hola", thread_id=thread_id,
+                                       user_id="u1" if thread_id else None)
+    headers = {**envelope.headers(), "x-retry-count": 3}
+    if error:
+        headers["x-last-error"] = error
+    if died_at is not None:
+        headers["x-death"] = [{"queue": "q", "reason": "rejected",
+                               "time": datetime.fromtimestamp(died_at, timezone.utc).replace(tzinfo=None)}]
+    properties = pika.BasicProperties(content_type=envelope.JSON, headers=headers)
+    return properties, envelope.encode(message)
+
+
+def run_job(channel, **options):
+    connection = FakeConnection(channel)
+    job = ReplayJob(lambda: connection, "dlq", "q", rate=10000, capacity_interval=0.01, **options)
+    job.run()
+    return job, connection
+
+
+def test_describe_reads_envelope_and_headers():
+    properties, body = question("q1", thread_id="t1", error="ClientError: 429", died_at=1000)
+    info = describe(properties, body)
+    assert (info.question_id, info.thread_id, info.format) == ("q1", "t1", "thread")
+    assert info.error == "ClientError: 429"
+    assert info.retry_count == 3
+    assert info.dead_lettered_at == 1000
+
+    legacy = describe(pika.BasicProperties(), json.dumps({"question_id": "q2", "question": "x",
+                                                          "response": "y"}).encode(), responses=True)
+    assert (legacy.question_id, legacy.format) == ("q2", "response")
+
+
+def test_filters_by_thread_error_and_age():
+    now = time.time()
+    info = describe(*question("q1", thread_id="t1", error="ClientError: 429", died_at=now - 120))
+    assert ReplayFilter(thread_id="t1", error="429", older_than=60, newer_than=600).matches(info, now)
+    assert not ReplayFilter(thread_id="t2").matches(info, now)
+    assert not ReplayFilter(error="timeout").matches(info, now)
+    assert not ReplayFilter(older_than=300).matches(info, now)
+    assert not ReplayFilter(format="quiz").matches(info, now)
+
+
+def test_replay_properties_reset_retries_and_history():
+    properties, _ = question("q1", died_at=1000)
+    replayed = replay_properties(properties)
+    assert replayed.headers["x-retry-count"] == 0
+    assert replayed.headers["x-replay-count"] == 1
+    assert "x-death" not in replayed.headers
+    assert replayed.headers[envelope.VERSION_HEADER] == envelope.ENVELOPE_VERSION
+    # El original no se modifica
+    assert properties.headers["x-retry-count"] == 3
+    assert replay_properties(properties, reset_retries=False).headers["x-retry-count"] == 3
+
+
+def test_replays_matching_messages_and_returns_the_rest_in_order():
+    messages = [question("q1", thread_id="t1"), question("q2"), question("q3", thread_id="t1"), question("q4")]
+    channel = FakeChannel(messages)
+
+    job, _ = run_job(channel, filters=ReplayFilter(thread_id="t1"))
+
+    assert job.state == "done"
+    assert [envelope.decode(body, envelope.JSON, {envelope.VERSION_HEADER: 2}).question_id
+            for _, body, _ in channel.published] == ["q1", "q3"]
+    assert channel.requeued == [messages[1][1], messages[3][1]]
+    assert job.progress()["replayed"] == 2 and job.progress()["skipped"] == 2
+
+
+def test_dry_run_publishes_nothing_and_reports_a_sample():
+    messages = [question("q1"), question("q2")]
+    channel = FakeChannel(messages)
+
+    job, _ = run_job(channel, dry_run=True)
+
+    assert channel.published == []
+    assert channel.requeued == [body for _, body in messages]
+    assert [info["question_id"] for info in job.progress()["sample"]] == ["q1", "q2"]
+
+
+def test_limit_stops_after_n_matches():
+    channel = FakeChannel([question(f"q{i}") for i in range(5)])
+    job, _ = run_job(channel, limit=2)
+    assert job.replayed == 2
+    assert len(channel.requeued) == 0
+    assert len(channel.messages) == 3
+
+
+def test_waits_while_target_backlog_is_full():
+    channel = FakeChannel([question("q1")], depths=[80, 60, 10])
+
+    job, connection = run_job(channel, max_backlog=50)
+
+    assert job.replayed == 1
+    assert connection.slept > 0
+    assert job.waited_s > 0
+
+
+def test_failure_returns_unpublished_messages():
+    channel = FakeChannel([question("q1")])
+
+    def fail(*args, **kwargs):
+        raise pika.exceptions.UnroutableError([])
+
+    channel.basic_publish = fail
+    job, _ = run_job(channel)
+
+    assert job.state == "failed"
+    assert len(channel.requeued) == 1
+
+
+def test_target_without_consumers_is_optional():
+    channel = FakeChannel([question("q1")], consumers=0)
+
+    job, _ = run_job(channel, require_consumer=False)
+
+    assert job.replayed == 1
+
+
+def test_held_messages_move_to_the_dlq_tail_in_order():
+    messages = [question("q1"), question("q2"), question("q3", thread_id="t1"), question("q4")]
+    channel = FakeChannel(messages)
+
+    job, _ = run_job(channel, filters=ReplayFilter(thread_id="t1"), hold_limit=2)
+
+    assert [routing_key for routing_key, _, _ in channel.published] == ["dlq", "dlq", "q", "dlq"]
+    assert [body for routing_key, body, _ in channel.published if routing_key == "dlq"] == [
+        messages[0][1], messages[1][1], messages[3][1],
+    ]
+    assert channel.requeued == [] and channel.unacked == []
+    assert job.progress()["moved_to_tail"] == 3
+
+
+def test_bulk_questions_without_thread_return_to_the_bulk_lane():
+    quiz = question("q1")
+    quiz[0].headers[envelope.LANE_HEADER] = envelope.BULK
+    batch_for_thread = question("q2", thread_id="t1")
+    batch_for_thread[0].headers[envelope.LANE_HEADER] = envelope.BULK
+    channel = FakeChannel([quiz, batch_for_thread, question("q3")])
+
+    run_job(channel, bulk_target="q.bulk")
+
+    assert [routing_key for routing_key, _, _ in channel.published] == ["q.bulk", "q", "q"]
+
+
+@pytest.mark.parametrize("options", [{"rate": 0}, {"rate": -1}, {"max_backlog": 0}, {"limit": 0}])
+def test_unbounded_replays_are_rejected(options):
+    with pytest.raises(ValueError):
+        ReplayJob(lambda: None, "dlq", "q", **{"rate": 5, **options})
+
+
+def test_admin_endpoints_need_a_token(monkeypatch):
+    client = TestClient(main.app)
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/admin/dlq/replay").status_code == 403
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secreto")
+    assert client.get("/admin/dlq/replay").status_code == 401
+    assert client.get("/admin/dlq/replay", headers={"X-Admin-Token": "secreto"}).status_code == 200
+    response = client.post("/admin/dlq/replay", json={"rate": 0}, headers={"X-Admin-Token": "secreto"})
+    assert response.status_code == 422
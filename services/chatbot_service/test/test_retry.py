@@ -0,0 +1,48 @@
+import httpx
+from google.genai import errors
+
+from app.retry import choose_retry_delay, retry_after_hint, retry_queue_name
+
+
+def test_tier_grows_with_retry_count_and_jitter_spreads_across_tiers():
+    delays = [5.0, 30.0, 120.0]
+
+    for retry_count in range(len(delays)):
+        tiers = set()
+        for _ in range(50):
+            tier, delay = choose_retry_delay(retry_count, delays)
+            assert delay == delays[tier - 1]
+            tiers.add(tier)
+        # El nivel que corresponde o el siguiente (sin pasar del último)
+        assert tiers == {retry_count + 1, min(retry_count + 2, len(delays))}
+
+    assert choose_retry_delay(7, delays)[0] == 3
+    assert retry_queue_name("quiz_questions", 2) == "quiz_questions.retry.2"
+
+
+def test_retry_after_moves_to_a_longer_tier():
+    for _ in range(20):
+        tier, delay = choose_retry_delay(0, [5.0, 30.0, 120.0], retry_after=20)
+
+        assert tier in (2, 3)
+        assert delay >= 20
+
+
+def test_retry_hint_from_gemini_retry_info():
+    error = errors.ClientError(429, {
+        "error": {
+            "code": 429,
+            "status": "RESOURCE_EXHAUSTED",
+            "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "23s"}],
+        }
+    })
+
+    assert retry_after_hint(error) == 23.0
+
+
+def test_retry_hint_from_header():
+    response = httpx.Response(503, headers={"Retry-After": "7"})
+    error = errors.ServerError(503, {"error": {"code": 503}}, response)
+
+    assert retry_after_hint(error) == 7.0
+    assert retry_after_hint(ValueError("vacío")) is None
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.router import ModelDeadlineExceeded, ModelRoute, ModelRouter, parse_models
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+def warm_up(router, model, latency=0.01, samples=20):
+    for _ in range(samples):
+        router._latency[model].add(latency)
+
+
+def test_parse_models_with_optional_deadlines():
+    routes = parse_models("gemini-2.5-flash:20, gemini-2.5-flash-lite", default_deadline=60)
+
+    assert routes == [ModelRoute("gemini-2.5-flash", 20.0), ModelRoute("gemini-2.5-flash-lite", 60.0)]
+    with pytest.raises(ValueError):
+        parse_models(" , ", default_deadline=60)
+
+
+def test_failing_model_falls_back_immediately():
+    router = ModelRouter([ModelRoute("a", 5), ModelRoute("b", 5)])
+    calls = []
+
+    def attempt(model, timeout, hedge):
+        calls.append(model)
+        if model == "a":
+            raise Unavailable("a caído")
+        return f"respuesta de {model}"
+
+    assert router.generate(attempt) == "respuesta de b"
+    assert calls == ["a", "b"]
+    assert router.stats()["fallbacks"] == 1
+
+
+def test_all_models_failing_raises_last_error():
+    router = ModelRouter([ModelRoute("a", 5), ModelRoute("b", 5)])
+
+    def attempt(model, timeout, hedge):
+        raise Unavailable(model)
+
+    with pytest.raises(Unavailable, match="b"):
+        router.generate(attempt)
+
+
+def test_deadline_moves_to_next_model():
+    router = ModelRouter([ModelRoute("a", 0.05), ModelRoute("b", 5)], hedge_percentile=0)
+    release = threading.Event()
+
+    def attempt(model, timeout, hedge):
+        if model == "a":
+            release.wait(2)
+        return model
+
+    started = time.monotonic()
+    assert router.generate(attempt) == "b"
+    assert time.monotonic() - started < 1
+    assert router.stats()["deadlines_exceeded"] == 1
+    release.set()
+
+
+def test_every_model_past_its_deadline_raises_deadline_exceeded():
+    router = ModelRouter([ModelRoute("a", 0.05), ModelRoute("b", 0.05)], hedge_percentile=0)
+    release = threading.Event()
+
+    def attempt(model, timeout, hedge):
+        release.wait(2)
+        return model
+
+    started = time.monotonic()
+    with pytest.raises(ModelDeadlineExceeded, match="b"):
+        router.generate(attempt)
+    assert time.monotonic() - started < 1
+    assert router.stats()["deadlines_exceeded"] == 2
+    release.set()
+
+
+def test_slow_primary_is_hedged_and_hedge_wins():
+    router = ModelRouter([ModelRoute("a", 5), ModelRoute("b", 5)], hedge_min_delay=0.02, hedge_max_ratio=1)
+    warm_up(router, "a")
+    release = threading.Event()
+
+    def attempt(model, timeout, hedge):
+        if model == "a":
+            release.wait(2)
+        return (model, hedge)
+
+    started = time.monotonic()
+    assert router.generate(attempt) == ("b", True)
+    assert time.monotonic() - started < 1
+    stats = router.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    release.set()
+
+
+def test_hedge_budget_limits_extra_requests():
+    router = ModelRouter([ModelRoute("a", 5)], hedge_min_delay=0.01, hedge_max_ratio=0)
+    warm_up(router, "a")
+
+    def attempt(model, timeout, hedge):
+        time.sleep(0.05)
+        return hedge
+
+    assert router.generate(attempt) is False
+    assert router.stats()["hedges"] == 0
+
+
+def test_async_hedge_cancels_the_loser():
+    router = ModelRouter([ModelRoute("a", 5)], hedge_min_delay=0.02, hedge_max_ratio=1)
+    warm_up(router, "a")
+    cancelled = []
+
+    async def attempt(model, timeout, hedge):
+        try:
+            await asyncio.sleep(0.01 if hedge else 2)
+        except asyncio.CancelledError:
+            cancelled.append(hedge)
+            raise
+        return hedge
+
+    async def run():
+        result = await router.generate_async(attempt)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) is True
+    assert cancelled == [False]
+
+
+def test_abandoned_attempt_keeps_its_permit_and_fallback_is_cached_under_its_model(monkeypatch):
+    from types import SimpleNamespace
+
+    from app import main
+    from app.ratelimit import GeminiLimiter
+
+    question = "¿Qué es una API? (fallback)"
+    limiter = GeminiLimiter()
+    released = threading.Event()
+
+    def generate_content(model, contents, timeout, json_output=False, profile=None):
+        if model == "lento":
+            released.wait(2)
+        return SimpleNamespace(text=f"respuesta de {model}")
+
+    router = ModelRouter([ModelRoute("lento", 0.05), ModelRoute("rapido", 5)], hedge_percentile=0)
+    monkeypatch.setattr(main, "generate_content", generate_content)
+    monkeypatch.setattr(main, "get_limiter", lambda: limiter)
+    monkeypatch.setattr(main, "get_router", lambda: router)
+    monkeypatch.setattr(main, "GENERATION_PROFILES_ENABLED", False)
+    main.get_response_cache.cache_clear()
+
+    assert main._generate_reply(question) == "respuesta de rapido"
+    # El primario abandonado por deadline sigue en curso y conserva su cupo; el del fallback ya se liberó
+    assert limiter.in_flight == 1
+    released.set()
+    deadline = time.monotonic() + 2
+    while limiter.in_flight and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert limiter.in_flight == 0
+
+    cache = main.get_response_cache()
+    assert cache.get(main.reply_cache_key(question, "rapido")) == "respuesta de rapido"
+    assert cache.get(main.reply_cache_key(question)) is None
+    main.get_response_cache.cache_clear()
+    router.close()
@@ -23,3 +23,107 @@ def test_chat_missing_required_field_returns_422():
     resp = client.post("/chat", json=payload)
 
     assert resp.status_code == 422
+
+
+def test_chat_returns_503_when_saturated(monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main, "_chat_semaphore", main.asyncio.Semaphore(0))
+    monkeypatch.setattr(main, "CHAT_QUEUE_TIMEOUT", 0.01)
+
+    resp = client.post("/chat", json={"message": "¿Qué es una API?"})
+
+    assert resp.status_code == 503
+
+
+def test_chat_stream_reports_saturation_without_holding_a_slot(monkeypatch):
+    from app import main
+
+    semaphore = main.asyncio.Semaphore(0)
+    monkeypatch.setattr(main, "_chat_semaphore", semaphore)
+    monkeypatch.setattr(main, "CHAT_QUEUE_TIMEOUT", 0.01)
+
+    resp = client.post("/chat/stream", json={"message": "Pregunta sin caché sobre saturación"})
+
+    assert resp.status_code == 200
+    assert resp.text.startswith("event: error\n")
+    # No libera un cupo que nunca tomó
+    assert semaphore._value == 0
+
+
+def test_chat_uses_async_gemini_path(monkeypatch):
+    from app import main
+
+    async def fake_process(question):
+        return "respuesta"
+
+    monkeypatch.setattr(main, "process_question_with_gemini_async", fake_process)
+
+    resp = client.post("/chat", json={"message": "¿Qué es una API?"})
+
+    assert resp.status_code == 200
+    assert resp.json() == {"reply": "respuesta"}
+
+
+def test_chat_stream_forwards_chunks(monkeypatch):
+    from types import SimpleNamespace
+
+    from app import main
+
+    async def fake_stream(model, contents, config=None):
+        async def chunks():
+            for text in ["Un bucle ", "for", ""]:
+                yield SimpleNamespace(text=text)
+
+        return chunks()
+
+    fake_client = SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content_stream=fake_stream)))
+    monkeypatch.setattr(main, "get_genai_client", lambda: fake_client)
+
+    resp = client.post("/chat/stream", json={"message": "¿Cómo hago un bucle for en Rust?"})
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = [block for block in resp.text.split("\n\n") if block]
+    assert events[0] == 'event: chunk\ndata: {"text": "Un bucle "}'
+    assert events[-1] == 'event: done\ndata: {"reply": "Un bucle for", "cached": false}'
+
+
+def test_metrics_endpoint_exposes_pipeline_histograms():
+    resp = client.get("/metrics")
+
+    assert resp.status_code == 200
+    assert "chatbot_pipeline_stage_seconds_bucket" in resp.text
+    assert 'chatbot_chat_request_seconds_count{endpoint="/chat"}' in resp.text
+    assert "chatbot_response_cache_hits" in resp.text
+
+
+def test_chat_stream_observes_latency_on_cache_hits_and_counts_empty_replies(monkeypatch):
+    from types import SimpleNamespace
+
+    from app import main, metrics
+
+    async def fake_stream(model, contents, config=None):
+        async def chunks():
+            yield SimpleNamespace(text="  ")
+
+        return chunks()
+
+    def observed():
+        return metrics.CHAT_STREAM_LATENCY._sum.get(), metrics.EMPTY_REPLIES_TOTAL._value.get()
+
+    fake_client = SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content_stream=fake_stream)))
+    monkeypatch.setattr(main, "get_genai_client", lambda: fake_client)
+    _, empty_before = observed()
+
+    resp = client.post("/chat/stream", json={"message": "Pregunta que el modelo deja vacía"})
+    assert "event: error" in resp.text
+    latency_before, empty_after = observed()
+    assert empty_after == empty_before + 1
+
+    main.get_response_cache().set(
+        main.reply_cache_key("Pregunta en caché"), "respuesta"
+    )
+    resp = client.post("/chat/stream", json={"message": "Pregunta en caché"})
+    assert '"cached": true' in resp.text
+    assert observed()[0] > latency_before
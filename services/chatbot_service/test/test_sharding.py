@@ -0,0 +1,205 @@
+import json
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from app.sharding import Membership, ShardCoordinator, assign_shards, shard_for, shard_queue_name
+
+
+class FakeChannel:
+    def __init__(self, refuse_exclusive=False):
+        self.refuse_exclusive = refuse_exclusive
+        self.consumers = {}
+        self.cancelled = []
+        self.nacked = []
+        self.acked = []
+        self.published = []
+        self.declared = []
+        self._tags = 0
+
+    def exchange_declare(self, exchange, exchange_type, durable=False):
+        self.declared.append(exchange)
+
+    def queue_declare(self, queue, durable=False, exclusive=False, auto_delete=False, arguments=None):
+        self.declared.append(queue)
+        return SimpleNamespace(method=SimpleNamespace(queue=queue or "amq.gen-members"))
+
+    def queue_bind(self, queue, exchange, routing_key=None):
+        pass
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_qos(self, prefetch_count=0):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False, exclusive=False):
+        if exclusive and self.refuse_exclusive:
+            raise pika.exceptions.ChannelClosedByBroker(403, "ACCESS_REFUSED")
+        self._tags += 1
+        tag = f"ctag-{self._tags}"
+        self.consumers[tag] = (queue, on_message_callback)
+        return tag
+
+    def basic_cancel(self, consumer_tag):
+        self.cancelled.append(self.consumers.pop(consumer_tag)[0])
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append((exchange, routing_key, body))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.nacked.append(delivery_tag)
+
+    def deliver(self, queue, delivery_tag, body=b"{}"):
+        for consumer_queue, handler in list(self.consumers.values()):
+            if consumer_queue == queue:
+                handler(self, SimpleNamespace(delivery_tag=delivery_tag), None, body)
+                return
+        raise AssertionError(f"Nadie consume {queue}")
+
+
+class FakeConnection:
+    def __init__(self, channel, router_channel=None):
+        self._channel = channel
+        self._router_channel = router_channel or FakeChannel()
+        self.timers = []
+
+    def channel(self):
+        return self._router_channel
+
+    def call_later(self, delay, callback):
+        self.timers.append(callback)
+
+    def run_timers(self):
+        timers, self.timers = self.timers, []
+        for callback in timers:
+            callback()
+
+
+def make_coordinator(replica_id="a", shards=4, router_channel=None):
+    channel = FakeChannel()
+    connection = FakeConnection(channel, router_channel)
+    handled = []
+    coordinator = ShardCoordinator(
+        connection, channel,
+        handler=lambda ch, method, properties, body: handled.append(method.delivery_tag),
+        ordering_key=lambda body, properties: json.loads(body).get("thread_id"),
+        replica_id=replica_id,
+        queue="q",
+        shards=shards,
+    )
+    coordinator.start()
+    return coordinator, channel, connection, handled
+
+
+def heartbeat(coordinator, replica_id):
+    coordinator._on_heartbeat(None, None, None, json.dumps({"replica": replica_id}).encode())
+
+
+def test_shard_for_is_stable_and_in_range():
+    assert shard_for("thread-1", 8) == shard_for(b"thread-1", 8)
+    assert all(0 <= shard_for(f"t{i}", 8) < 8 for i in range(100))
+    assert len({shard_for(f"t{i}", 8) for i in range(100)}) == 8
+
+
+def test_assign_shards_partitions_and_moves_only_to_new_member():
+    before = {member: assign_shards(member, {"a", "b"}, 64) for member in ("a", "b")}
+    after = {member: assign_shards(member, {"a", "b", "c"}, 64) for member in ("a", "b", "c")}
+
+    assert before["a"] | before["b"] == set(range(64))
+    assert not before["a"] & before["b"]
+    assert set().union(*after.values()) == set(range(64))
+    # Los shards que cambian de dueño solo van a la réplica nueva
+    assert after["a"] <= before["a"] and after["b"] <= before["b"]
+
+
+def test_membership_expires_silent_replicas():
+    membership = Membership(timeout=15)
+    assert membership.heartbeat("a", now=0)
+    assert not membership.heartbeat("a", now=10)
+    membership.heartbeat("b", now=0)
+
+    assert membership.expire(now=20) == ["b"]
+    assert membership.live() == {"a"}
+
+
+def test_claims_every_shard_after_first_interval_when_alone():
+    coordinator, channel, connection, _ = make_coordinator()
+    assert coordinator.owned == set()
+
+    connection.run_timers()
+
+    assert coordinator.owned == {0, 1, 2, 3}
+    assert {queue for queue, _ in channel.consumers.values()} >= {shard_queue_name("q", s) for s in range(4)}
+
+
+def test_new_replica_takes_shards_after_in_flight_messages_finish():
+    coordinator, channel, connection, handled = make_coordinator()
+    connection.run_timers()
+    lost = sorted(set(range(4)) - assign_shards("a", {"a", "b"}, 4))
+    shard = lost[0]
+    queue = shard_queue_name("q", shard)
+    channel.deliver(queue, delivery_tag=1)
+    assert handled == [1]
+
+    heartbeat(coordinator, "b")
+
+    # El shard sigue tomado hasta que termine el mensaje en proceso
+    assert queue not in channel.cancelled
+    channel.deliver(queue, delivery_tag=2)
+    assert handled == [1]
+
+    coordinator.done(SimpleNamespace(delivery_tag=1))
+
+    assert queue in channel.cancelled
+    assert channel.nacked == [2]
+    assert coordinator.stats()["handoffs"] >= 1
+
+
+def test_regaining_a_draining_shard_dispatches_held_messages():
+    coordinator, channel, connection, handled = make_coordinator()
+    connection.run_timers()
+    shard = sorted(set(range(4)) - assign_shards("a", {"a", "b"}, 4))[0]
+    queue = shard_queue_name("q", shard)
+    channel.deliver(queue, delivery_tag=1)
+    heartbeat(coordinator, "b")
+    channel.deliver(queue, delivery_tag=2)
+
+    coordinator.membership.expire(float("inf"))
+    coordinator.rebalance()
+
+    assert handled == [1, 2]
+    assert queue not in channel.cancelled
+
+
+def test_router_publishes_by_thread_and_standby_when_refused():
+    router_channel = FakeChannel()
+    coordinator, _, _, _ = make_coordinator(router_channel=router_channel)
+    body = json.dumps({"thread_id": "t1"}).encode()
+
+    router_channel.deliver("q", delivery_tag=7, body=body)
+
+    assert router_channel.published == [("q.shards", str(shard_for("t1", 4)), body)]
+    assert router_channel.acked == [7]
+    assert coordinator.stats()["router"] is True
+
+    standby, _, _, _ = make_coordinator(router_channel=FakeChannel(refuse_exclusive=True))
+    assert standby.stats()["router"] is False
+
+
+@pytest.mark.parametrize("replicas", [2, 3])
+def test_replicas_agree_on_a_disjoint_assignment(replicas):
+    members = [f"pod-{i}" for i in range(replicas)]
+    coordinators = [make_coordinator(replica_id=member, shards=8) for member in members]
+    for coordinator, _, connection, _ in coordinators:
+        for member in members:
+            heartbeat(coordinator, member)
+        connection.run_timers()
+
+    owned = [coordinator.owned for coordinator, _, _, _ in coordinators]
+    assert set().union(*owned) == set(range(8))
+    assert sum(len(shards) for shards in owned) == 8
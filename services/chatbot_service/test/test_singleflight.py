@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.05)
+        return "respuesta"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ["respuesta"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 4
+
+
+def test_failure_reaches_waiters_and_does_not_poison_key():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Gemini caído")
+
+    async def ok():
+        return "respuesta"
+
+    async def scenario():
+        results = await asyncio.gather(
+            flight.do_async("k", failing), flight.do_async("k", failing), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        return await flight.do_async("k", ok)
+
+    assert asyncio.run(scenario()) == "respuesta"
+    assert flight.stats() == {"in_flight": 0, "upstream_calls": 2, "coalesced": 1, "failures": 1}
+
+
+def test_sync_error_is_raised():
+    flight = SingleFlight()
+
+    def boom():
+        raise ValueError("vacío")
+
+    with pytest.raises(ValueError):
+        flight.do("k", boom)
+
+
+def test_cancelled_leader_hands_the_call_to_a_waiter():
+    flight = SingleFlight()
+    started = threading.Event()
+    calls = []
+    results = []
+
+    async def slow():
+        started.set()
+        await asyncio.sleep(10)
+
+    def fetch():
+        calls.append(1)
+        return "respuesta"
+
+    def follower():
+        started.wait()
+        results.append(flight.do("k", fetch))
+
+    async def leader():
+        task = asyncio.create_task(flight.do_async("k", slow))
+        while flight.stats()["coalesced"] == 0:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    asyncio.run(leader())
+    thread.join(timeout=2)
+
+    # El hilo no recibe la cancelación: vuelve a intentar como líder
+    assert results == ["respuesta"] and calls == [1]
+    assert flight.stats()["in_flight"] == 0
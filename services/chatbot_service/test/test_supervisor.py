@@ -0,0 +1,179 @@
+import queue
+import threading
+import time
+
+import pika
+from fastapi.testclient import TestClient
+
+from app import main
+from app.supervisor import ConsumerSupervisor
+
+
+class FakeConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.callbacks = queue.Queue()
+        self.is_open = True
+        self.processed = 0
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+    def process_data_events(self, time_limit=0):
+        try:
+            self.callbacks.get(timeout=time_limit or 0.001)()
+        except queue.Empty:
+            pass
+        self.processed += 1
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.consuming = False
+
+    def start_consuming(self):
+        if self.connection.fail:
+            raise pika.exceptions.StreamLostError("Transport indicated EOF")
+        self.consuming = True
+        while self.consuming:
+            self.connection.process_data_events(0.01)
+
+    def stop_consuming(self):
+        self.consuming = False
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.005)
+
+
+def test_reconnects_with_backoff_in_a_loop():
+    # Se cae una conexión establecida, luego el broker no acepta conexiones dos veces
+    lost, healthy = FakeConnection(fail=True), FakeConnection()
+    attempts = [lost, None, None, healthy]
+
+    def connect():
+        connection = attempts.pop(0)
+        if connection is None:
+            raise pika.exceptions.AMQPConnectionError("connection refused")
+        return connection
+
+    supervisor = ConsumerSupervisor(connect, FakeChannel, backoff_base=0.001, backoff_max=0.01)
+    supervisor.start()
+    wait_for(lambda: supervisor.connections == 2 and supervisor.consuming)
+
+    assert supervisor.failures == 3
+    assert "AMQPConnectionError" in supervisor.last_error
+    # La conexión caída se cierra antes de reintentar
+    assert not lost.is_open
+    assert supervisor.stop(1)
+    assert supervisor.state == "stopped" and not healthy.is_open
+
+
+def test_backoff_is_capped_and_jittered():
+    supervisor = ConsumerSupervisor(None, None, backoff_base=1, backoff_max=5)
+    delays = [supervisor.backoff(10) for _ in range(100)]
+    assert max(delays) <= 5
+    assert len(set(delays)) > 1
+
+
+def test_stop_waits_for_in_flight_work_before_closing():
+    connection = FakeConnection()
+    in_flight = threading.Event()
+    in_flight.set()
+    stopped_fetching = []
+
+    def finish_later():
+        # Un worker termina y agenda su ack en el hilo de la conexión
+        time.sleep(0.05)
+        connection.add_callback_threadsafe(in_flight.clear)
+
+    supervisor = ConsumerSupervisor(lambda: connection, FakeChannel, idle=lambda: not in_flight.is_set(),
+                                     on_stop=lambda: stopped_fetching.append(True))
+    supervisor.start()
+    wait_for(lambda: supervisor.consuming)
+    threading.Thread(target=finish_later).start()
+
+    assert supervisor.stop(2)
+    assert stopped_fetching == [True]
+    assert not in_flight.is_set()
+    assert not connection.is_open
+
+
+def test_stop_gives_up_at_the_deadline():
+    connection = FakeConnection()
+    supervisor = ConsumerSupervisor(lambda: connection, FakeChannel, idle=lambda: False)
+    supervisor.start()
+    wait_for(lambda: supervisor.consuming)
+
+    started = time.monotonic()
+    assert supervisor.stop(0.2)
+    assert time.monotonic() - started < 1
+    assert not connection.is_open
+
+
+def test_draining_consumer_requeues_new_messages(monkeypatch):
+    class Channel:
+        nacked = []
+
+        def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+            self.nacked.append((delivery_tag, requeue))
+
+    monkeypatch.setattr(main, "_draining", threading.Event())
+    main._draining.set()
+    main.callback(Channel(), type("Method", (), {"delivery_tag": 7})(), None, b"{}")
+    assert Channel.nacked == [(7, True)]
+
+
+def test_stop_fetching_cancels_the_bulk_lane(monkeypatch):
+    class BulkChannel:
+        is_open = True
+        cancelled = []
+
+        def basic_cancel(self, consumer_tag):
+            self.cancelled.append(consumer_tag)
+
+    channel = BulkChannel()
+    monkeypatch.setattr(main, "_draining", threading.Event())
+    monkeypatch.setattr(main, "_shards", None)
+    monkeypatch.setattr(main, "_bulk_consumer", (channel, "ctag-bulk"))
+
+    main.stop_fetching()
+
+    assert main._draining.is_set()
+    assert channel.cancelled == ["ctag-bulk"]
+    assert main._bulk_consumer is None
+
+
+def test_ready_and_live_probes(monkeypatch):
+    client = TestClient(main.app)
+    supervisor = ConsumerSupervisor(None, None)
+    monkeypatch.setattr(main, "get_supervisor", lambda: supervisor)
+    monkeypatch.setattr(main, "_model_ready", threading.Event())
+    monkeypatch.setattr(main, "_draining", threading.Event())
+
+    resp = client.get("/ready")
+    assert resp.status_code == 503
+    assert resp.json()["detail"]["broker"] is False
+
+    supervisor.state = "consuming"
+    main._model_ready.set()
+    assert client.get("/ready").status_code == 200
+
+    main._draining.set()
+    assert client.get("/ready").status_code == 503
+
+    # Detenido cuenta como vivo; si el hilo murió sin que se pidiera, no
+    supervisor.state = "stopped"
+    assert client.get("/live").status_code == 200
+    supervisor.state = "consuming"
+    supervisor._thread = threading.Thread(target=lambda: None)
+    supervisor._thread.start()
+    supervisor._thread.join()
+    assert client.get("/live").status_code == 503
@@ -0,0 +1,127 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import pika
+import pytest
+
+from app import envelope, main, tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def submit(self, span):
+        self.spans.append(span)
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"exported": len(self.spans)}
+
+
+class FakeChannel:
+    def __init__(self):
+        self.acked = []
+        self.published = []
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.acked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self.published.append(properties)
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = ListExporter()
+    monkeypatch.setattr(main, "get_tracer", lambda: tracing.Tracer("chatbot_service", 0.0, exporter))
+    monkeypatch.setattr(main, "RETRY_DELAY_ENABLED", False)
+    main.get_idempotency_store.cache_clear()
+    yield exporter
+    main.get_idempotency_store.cache_clear()
+
+
+def test_quiz_service_copy_is_identical():
+    here = Path(__file__).resolve().parents[1] / "app" / "tracing.py"
+    quiz = Path(__file__).resolve().parents[2] / "quiz_service" / "app" / "tracing.py"
+    assert quiz.read_bytes() == here.read_bytes()
+
+
+def test_traceparent_round_trip_and_invalid_values():
+    context = tracing.parse_traceparent(PARENT)
+    assert (context.trace_id, context.span_id, context.sampled) == (TRACE_ID, "00f067aa0ba902b7", True)
+    assert context.traceparent() == PARENT
+    assert tracing.parse_traceparent(PARENT.encode()).trace_id == TRACE_ID
+
+    for value in (None, "", "basura", PARENT.replace(TRACE_ID, "0" * 32), "ff" + PARENT[2:], PARENT[:-1] + "x"):
+        assert tracing.parse_traceparent(value) is None
+
+
+def test_head_sampling_is_decided_once_per_trace():
+    exporter = ListExporter()
+    tracer = tracing.Tracer("svc", 0.0, exporter)
+
+    # Sin padre y con tasa 0 no se registra, pero el contexto se propaga
+    root = tracer.start_span("raiz")
+    assert not root.recording and root.traceparent().endswith("-00")
+    headers = tracer.inject({}, root)
+    assert tracing.extract(headers).trace_id == root.context.trace_id
+    assert tracer.child_span("hijo") is tracing.NOOP_SPAN
+
+    # Un padre muestreado manda, aunque la tasa local sea 0
+    span = tracer.start_span("consumo", parent=tracing.parse_traceparent(PARENT))
+    with span:
+        with tracer.child_span("hijo", kind="CLIENT", model="m") as child:
+            child.set("cache_hit", False)
+    assert [s["name"] for s in exporter.spans] == ["hijo", "consumo"]
+    assert exporter.spans[0]["parentId"] == exporter.spans[1]["id"]
+    assert exporter.spans[1]["parentId"] == "00f067aa0ba902b7"
+    assert exporter.spans[0]["tags"] == {"model": "m", "cache_hit": "False"}
+
+
+def test_retry_keeps_the_trace_and_records_queue_wait(exporter, monkeypatch):
+    def answer_question(question, batchable=False):
+        raise RuntimeError("modelo caído")
+
+    monkeypatch.setattr(main, "answer_question", answer_question)
+    channel = FakeChannel()
+    message = envelope.QuestionMessage(question_id="q1", question="hola", timestamp=1.0)
+    headers = {**envelope.headers(), tracing.TRACEPARENT_HEADER: PARENT, tracing.PUBLISHED_AT_HEADER: 1.0}
+    properties = pika.BasicProperties(content_type=envelope.JSON, headers=headers, message_id="q1")
+    method = SimpleNamespace(delivery_tag=1, redelivered=False, routing_key="quiz_questions")
+
+    main.callback(channel, method, properties, envelope.encode(message))
+
+    names = {span["name"]: span for span in exporter.spans}
+    process, wait = names["chatbot.process"], names["rabbitmq.queue_wait"]
+    assert process["traceId"] == wait["traceId"] == TRACE_ID
+    assert process["parentId"] == "00f067aa0ba902b7" and wait["parentId"] == process["id"]
+    assert process["tags"]["outcome"] == "retried" and "modelo caído" in process["tags"]["error"]
+
+    # El reintento es hijo del procesamiento y conserva los identificadores
+    retried = channel.published[0]
+    assert tracing.extract(retried.headers).trace_id == TRACE_ID
+    assert tracing.extract(retried.headers).span_id == process["id"]
+    assert retried.headers[tracing.PUBLISHED_AT_HEADER] > 1.0
+    assert retried.message_id == "q1"
+
+
+def test_file_sink_writes_zipkin_json_lines(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    span_exporter = tracing.SpanExporter(tracing.file_sink(str(path)), interval=0.01)
+    tracer = tracing.Tracer("svc", 1.0, span_exporter)
+
+    tracer.start_span("uno", kind="PRODUCER").finish()
+    tracer.close()
+
+    [line] = path.read_text().splitlines()
+    span = json.loads(line)
+    assert span["name"] == "uno" and span["kind"] == "PRODUCER"
+    assert span["localEndpoint"] == {"serviceName": "svc"}
+    assert tracer.stats()["exported"] == 1
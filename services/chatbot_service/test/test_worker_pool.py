@@ -0,0 +1,120 @@
+import threading
+import time
+
+from app.worker_pool import ConsumerWorkerPool, Lane, ThreadSafeChannel
+
+
+def test_same_key_runs_in_order():
+    pool = ConsumerWorkerPool(4)
+    seen = []
+
+    def task(i):
+        time.sleep(0.01 if i % 2 == 0 else 0)
+        seen.append(i)
+
+    for i in range(10):
+        pool.submit("thread-1", task, i)
+
+    assert pool.wait_idle(timeout=5)
+    assert seen == list(range(10))
+    pool.shutdown()
+
+
+def test_different_keys_run_concurrently():
+    pool = ConsumerWorkerPool(4)
+    barrier = threading.Barrier(4, timeout=2)
+
+    for i in range(4):
+        pool.submit(f"thread-{i}", barrier.wait)
+
+    assert pool.wait_idle(timeout=5)
+    assert not barrier.broken
+    assert pool.in_flight == 0
+    pool.shutdown()
+
+
+def test_weighted_lanes_favor_interactive_without_starving_bulk():
+    pool = ConsumerWorkerPool(1, lanes=[Lane("interactive", weight=3), Lane("bulk", weight=1)])
+    gate = threading.Event()
+    seen = []
+    # Ocupa el único worker mientras se encolan ambos carriles
+    pool.submit(None, gate.wait)
+    time.sleep(0.05)
+    for i in range(8):
+        pool.submit(None, seen.append, f"b{i}", lane="bulk")
+    for i in range(6):
+        pool.submit(None, seen.append, f"i{i}", lane="interactive")
+    gate.set()
+
+    assert pool.wait_idle(timeout=5)
+    # 3 interactivos por cada bulk mientras ambos tienen trabajo
+    assert seen[:8] == ["i0", "i1", "b0", "i2", "i3", "i4", "b1", "i5"]
+    assert pool.stats()["bulk_dispatched"] == 8
+    pool.shutdown()
+
+
+def test_bulk_lane_cap_leaves_workers_for_interactive():
+    pool = ConsumerWorkerPool(2, lanes=[Lane("interactive"), Lane("bulk", max_active=1)])
+    release = threading.Event()
+    started = threading.Event()
+
+    for _ in range(3):
+        pool.submit(None, release.wait, lane="bulk")
+    pool.submit(None, started.set, lane="interactive")
+
+    assert started.wait(timeout=2)
+    assert pool.stats()["bulk_active"] == 1
+    release.set()
+    assert pool.wait_idle(timeout=5)
+    pool.shutdown()
+
+
+def test_aged_bulk_message_jumps_the_weights():
+    pool = ConsumerWorkerPool(1, lanes=[Lane("interactive", weight=100), Lane("bulk", max_wait=0.05)])
+    gate = threading.Event()
+    seen = []
+    pool.submit(None, gate.wait)
+    pool.submit(None, seen.append, "bulk", lane="bulk")
+    time.sleep(0.1)
+    for i in range(5):
+        pool.submit(None, seen.append, f"i{i}", lane="interactive")
+    gate.set()
+
+    assert pool.wait_idle(timeout=5)
+    assert seen[0] == "bulk"
+    assert pool.stats()["bulk_aged"] == 1
+    pool.shutdown()
+
+
+class _Connection:
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+
+class _Channel:
+    is_open = True
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def basic_publish(self, **kwargs):
+        if self.fail:
+            raise RuntimeError("canal caído")
+        self.calls.append("publish")
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self.calls.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.calls.append(("nack", delivery_tag, requeue))
+
+
+def test_publish_and_ack_only_acks_after_a_successful_publish():
+    channel = _Channel()
+    ThreadSafeChannel(_Connection(), channel).publish_and_ack(7, exchange="", routing_key="q", body=b"x")
+    assert channel.calls == ["publish", ("ack", 7)]
+
+    failing = _Channel(fail=True)
+    ThreadSafeChannel(_Connection(), failing).publish_and_ack(8, exchange="", routing_key="q", body=b"x")
+    assert failing.calls == [("nack", 8, True)]
@@ -0,0 +1,159 @@
+"""Sobre versionado de los mensajes entre quiz_service y chatbot_service.
+
+Este archivo está duplicado en ``services/quiz_service/app/envelope.py`` y
+``services/chatbot_service/app/envelope.py`` porque cada servicio se construye
+por separado; ``test_envelope.py`` verifica que ambas copias sean idénticas.
+
+- Versión 2 (header ``x-envelope-version: 2``): structs de msgspec con tag
+  ``type``, serializados como JSON o msgpack según el ``content_type``.
+- Versión 1 (sin header): los dos formatos JSON anteriores (el de thread con
+  ``thread_id``/``content`` y el del quiz con ``question``), que siguen
+  enviando productores externos.
+
+La decodificación valida y construye el struct en una sola pasada, sin dicts
+intermedios.
+"""
+
+import msgspec
+
+ENVELOPE_VERSION = 2
+VERSION_HEADER = "x-envelope-version"
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CONTENT_TYPES = (JSON, MSGPACK)
+
+# Carril de prioridad: las preguntas de threads son interactivas; las que publica quiz_service, bulk
+LANE_HEADER = "x-lane"
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+class EnvelopeError(ValueError):
+    """El cuerpo no corresponde a ninguna versión conocida del sobre."""
+
+
+class QuestionMessage(msgspec.Struct, tag="question", kw_only=True, omit_defaults=True):
+    question_id: str
+    question: str
+    timestamp: float | None = None
+    # Con destino: la respuesta se entrega al thread en vez de publicarse en la cola de respuestas
+    thread_id: str | None = None
+    user_id: str | None = None
+
+    @property
+    def format(self) -> str:
+        return "thread" if self.thread_id and self.user_id else "quiz"
+
+
+class ResponseMessage(msgspec.Struct, tag="response", kw_only=True, omit_defaults=True):
+    question_id: str
+    question: str
+    response: str
+    timestamp: float
+    processed_by: str
+    thread_id: str | None = None
+    user_id: str | None = None
+
+
+Envelope = QuestionMessage | ResponseMessage
+
+
+class _LegacyMessage(msgspec.Struct):
+    """Unión de los campos de los formatos v1; los que no vienen quedan en None"""
+    id: str | int | None = None
+    thread_id: str | int | None = None
+    user_id: str | int | None = None
+    content: str | None = None
+    question_id: str | int | None = None
+    question: str | None = None
+
+
+_ENCODERS = {JSON: msgspec.json.Encoder(), MSGPACK: msgspec.msgpack.Encoder()}
+_DECODERS = {JSON: msgspec.json.Decoder(Envelope), MSGPACK: msgspec.msgpack.Decoder(Envelope)}
+_LEGACY_DECODER = msgspec.json.Decoder(_LegacyMessage)
+
+
+def headers(content_type: str = JSON) -> dict:
+    """Headers AMQP que identifican la versión del sobre"""
+    if content_type not in CONTENT_TYPES:
+        raise EnvelopeError(f"content_type no soportado: {content_type}")
+    return {VERSION_HEADER: ENVELOPE_VERSION}
+
+
+def lane(message_headers: dict | None, default: str = INTERACTIVE) -> str:
+    """Carril del mensaje según su header; sin header (o desconocido), ``default``"""
+    value = (message_headers or {}).get(LANE_HEADER)
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return value if value in LANES else default
+
+
+def encode(message: Envelope, content_type: str = JSON) -> bytes:
+    try:
+        return _ENCODERS[content_type].encode(message)
+    except KeyError:
+        raise EnvelopeError(f"content_type no soportado: {content_type}") from None
+
+
+def _version(message_headers: dict | None) -> int:
+    if not message_headers or VERSION_HEADER not in message_headers:
+        return 1
+    try:
+        return int(message_headers[VERSION_HEADER])
+    except (TypeError, ValueError):
+        raise EnvelopeError(f"{VERSION_HEADER} inválido: {message_headers[VERSION_HEADER]!r}") from None
+
+
+def decode(body: bytes, content_type: str | None = None, message_headers: dict | None = None) -> Envelope:
+    """Decodifica un sobre v2 según su content_type"""
+    version = _version(message_headers)
+    if version != ENVELOPE_VERSION:
+        raise EnvelopeError(f"Versión de sobre no soportada: {version}")
+    decoder = _DECODERS.get(content_type or JSON)
+    if decoder is None:
+        raise EnvelopeError(f"content_type no soportado: {content_type}")
+    try:
+        return decoder.decode(body)
+    except msgspec.DecodeError as exc:
+        raise EnvelopeError(str(exc)) from exc
+
+
+def _decode_legacy(body: bytes) -> tuple[QuestionMessage, str]:
+    try:
+        legacy = _LEGACY_DECODER.decode(body)
+    except msgspec.ValidationError:
+        # JSON válido pero con otra forma: se procesa el texto completo
+        msgspec.json.decode(body)
+        return QuestionMessage(question_id="unknown", question=bytes(body).decode("utf-8", "replace")), "unknown"
+
+    # Formato 1: mensaje de INF326-tarea-2-main (viene el objeto message directamente)
+    if legacy.thread_id is not None and legacy.content is not None:
+        return QuestionMessage(
+            question_id=str(legacy.id if legacy.id is not None else "unknown"),
+            question=legacy.content,
+            thread_id=str(legacy.thread_id),
+            user_id=str(legacy.user_id if legacy.user_id is not None else ""),
+        ), "thread"
+    # Formato 2: mensaje original del quiz_service
+    if legacy.question is not None:
+        return QuestionMessage(
+            question_id=str(legacy.question_id if legacy.question_id is not None else "unknown"),
+            question=legacy.question,
+        ), "quiz"
+    return QuestionMessage(question_id="unknown", question=bytes(body).decode("utf-8", "replace")), "unknown"
+
+
+def decode_question(body: bytes, content_type: str | None = None,
+                    message_headers: dict | None = None) -> tuple[QuestionMessage, str]:
+    """Decodifica una pregunta de cualquier versión. Retorna el mensaje y su formato (thread/quiz/unknown)"""
+    if _version(message_headers) == 1:
+        try:
+            return _decode_legacy(body)
+        except msgspec.DecodeError as exc:
+            raise EnvelopeError(str(exc)) from exc
+
+    message = decode(body, content_type, message_headers)
+    if not isinstance(message, QuestionMessage):
+        raise EnvelopeError(f"Se esperaba una pregunta y llegó {type(message).__name__}")
+    return message, message.format
@@ -3,10 +3,14 @@ import time
 import logging
 import uuid
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
 import random
 import pika
-import json
+
+from . import envelope, metrics, tracing
+from .publisher import BatchInterrupted, PublisherUnavailable, RabbitPublisher
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +34,17 @@ RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
 QUEUE_NAME = os.getenv("QUESTIONS_QUEUE", "quiz_questions")
+# Carril bulk: las preguntas del quiz van a su propia cola para no adelantarse a las de los
+# threads. Vacío publica en QUESTIONS_QUEUE como antes (igual se marcan como bulk). Las que
+# se entregan a un thread van siempre a QUESTIONS_QUEUE: solo esa cola se reparte por thread
+# entre los shards de chatbot_service, que es lo que mantiene el orden dentro del thread
+BULK_QUEUE = os.getenv("BULK_QUESTIONS_QUEUE", f"{QUEUE_NAME}.bulk")
+PUBLISH_QUEUE = BULK_QUEUE or QUEUE_NAME
+PUBLISHER_POOL_SIZE = int(os.getenv("PUBLISHER_POOL_SIZE", "2"))
+PUBLISH_CONFIRM_TIMEOUT = float(os.getenv("PUBLISH_CONFIRM_TIMEOUT", "5"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "5000"))
+# Serialización de los mensajes publicados (application/json o application/msgpack)
+ENVELOPE_CONTENT_TYPE = os.getenv("ENVELOPE_CONTENT_TYPE", envelope.JSON)
 
 
 class QuestionRequest(BaseModel):
@@ -44,78 +59,202 @@ class QuestionResponse(BaseModel):
     question_id: str
 
 
-def get_rabbitmq_connection():
-    """Establece conexión con RabbitMQ con reintentos"""
-    max_retries = 5
-    retry_delay = 5
-    
-    for attempt in range(max_retries):
-        try:
-            credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-            parameters = pika.ConnectionParameters(
-                host=RABBITMQ_HOST,
-                port=RABBITMQ_PORT,
-                credentials=credentials,
-                heartbeat=600,
-                blocked_connection_timeout=300
-            )
-            connection = pika.BlockingConnection(parameters)
-            logger.info(f"Conexión establecida con RabbitMQ en {RABBITMQ_HOST}:{RABBITMQ_PORT}")
-            return connection
-        except Exception as e:
-            logger.warning(f"Intento {attempt + 1}/{max_retries} falló: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                logger.error("No se pudo conectar a RabbitMQ después de varios intentos")
-                raise
+class BatchQuestion(BaseModel):
+    """Pregunta explícita dentro de un lote, con destino opcional"""
+    question: str = Field(min_length=1)
+    thread_id: str | None = None
+    user_id: str | None = None
+
+
+class BatchRequest(BaseModel):
+    """Modelo para publicar un lote: `count` preguntas aleatorias o una lista explícita"""
+    # Acotados antes de armar el lote: un count enorme no llega a reservar memoria
+    count: int | None = Field(default=None, ge=1, le=BATCH_MAX_QUESTIONS)
+    questions: list[BatchQuestion] | None = Field(default=None, max_length=BATCH_MAX_QUESTIONS)
+    # Destino por defecto para las preguntas que no traen uno propio
+    thread_id: str | None = None
+    user_id: str | None = None
+
+
+class BatchResponse(BaseModel):
+    """Modelo de respuesta de un lote"""
+    message: str
+    question_ids: list[str]
+    # Preguntas que el broker rechazó o que no quedaron confirmadas: se pueden reenviar
+    failed_question_ids: list[str] = []
+    published: int
+    elapsed_ms: float
+    messages_per_second: float
+
+
+def get_connection_parameters() -> pika.ConnectionParameters:
+    """Parámetros de conexión a RabbitMQ"""
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    return pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        port=RABBITMQ_PORT,
+        credentials=credentials,
+        heartbeat=600,
+        blocked_connection_timeout=300
+    )
+
+
+publisher = RabbitPublisher(
+    get_connection_parameters(),
+    PUBLISH_QUEUE,
+    pool_size=PUBLISHER_POOL_SIZE,
+    confirm_timeout=PUBLISH_CONFIRM_TIMEOUT,
+)
+metrics.BROKER_CONNECTED.set_function(lambda: int(publisher.connected))
+
+# Trazas: el traceparent viaja en los headers hasta chatbot_service
+tracer = tracing.Tracer.from_env("quiz_service")
 
 
 def publish_question(question: str):
     """Publica una pregunta en la cola de RabbitMQ"""
+    # Generar ID único para la pregunta
+    question_id = str(uuid.uuid4())
+    
+    # Crear mensaje con metadata
+    message = build_question_message(question_id, question)
+    
+    started = time.perf_counter()
+    span = tracer.start_span("quiz.publish", kind="PRODUCER",
+                             attributes={"queue": PUBLISH_QUEUE, "question_id": question_id})
     try:
-        connection = get_rabbitmq_connection()
-        channel = connection.channel()
-        
-        # No necesitamos declarar la cola aquí, ya está en definitions.json
-        # Pero lo hacemos por seguridad (es idempotente)
-        channel.queue_declare(queue=QUEUE_NAME, durable=True, passive=True)
-        
-        # Generar ID único para la pregunta
-        question_id = str(uuid.uuid4())
-        
-        # Crear mensaje con metadata
-        message = json.dumps({
-            "question_id": question_id,
-            "question": question,
-            "timestamp": time.time()
-        })
-        
-        # Publicar el mensaje
-        channel.basic_publish(
-            exchange='',
-            routing_key=QUEUE_NAME,
-            body=message,
-            properties=pika.BasicProperties(
-                delivery_mode=2,  # Hacer el mensaje persistente
-                content_type='application/json'
-            )
+        # Publicar el mensaje en una conexión ya abierta y esperar el confirm del broker
+        publisher.publish(
+            PUBLISH_QUEUE,
+            message,
+            message_properties(span),
         )
-        
-        logger.info(f"Pregunta publicada - ID: {question_id}")
-        connection.close()
-        
-        return question_id
-        
+    except PublisherUnavailable as e:
+        metrics.ERROR_UNAVAILABLE.inc()
+        span.record_error(e)
+        logger.error(f"RabbitMQ no disponible: {e}")
+        raise HTTPException(status_code=503, detail="RabbitMQ no está disponible, intenta nuevamente")
     except Exception as e:
+        metrics.ERROR_PUBLISH.inc()
+        span.record_error(e)
         logger.error(f"Error al publicar mensaje: {e}")
         raise HTTPException(status_code=500, detail=f"Error al publicar pregunta: {str(e)}")
+    finally:
+        span.finish()
+    metrics.PUBLISH_SINGLE.observe(time.perf_counter() - started)
+    metrics.QUESTIONS_PUBLISHED_TOTAL.inc()
+
+    logger.info(f"Pregunta publicada - ID: {question_id}")
+    return question_id
+
+
+def message_properties(span: tracing.Span = None) -> pika.BasicProperties:
+    """Propiedades AMQP de las preguntas: persistentes, con versión y serialización del sobre, carril bulk y traza"""
+    return pika.BasicProperties(
+        delivery_mode=2,  # Hacer el mensaje persistente
+        content_type=ENVELOPE_CONTENT_TYPE,
+        headers=tracer.inject(
+            {**envelope.headers(ENVELOPE_CONTENT_TYPE), envelope.LANE_HEADER: envelope.BULK}, span
+        ),
+    )
+
+
+def build_question_message(question_id: str, question: str, thread_id: str = None, user_id: str = None) -> bytes:
+    """Cuerpo del mensaje; con thread_id y user_id la respuesta se entrega al thread"""
+    message = envelope.QuestionMessage(
+        question_id=question_id,
+        question=question,
+        timestamp=time.time(),
+        thread_id=thread_id if thread_id and user_id else None,
+        user_id=user_id if thread_id and user_id else None,
+    )
+    return envelope.encode(message, ENVELOPE_CONTENT_TYPE)
+
+
+def publish_queue(thread_id: str = None, user_id: str = None) -> str:
+    """Cola de una pregunta: la del thread (con orden por thread) o la del carril bulk"""
+    return QUEUE_NAME if thread_id and user_id else PUBLISH_QUEUE
+
+
+def publish_question_batch(items: list[BatchQuestion]) -> tuple[list[str], list[str], float]:
+    """Publica un lote de preguntas con confirmación del broker por mensaje.
+
+    Retorna los IDs publicados, los que no quedaron encolados y el tiempo en segundos.
+    """
+    question_ids = [str(uuid.uuid4()) for _ in items]
+    bodies = [
+        build_question_message(question_id, item.question, item.thread_id, item.user_id)
+        for question_id, item in zip(question_ids, items)
+    ]
+    queues = [publish_queue(item.thread_id, item.user_id) for item in items]
+
+    started = time.perf_counter()
+    # Un solo span (y traza) para todo el lote: las propiedades se comparten
+    span = tracer.start_span("quiz.publish_batch", kind="PRODUCER",
+                             attributes={"queue": ",".join(sorted(set(queues))), "count": len(bodies)})
+    try:
+        failed = publisher.publish_batch(
+            PUBLISH_QUEUE,
+            bodies,
+            message_properties(span),
+            # Cada mensaje espera su confirm: un lote grande tarda más que un publish individual
+            timeout=PUBLISH_CONFIRM_TIMEOUT + len(bodies) / 1000,
+            routing_keys=queues,
+        )
+    except BatchInterrupted as e:
+        # Parte del lote ya quedó encolada: se informa qué faltó en vez de fallar todo el lote
+        metrics.ERROR_UNAVAILABLE.inc()
+        span.record_error(e)
+        logger.error(f"Conexión perdida a mitad del lote: {e}")
+        failed = e.failed
+    except PublisherUnavailable as e:
+        metrics.ERROR_UNAVAILABLE.inc()
+        span.record_error(e)
+        logger.error(f"RabbitMQ no disponible: {e}")
+        raise HTTPException(status_code=503, detail="RabbitMQ no está disponible, intenta nuevamente")
+    except Exception as e:
+        metrics.ERROR_PUBLISH.inc()
+        span.record_error(e)
+        logger.error(f"Error al publicar lote: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al publicar lote: {str(e)}")
+    finally:
+        span.finish()
+    elapsed = time.perf_counter() - started
+    failed = set(failed)
+    published_ids = [question_id for index, question_id in enumerate(question_ids) if index not in failed]
+    failed_ids = [question_id for index, question_id in enumerate(question_ids) if index in failed]
+    metrics.PUBLISH_BATCH.observe(elapsed)
+    metrics.QUESTIONS_PUBLISHED_TOTAL.inc(len(published_ids))
+    if failed_ids:
+        metrics.ERROR_REJECTED.inc(len(failed_ids))
+        logger.warning(f"Lote con {len(failed_ids)} preguntas sin encolar de {len(bodies)}")
+
+    logger.info(f"Lote publicado - {len(published_ids)} preguntas en {elapsed * 1000:.1f} ms")
+    return published_ids, failed_ids, elapsed
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Abre las conexiones del publisher al iniciar el servicio"""
+    publisher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    publisher.stop()
+    tracer.close()
 
 
 @app.get("/health")
 async def health() -> dict:
     """Health check endpoint"""
-    return {"status": "ok", "service": "quiz_service"}
+    return {"status": "ok", "service": "quiz_service", "broker_connected": publisher.connected}
+
+
+@app.get("/metrics")
+def prometheus_metrics() -> Response:
+    """Métricas en formato Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/questions", response_model=QuestionResponse)
@@ -133,6 +272,8 @@ def get_questions():
             question=selected,
             question_id=question_id
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -152,5 +293,47 @@ def publish_question_endpoint():
             question=selected,
             question_id=question_id
         )
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/questions/batch", response_model=BatchResponse)
+def publish_questions_batch(request: BatchRequest):
+    """
+    Publica un lote de preguntas en una sola operación con confirmación del broker.
+    Acepta `count` (preguntas aleatorias) o una lista explícita en `questions`,
+    opcionalmente dirigidas a un thread/usuario.
+    """
+    if request.questions:
+        items = [
+            BatchQuestion(
+                question=item.question,
+                thread_id=item.thread_id or request.thread_id,
+                user_id=item.user_id or request.user_id,
+            )
+            for item in request.questions
+        ]
+    elif request.count:
+        items = [
+            BatchQuestion(question=random.choice(QUESTIONS), thread_id=request.thread_id, user_id=request.user_id)
+            for _ in range(request.count)
+        ]
+    else:
+        raise HTTPException(status_code=400, detail="Debes indicar `count` o `questions`")
+
+    question_ids, failed_ids, elapsed = publish_question_batch(items)
+    if not question_ids:
+        raise HTTPException(status_code=503, detail="Ninguna pregunta del lote quedó encolada, intenta nuevamente")
+    return BatchResponse(
+        message=(
+            "Lote enviado al servicio de chatbot para procesamiento" if not failed_ids
+            else f"Lote enviado parcialmente: {len(failed_ids)} preguntas no quedaron encoladas"
+        ),
+        question_ids=question_ids,
+        failed_question_ids=failed_ids,
+        published=len(question_ids),
+        elapsed_ms=round(elapsed * 1000, 3),
+        messages_per_second=round(len(question_ids) / elapsed, 1) if elapsed > 0 else 0.0,
+    )
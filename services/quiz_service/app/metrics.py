@@ -0,0 +1,19 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+PUBLISH_SECONDS = Histogram(
+    "quiz_publish_seconds",
+    "Latencia de publicación en RabbitMQ (incluye el confirm del broker)",
+    ["kind"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+PUBLISH_ERRORS_TOTAL = Counter("quiz_publish_errors_total", "Errores al publicar", ["reason"])
+QUESTIONS_PUBLISHED_TOTAL = Counter("quiz_questions_published_total", "Preguntas publicadas")
+BROKER_CONNECTED = Gauge("quiz_broker_connected", "1 si hay al menos una conexión del publisher abierta")
+
+# Hijos con etiquetas ya resueltas para no crearlos en cada publicación
+PUBLISH_SINGLE = PUBLISH_SECONDS.labels("single")
+PUBLISH_BATCH = PUBLISH_SECONDS.labels("batch")
+ERROR_UNAVAILABLE = PUBLISH_ERRORS_TOTAL.labels("unavailable")
+ERROR_PUBLISH = PUBLISH_ERRORS_TOTAL.labels("error")
+# Mensajes de un lote que el broker rechazó (nack) o no pudo enrutar
+ERROR_REJECTED = PUBLISH_ERRORS_TOTAL.labels("rejected")
@@ -0,0 +1,259 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import pika
+from pika.exceptions import AMQPConnectionError, AMQPChannelError, NackError, UnroutableError
+
+logger = logging.getLogger(__name__)
+
+
+class PublisherUnavailable(Exception):
+    """No hay conexión con RabbitMQ; la publicación falla de inmediato."""
+
+
+class PublishTimeout(PublisherUnavailable):
+    """La publicación no se confirmó a tiempo.
+
+    Si aún esperaba en la cola del worker se canceló sin ejecutarse; si ya
+    estaba en curso, no se sabe si llegó al broker.
+    """
+
+
+class BatchInterrupted(PublisherUnavailable):
+    """Se perdió la conexión a mitad de un lote; ``failed`` son las posiciones sin confirmar."""
+
+    def __init__(self, message: str, failed: list[int]):
+        super().__init__(message)
+        self.failed = failed
+
+
+class _PublisherWorker:
+    """Hilo dueño de una conexión y un canal con publisher confirms.
+
+    pika ``BlockingConnection`` no es thread-safe, así que cada conexión vive
+    en su propio hilo y recibe trabajos a través de una cola. El hilo también
+    atiende los heartbeats y reconecta con backoff exponencial.
+    """
+
+    def __init__(self, index: int, parameters: pika.ConnectionParameters, queue_name: str,
+                 max_backoff: float = 30.0):
+        self.index = index
+        self._parameters = parameters
+        self._queue_name = queue_name
+        self._max_backoff = max_backoff
+        self._jobs: queue.Queue[tuple] = queue.Queue()
+        self._connection = None
+        self._channel = None
+        self._stopped = threading.Event()
+        self.connected = threading.Event()
+        # El broker frenó la conexión (memoria o disco): no se le asignan publicaciones
+        self.blocked = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"publisher-{index}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def submit(self, fn) -> Future:
+        """Ejecuta ``fn(channel)`` en el hilo de la conexión"""
+        future = Future()
+        self._jobs.put((fn, future))
+        return future
+
+    def _connect(self) -> None:
+        self._connection = pika.BlockingConnection(self._parameters)
+        self._connection.add_on_connection_blocked_callback(lambda *_: self.blocked.set())
+        self._connection.add_on_connection_unblocked_callback(lambda *_: self.blocked.clear())
+        self._channel = self._connection.channel()
+        # La cola está en definitions.json; passive=True solo verifica que exista
+        self._channel.queue_declare(queue=self._queue_name, durable=True, passive=True)
+        self._channel.confirm_delivery()
+        self.connected.set()
+        logger.info(f"Publisher {self.index} conectado a RabbitMQ")
+
+    def _disconnect(self) -> None:
+        self.connected.clear()
+        self.blocked.clear()
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def _fail_pending(self, error: Exception) -> None:
+        while True:
+            try:
+                _, future = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            future.set_exception(error)
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stopped.is_set():
+            if not self.connected.is_set():
+                try:
+                    self._connect()
+                    backoff = 1.0
+                except Exception as e:
+                    logger.warning(f"Publisher {self.index}: no se pudo conectar a RabbitMQ: {e}")
+                    self._disconnect()
+                    self._fail_pending(PublisherUnavailable(str(e)))
+                    self._stopped.wait(backoff)
+                    backoff = min(backoff * 2, self._max_backoff)
+                    continue
+
+            try:
+                fn, future = self._jobs.get(timeout=1.0)
+            except queue.Empty:
+                # Atender heartbeats mientras no hay publicaciones
+                try:
+                    self._connection.process_data_events(time_limit=0)
+                except Exception as e:
+                    logger.warning(f"Publisher {self.index}: conexión perdida: {e}")
+                    self._disconnect()
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(self._channel))
+            except BatchInterrupted as e:
+                logger.warning(f"Publisher {self.index}: conexión perdida: {e}")
+                future.set_exception(e)
+                self._disconnect()
+            except (AMQPConnectionError, AMQPChannelError) as e:
+                logger.warning(f"Publisher {self.index}: conexión perdida: {e}")
+                future.set_exception(PublisherUnavailable(str(e)))
+                self._disconnect()
+            except Exception as e:
+                future.set_exception(e)
+
+        self._disconnect()
+        self._fail_pending(PublisherUnavailable("Publisher detenido"))
+
+
+class RabbitPublisher:
+    """Publisher de larga vida: un pool de conexiones/canales con confirms.
+
+    Se crea al iniciar el servicio y reconecta en segundo plano. Si no hay
+    ninguna conexión disponible (o todas están frenadas por el broker),
+    ``publish`` lanza ``PublisherUnavailable`` de inmediato en lugar de
+    bloquear la petición.
+    """
+
+    def __init__(self, parameters: pika.ConnectionParameters, queue_name: str,
+                 pool_size: int = 2, confirm_timeout: float = 5.0):
+        self.confirm_timeout = confirm_timeout
+        self._workers = [_PublisherWorker(i, parameters, queue_name) for i in range(pool_size)]
+        self._round_robin = itertools.cycle(self._workers)
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self) -> None:
+        for worker in self._workers:
+            worker.stop()
+
+    @property
+    def connected(self) -> bool:
+        return any(worker.connected.is_set() for worker in self._workers)
+
+    def _pick_worker(self) -> _PublisherWorker:
+        with self._lock:
+            for _ in range(len(self._workers)):
+                worker = next(self._round_robin)
+                if worker.connected.is_set() and not worker.blocked.is_set():
+                    return worker
+        raise PublisherUnavailable("No hay conexión disponible con RabbitMQ")
+
+    def run(self, fn, timeout: float = None):
+        """Ejecuta ``fn(channel)`` en una conexión disponible y espera el resultado.
+
+        Si se vence ``timeout`` antes de que el worker tome el trabajo, se cancela
+        y falla con ``PublishTimeout`` (no se publicó nada). Si ya está en curso se
+        espera su confirm a lo sumo ``confirm_timeout`` segundos más y después
+        también falla con ``PublishTimeout``: la petición no queda colgada de un
+        broker que frenó la conexión o de una reconexión.
+        """
+        self.start()
+        timeout = timeout or self.confirm_timeout
+        future = self._pick_worker().submit(fn)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise PublishTimeout(f"La publicación no se ejecutó en {timeout:.1f}s")
+        logger.warning(f"Publicación en curso tras {timeout:.1f}s, esperando el confirm del broker")
+        try:
+            return future.result(timeout=self.confirm_timeout)
+        except FutureTimeoutError:
+            raise PublishTimeout(
+                f"Sin confirm del broker tras {timeout + self.confirm_timeout:.1f}s; la publicación pudo haber llegado"
+            ) from None
+
+    def publish(self, routing_key: str, body: bytes | str, properties: pika.BasicProperties,
+                exchange: str = "") -> None:
+        """Publica un mensaje y espera la confirmación del broker"""
+        started = time.perf_counter()
+
+        def _publish(channel):
+            # Con confirm_delivery, basic_publish lanza NackError/UnroutableError si el broker lo rechaza
+            channel.basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties,
+                mandatory=True,
+            )
+
+        self.run(_publish)
+        logger.debug(f"Publicación confirmada en {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    def publish_batch(self, routing_key: str, bodies: list, properties: pika.BasicProperties,
+                      exchange: str = "", timeout: float = None, routing_keys: list[str] = None) -> list[int]:
+        """Publica un lote con publisher confirms y ``mandatory``; retorna las posiciones rechazadas.
+
+        ``routing_keys``, si se pasa, indica la routing key de cada mensaje en
+        lugar de ``routing_key``. Un mensaje que el broker rechaza (nack) o no
+        puede enrutar se informa como fallido y el lote sigue. Si se cae la
+        conexión a mitad de camino, ``BatchInterrupted`` indica qué posiciones
+        quedaron sin confirmar.
+        """
+        keys = routing_keys or [routing_key] * len(bodies)
+
+        def _publish_batch(channel):
+            failed = []
+            for index, (key, body) in enumerate(zip(keys, bodies)):
+                try:
+                    channel.basic_publish(
+                        exchange=exchange,
+                        routing_key=key,
+                        body=body,
+                        properties=properties,
+                        mandatory=True,
+                    )
+                except (NackError, UnroutableError) as e:
+                    logger.warning(f"Mensaje {index} del lote rechazado por el broker: {e}")
+                    failed.append(index)
+                except (AMQPConnectionError, AMQPChannelError) as e:
+                    raise BatchInterrupted(str(e), failed + list(range(index, len(bodies)))) from e
+            return failed
+
+        return self.run(_publish_batch, timeout=timeout)
@@ -0,0 +1,360 @@
+"""Trazas distribuidas entre quiz_service, RabbitMQ y chatbot_service.
+
+Este archivo está duplicado en ``services/quiz_service/app/tracing.py`` y
+``services/chatbot_service/app/tracing.py`` (como ``envelope.py``);
+``test_tracing.py`` verifica que ambas copias sean idénticas.
+
+- El contexto viaja en el header ``traceparent`` (W3C Trace Context) de los
+  mensajes AMQP y de las peticiones HTTP; ``x-published-at`` marca el momento
+  de la última publicación para medir la espera en cola.
+- Muestreo en la cabecera (head-based): quien inicia la traza decide con
+  probabilidad ``sample_rate`` y la decisión viaja en el flag del
+  ``traceparent``. Los mensajes no muestreados solo propagan el contexto; no
+  se crean ni exportan spans.
+- Los spans se exportan en formato Zipkin v2 (lo aceptan Zipkin, Jaeger, Tempo
+  y el OpenTelemetry Collector) a un archivo JSONL o a un colector por HTTP,
+  desde un hilo en segundo plano con buffer acotado: si el colector no da
+  abasto se descartan spans, nunca se bloquea el procesamiento.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+PUBLISHED_AT_HEADER = "x-published-at"
+
+_ZIPKIN_KINDS = {"CLIENT", "SERVER", "PRODUCER", "CONSUMER"}
+
+
+class SpanContext:
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def parse_traceparent(value) -> SpanContext | None:
+    """Contexto de un header ``traceparent``; None si falta o es inválido"""
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    if not isinstance(value, str) or len(value) < 55:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    trace_id, span_id, flags = parts[1], parts[2], parts[3]
+    if len(trace_id) != 32 or len(span_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        if int(trace_id, 16) == 0 or int(span_id, 16) == 0:
+            return None
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    return SpanContext(trace_id.lower(), span_id.lower(), sampled)
+
+
+def extract(headers: dict | None) -> SpanContext | None:
+    return parse_traceparent((headers or {}).get(TRACEPARENT_HEADER))
+
+
+def published_at(properties) -> float | None:
+    """Momento (epoch) de la última publicación: header ``x-published-at`` o timestamp AMQP"""
+    value = (properties.headers or {}).get(PUBLISHED_AT_HEADER)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if properties.timestamp:
+        return float(properties.timestamp)
+    return None
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """Una operación con nombre, duración y atributos.
+
+    Con ``recording`` en False solo lleva el contexto (para propagarlo) y el
+    resto de los métodos no hace nada.
+    """
+
+    __slots__ = ("tracer", "name", "context", "parent_id", "kind", "start", "end", "attributes",
+                 "recording", "_token")
+
+    def __init__(self, tracer, name: str, context: SpanContext, parent_id: str | None = None,
+                 kind: str = "INTERNAL", start: float = None, attributes: dict = None, recording: bool = True):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start = start if start is not None else time.time()
+        self.end = None
+        self.attributes = dict(attributes or {}) if recording else None
+        self.recording = recording
+        self._token = None
+
+    def set(self, key: str, value) -> None:
+        if self.recording and value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, exc: BaseException) -> None:
+        if self.recording:
+            self.attributes["error"] = f"{type(exc).__name__}: {exc}"[:500]
+
+    def traceparent(self) -> str | None:
+        return self.context.traceparent() if self.context is not None else None
+
+    def finish(self, end: float = None) -> None:
+        if not self.recording or self.end is not None:
+            return
+        self.end = end if end is not None else time.time()
+        self.tracer.export(self)
+
+    def to_zipkin(self) -> dict:
+        span = {
+            "traceId": self.context.trace_id,
+            "id": self.context.span_id,
+            "name": self.name,
+            "timestamp": int(self.start * 1_000_000),
+            "duration": max(int((self.end - self.start) * 1_000_000), 1),
+            "localEndpoint": {"serviceName": self.tracer.service},
+            "tags": {key: str(value) for key, value in self.attributes.items()},
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        if self.kind in _ZIPKIN_KINDS:
+            span["kind"] = self.kind
+        return span
+
+    def __enter__(self):
+        # NOOP_SPAN se comparte entre hilos: no se activa
+        if self.context is not None:
+            self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.record_error(exc)
+        self.finish()
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        return False
+
+
+# Span sin contexto ni registro, para las operaciones fuera de una traza muestreada
+NOOP_SPAN = Span(None, "noop", None, recording=False)
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+def current_traceparent() -> str | None:
+    span = _current.get()
+    return span.traceparent() if span is not None else None
+
+
+def activate(span: Span):
+    """Hace de ``span`` el span actual del hilo; retorna el token para ``deactivate``"""
+    return _current.set(span)
+
+
+def deactivate(token) -> None:
+    _current.reset(token)
+
+
+class SpanExporter:
+    """Envía spans a ``sink(lista de spans Zipkin)`` en lotes desde un hilo en segundo plano"""
+
+    def __init__(self, sink, max_queue: int = 4096, batch_size: int = 256, interval: float = 1.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, span: dict) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="span-exporter")
+                self._thread.start()
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send(self, batch: list) -> None:
+        try:
+            self.sink(batch)
+            self.exported += len(batch)
+        except Exception as exc:
+            self.failed += len(batch)
+            logger.warning(f"No se pudieron exportar {len(batch)} spans: {exc}")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._stopped.wait(self.interval)
+            batch = self._drain()
+            while batch:
+                self._send(batch)
+                batch = self._drain()
+
+    def flush(self) -> None:
+        batch = self._drain()
+        while batch:
+            self._send(batch)
+            batch = self._drain()
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+def file_sink(path: str):
+    """Agrega cada span como una línea JSON (formato Zipkin v2)"""
+    lock = threading.Lock()
+
+    def write(batch: list) -> None:
+        lines = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in batch)
+        with lock, open(path, "a", encoding="utf-8") as handle:
+            handle.write(lines)
+
+    return write
+
+
+def zipkin_sink(url: str, timeout: float = 5.0):
+    """POST del lote a un colector Zipkin v2 (p. ej. http://localhost:9411/api/v2/spans)"""
+
+    def post(batch: list) -> None:
+        request = urllib.request.Request(
+            url, data=json.dumps(batch).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+
+    return post
+
+
+class Tracer:
+    """Crea spans con muestreo en la cabecera y los entrega al exportador.
+
+    Sin exportador no se registra nada, pero el contexto se sigue propagando.
+    """
+
+    def __init__(self, service: str, sample_rate: float = 0.0, exporter: SpanExporter = None):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.started = 0
+        self.sampled_roots = 0
+
+    @classmethod
+    def from_env(cls, service: str) -> "Tracer":
+        """``TRACE_EXPORTER``: none, file (``TRACE_FILE``) o zipkin (``TRACE_ZIPKIN_URL``)"""
+        kind = os.getenv("TRACE_EXPORTER", "none").lower()
+        exporter = None
+        if kind == "file":
+            exporter = SpanExporter(file_sink(os.getenv("TRACE_FILE", f"/tmp/{service}-spans.jsonl")))
+        elif kind == "zipkin":
+            exporter = SpanExporter(zipkin_sink(os.getenv("TRACE_ZIPKIN_URL", "http://localhost:9411/api/v2/spans")))
+        return cls(service, float(os.getenv("TRACE_SAMPLE_RATE", "0.01")), exporter)
+
+    def start_span(self, name: str, parent: SpanContext = None, kind: str = "INTERNAL",
+                   start: float = None, attributes: dict = None) -> Span:
+        """Span hijo de ``parent`` (o del span actual); sin ninguno, inicia una traza nueva"""
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+        if parent is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+            if sampled:
+                self.sampled_roots += 1
+            trace_id, parent_id = _new_id(128), None
+        else:
+            sampled, trace_id, parent_id = parent.sampled, parent.trace_id, parent.span_id
+        recording = sampled and self.exporter is not None
+        if not recording:
+            # Propagar el contexto sin registrar: se reutiliza el id del padre
+            return Span(self, name, SpanContext(trace_id, parent_id or _new_id(64), sampled), recording=False)
+        self.started += 1
+        return Span(self, name, SpanContext(trace_id, _new_id(64), True), parent_id, kind, start, attributes)
+
+    def child_span(self, name: str, kind: str = "INTERNAL", **attributes) -> Span:
+        """Span hijo del actual solo si este se está registrando (no inicia trazas)"""
+        current = _current.get()
+        if current is None or not current.recording:
+            return NOOP_SPAN
+        return self.start_span(name, current.context, kind, attributes=attributes)
+
+    def inject(self, headers: dict, span: Span = None) -> dict:
+        """Agrega ``traceparent`` (del span dado o el actual) y ``x-published-at`` a los headers"""
+        span = span if span is not None else _current.get()
+        if span is not None and span.context is not None:
+            headers[TRACEPARENT_HEADER] = span.context.traceparent()
+        headers[PUBLISHED_AT_HEADER] = time.time()
+        return headers
+
+    def export(self, span: Span) -> None:
+        if self.exporter is not None:
+            self.exporter.submit(span.to_zipkin())
+
+    def close(self) -> None:
+        if self.exporter is not None:
+            self.exporter.close()
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "exporting": self.exporter is not None,
+            "spans": self.started,
+            "sampled_roots": self.sampled_roots,
+            **(self.exporter.stats() if self.exporter is not None else {}),
+        }
@@ -0,0 +1,5 @@
+import sys
+import os
+
+# Agregar el directorio actual al PYTHONPATH
+sys.path.append(os.path.dirname(__file__))
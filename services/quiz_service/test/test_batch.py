@@ -0,0 +1,67 @@
+from fastapi.testclient import TestClient
+
+from app import main
+from app.publisher import BatchInterrupted
+
+client = TestClient(main.app)
+
+
+class FakePublisher:
+    def __init__(self, failed=(), error=None):
+        self.failed = list(failed)
+        self.error = error
+        self.batches = []
+
+    def publish_batch(self, routing_key, bodies, properties, exchange="", timeout=None, routing_keys=None):
+        self.batches.append(list(zip(routing_keys, bodies)))
+        if self.error is not None:
+            raise self.error
+        return self.failed
+
+
+def test_count_is_bounded_before_building_the_batch(monkeypatch):
+    fake = FakePublisher()
+    monkeypatch.setattr(main, "publisher", fake)
+
+    response = client.post("/questions/batch", json={"count": main.BATCH_MAX_QUESTIONS + 1})
+
+    assert response.status_code == 422
+    assert fake.batches == []
+
+
+def test_batch_goes_to_the_bulk_lane_and_thread_questions_to_the_questions_queue(monkeypatch):
+    fake = FakePublisher()
+    monkeypatch.setattr(main, "publisher", fake)
+
+    response = client.post("/questions/batch", json={"questions": [
+        {"question": "¿Qué es una API?"},
+        {"question": "¿Y un proceso?", "thread_id": "t1", "user_id": "u1"},
+    ]})
+
+    assert response.status_code == 200
+    assert response.json()["published"] == 2
+    assert [queue for queue, _ in fake.batches[0]] == [main.PUBLISH_QUEUE, main.QUEUE_NAME]
+
+
+def test_rejected_questions_are_reported(monkeypatch):
+    monkeypatch.setattr(main, "publisher", FakePublisher(failed=[1]))
+
+    response = client.post("/questions/batch", json={"count": 3})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert body["published"] == 2 and len(body["question_ids"]) == 2
+    assert len(body["failed_question_ids"]) == 1
+    assert body["failed_question_ids"][0] not in body["question_ids"]
+
+
+def test_lost_connection_reports_the_part_that_was_queued(monkeypatch):
+    monkeypatch.setattr(main, "publisher", FakePublisher(error=BatchInterrupted("EOF", failed=[2, 3])))
+
+    response = client.post("/questions/batch", json={"count": 4})
+
+    assert response.status_code == 200
+    assert response.json()["published"] == 2
+
+    monkeypatch.setattr(main, "publisher", FakePublisher(error=BatchInterrupted("EOF", failed=[0, 1])))
+    assert client.post("/questions/batch", json={"count": 2}).status_code == 503
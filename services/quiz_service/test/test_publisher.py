@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pika
+import pytest
+from pika.exceptions import AMQPConnectionError, StreamLostError, UnroutableError
+
+from app import publisher as publisher_module
+from app.publisher import BatchInterrupted, PublisherUnavailable, PublishTimeout, RabbitPublisher
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.published = []
+
+    def queue_declare(self, queue, durable=True, passive=False):
+        return None
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        if self.connection.lose_after is not None and len(self.published) >= self.connection.lose_after:
+            raise StreamLostError("Transport indicated EOF")
+        if mandatory and routing_key in self.connection.unroutable:
+            raise UnroutableError([])
+        self.published.append((routing_key, body))
+
+
+class FakeConnection:
+    def __init__(self, unroutable=(), lose_after=None):
+        self.unroutable = set(unroutable)
+        self.lose_after = lose_after
+        self.is_open = True
+        self.channels = []
+        self.on_blocked = []
+        self.on_unblocked = []
+
+    def add_on_connection_blocked_callback(self, callback):
+        self.on_blocked.append(callback)
+
+    def add_on_connection_unblocked_callback(self, callback):
+        self.on_unblocked.append(callback)
+
+    def channel(self):
+        channel = FakeChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+@pytest.fixture
+def connect(monkeypatch):
+    connections = []
+
+    def use(**options):
+        def factory(parameters):
+            connection = FakeConnection(**options)
+            connections.append(connection)
+            return connection
+
+        monkeypatch.setattr(publisher_module.pika, "BlockingConnection", factory)
+        return connections
+
+    return use
+
+
+def started(pool_size=1, **options) -> RabbitPublisher:
+    publisher = RabbitPublisher(pika.ConnectionParameters(), "quiz_questions", pool_size=pool_size, **options)
+    publisher.start()
+    for worker in publisher._workers:
+        assert worker.connected.wait(2)
+    return publisher
+
+
+def test_batch_reports_unroutable_messages_and_publishes_the_rest(connect):
+    connections = connect(unroutable={"sin_cola"})
+    publisher = started()
+
+    failed = publisher.publish_batch("quiz_questions", [b"a", b"b", b"c"], pika.BasicProperties(),
+                                     routing_keys=["quiz_questions", "sin_cola", "quiz_questions"])
+    publisher.stop()
+
+    assert failed == [1]
+    assert connections[0].channels[0].published == [("quiz_questions", b"a"), ("quiz_questions", b"c")]
+
+
+def test_batch_interrupted_by_a_lost_connection_reports_what_is_missing(connect):
+    connect(lose_after=2)
+    publisher = started()
+
+    with pytest.raises(BatchInterrupted) as exc:
+        publisher.publish_batch("quiz_questions", [b"a", b"b", b"c", b"d"], pika.BasicProperties())
+    publisher.stop()
+
+    assert exc.value.failed == [2, 3]
+
+
+def test_publish_fails_fast_without_a_connection(monkeypatch):
+    def refuse(parameters):
+        raise AMQPConnectionError("Connection refused")
+
+    monkeypatch.setattr(publisher_module.pika, "BlockingConnection", refuse)
+    publisher = RabbitPublisher(pika.ConnectionParameters(), "quiz_questions", pool_size=1)
+
+    started_at = time.perf_counter()
+    with pytest.raises(PublisherUnavailable):
+        publisher.publish("quiz_questions", b"hola", pika.BasicProperties())
+    publisher.stop()
+
+    assert time.perf_counter() - started_at < 1
+
+
+def test_queued_publish_is_cancelled_at_the_timeout(connect):
+    connect()
+    publisher = started(confirm_timeout=0.05)
+    release = threading.Event()
+    ran = []
+
+    busy = threading.Thread(target=lambda: publisher.run(lambda channel: release.wait(2), timeout=2))
+    busy.start()
+    time.sleep(0.05)
+    with pytest.raises(PublishTimeout):
+        publisher.run(lambda channel: ran.append(1))
+    release.set()
+    busy.join()
+    publisher.stop()
+
+    # Se canceló antes de ejecutarse: no se publicó
+    assert ran == []
+
+
+def test_wait_for_a_publish_in_progress_is_bounded(connect):
+    connect()
+    publisher = started(confirm_timeout=0.1)
+    release = threading.Event()
+
+    started_at = time.perf_counter()
+    with pytest.raises(PublishTimeout):
+        publisher.run(lambda channel: release.wait(5))
+    elapsed = time.perf_counter() - started_at
+    release.set()
+    publisher.stop()
+
+    assert elapsed < 1
+
+
+def test_blocked_connection_is_skipped(connect):
+    connections = connect()
+    publisher = started()
+
+    for callback in connections[0].on_blocked:
+        callback(None, None)
+    with pytest.raises(PublisherUnavailable):
+        publisher.publish("quiz_questions", b"hola", pika.BasicProperties())
+
+    for callback in connections[0].on_unblocked:
+        callback(None, None)
+    publisher.publish("quiz_questions", b"hola", pika.BasicProperties())
+    publisher.stop()
+
+    assert connections[0].channels[0].published == [("quiz_questions", b"hola")]
+
+
+def test_reconnects_after_losing_the_connection(connect):
+    connections = connect(lose_after=0)
+    publisher = started()
+
+    with pytest.raises(PublisherUnavailable):
+        publisher.publish("quiz_questions", b"hola", pika.BasicProperties())
+    # El worker reconecta en segundo plano con una conexión nueva
+    deadline = time.monotonic() + 3
+    while len(connections) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    connections[1].lose_after = None
+    assert publisher._workers[0].connected.wait(2)
+    publisher.publish("quiz_questions", b"hola", pika.BasicProperties())
+    publisher.stop()
+
+    assert connections[1].channels[0].published == [("quiz_questions", b"hola")]